@@ -0,0 +1,82 @@
+"""
+    Bencode benchmark on synthetic multi-MB torrents.
+    Run from the repository root: python -m benchmarks.bencode_bench
+"""
+import argparse
+import hashlib
+import os
+import random
+import time
+
+from src.torrent import bencode
+
+
+def synthetic_torrent(pieces: int, files: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    info = {
+        b"name": b"synthetic",
+        b"piece length": 262144,
+        b"pieces": os.urandom(20 * pieces),
+    }
+    if files:
+        info[b"files"] = [
+            {
+                b"length": rng.randrange(1, 1 << 30),
+                b"path": [b"dir%d" % (i % 97), b"file-%08d.bin" % i],
+            }
+            for i in range(files)
+        ]
+    else:
+        info[b"length"] = pieces * 262144
+    return bencode.encode({
+        b"announce": b"http://tracker.example/announce",
+        b"announce-list": [[b"http://tracker.example/announce"], [b"udp://tracker.example:80"]],
+        b"creation date": 1700000000,
+        b"info": info,
+    })
+
+
+def best_of(repeat: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(pieces: int, files: int, repeat: int) -> None:
+    contents = synthetic_torrent(pieces, files)
+    decoded = bencode.decode(contents)
+    size = len(contents) / 1e6
+
+    def info_hash():
+        spans = {}
+        bencode.decode(contents, spans, span_depth=1)
+        start, end = spans[(b"info",)]
+        hashlib.sha1(contents[start:end]).digest()
+
+    results = {
+        "decode": best_of(repeat, lambda: bencode.decode(contents)),
+        "decode+spans": best_of(repeat, info_hash),
+        "encode": best_of(repeat, lambda: bencode.encode(decoded)),
+    }
+    print(f"{pieces} pieces, {files} files, {size:.1f}MB")
+    for name, seconds in results.items():
+        print(f"  {name:<14}{seconds * 1000:9.1f}ms {size / seconds:9.1f}MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pieces", type=int, nargs="*", default=[10_000, 200_000])
+    parser.add_argument("--files", type=int, nargs="*", default=[0, 1_000, 50_000])
+    args = parser.parse_args()
+
+    for pieces in args.pieces:
+        for files in args.files:
+            run(pieces, files, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+    End-to-end download benchmark against a local swarm.
+    Starts a stand-in HTTP tracker and N seeders on localhost, runs the
+    real client in a separate process and reports its throughput, CPU
+    time and peak RSS.
+    Run from the repository root: python -m benchmarks.swarm
+"""
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import statistics
+import struct
+import tempfile
+import time
+
+from src.torrent import bencode
+from src.torrent.metainfo import tracker_payload
+
+PSTR = b"\x13BitTorrent protocol"
+
+
+def synthetic_torrent(size: int, piece_length: int, announce: str, seed: int = 0) -> tuple[bytes, dict]:
+    data = random.Random(seed).randbytes(size)
+    pieces = b"".join(
+        hashlib.sha1(data[i:i + piece_length]).digest() for i in range(0, size, piece_length)
+    )
+    decoded = {
+        b"announce": announce.encode(),
+        b"info": {
+            b"name": b"swarm.bin",
+            b"length": size,
+            b"piece length": piece_length,
+            b"pieces": pieces,
+        },
+    }
+    return data, decoded
+
+
+class Seeder:
+    """A peer with the whole torrent that answers requests after a delay.
+
+    latency is added to every request, bandwidth (bytes per second, 0
+    for unlimited) is shared by all of its connections, and corrupt is
+    the probability of flipping a byte in a served block.
+    """
+
+    def __init__(self, data: bytes, info_hash: bytes, piece_length: int,
+                 latency: float = 0.0, bandwidth: float = 0, corrupt: float = 0.0):
+        self.data = data
+        self.info_hash = info_hash
+        self.piece_length = piece_length
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.corrupt = corrupt
+        self.rng = random.Random()
+        self.next_free = 0.0
+        self.served = 0
+        self.corrupted = 0
+
+        pieces = (len(data) + piece_length - 1) // piece_length
+        bits = bytearray((pieces + 7) // 8)
+        for i in range(pieces):
+            bits[i // 8] |= 0x80 >> (i % 8)
+        self.bitfield = struct.pack("!IB", 1 + len(bits), 5) + bits
+        self.peer_id = b"-SW0001-" + bytes(self.rng.randrange(48, 58) for _ in range(12))
+
+    async def start(self) -> int:
+        server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        queue = asyncio.Queue()
+        sender = None
+        try:
+            handshake = await reader.readexactly(68)
+            if handshake[28:48] != self.info_hash:
+                return
+            writer.write(PSTR + bytes(8) + self.info_hash + self.peer_id + self.bitfield)
+            sender = asyncio.create_task(self.send(writer, queue))
+            loop = asyncio.get_running_loop()
+            while True:
+                length = struct.unpack("!I", await reader.readexactly(4))[0]
+                if not length:
+                    continue
+                message = await reader.readexactly(length)
+                if message[0] == 2:         # interested
+                    queue.put_nowait((0.0, None))
+                elif message[0] == 6:       # request
+                    queue.put_nowait((loop.time() + self.latency, struct.unpack("!III", message[1:13])))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if sender is not None:
+                sender.cancel()
+            writer.close()
+
+    async def send(self, writer: asyncio.StreamWriter, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            due, request = await queue.get()
+            if request is None:
+                writer.write(struct.pack("!IB", 1, 1))      # unchoke
+                continue
+            index, begin, length = request
+            offset = index * self.piece_length + begin
+            block = self.data[offset:offset + length]
+            if self.corrupt and self.rng.random() < self.corrupt:
+                flipped = bytearray(block)
+                flipped[self.rng.randrange(len(flipped))] ^= 0xFF
+                block = bytes(flipped)
+                self.corrupted += 1
+
+            ready = due
+            if self.bandwidth:
+                ready = max(due, self.next_free)
+                self.next_free = max(ready, loop.time()) + length / self.bandwidth
+            if ready > loop.time():
+                await asyncio.sleep(ready - loop.time())
+
+            writer.write(struct.pack("!IBII", 9 + length, 7, index, begin) + block)
+            await writer.drain()
+            self.served += length
+
+
+async def start_tracker(ports: list[int]) -> int:
+    """An HTTP tracker stand-in that hands every client all the seeders."""
+    body = bencode.encode({
+        b"interval": 1800,
+        b"complete": len(ports),
+        b"incomplete": 1,
+        b"peers": [{b"ip": b"127.0.0.1", b"port": port} for port in ports],
+    })
+    response = b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server.sockets[0].getsockname()[1]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_client(decoded: dict, payload: dict, workdir: str, options: dict, results) -> None:
+    """Runs in the child process, so its CPU time and RSS are the client's alone."""
+    os.chdir(workdir)
+    from src.client.session import contact_peer
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    contact_peer(decoded, payload, **options)
+    elapsed = time.perf_counter() - start
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN)       # process hash pool
+    results.send({
+        "seconds": elapsed,
+        "cpu": (own.ru_utime - before.ru_utime) + (own.ru_stime - before.ru_stime)
+        + workers.ru_utime + workers.ru_stime,
+        "rss": own.ru_maxrss * 1024,        # kilobytes on Linux
+    })
+
+
+async def bench(args) -> None:
+    size = int(args.size * 1024 * 1024)
+    piece_length = args.piece_length * 1024
+    data, decoded = synthetic_torrent(size, piece_length, "")
+    info_hash = hashlib.sha1(bencode.encode(decoded[b"info"])).digest()
+
+    seeders = [
+        Seeder(data, info_hash, piece_length, args.latency / 1000,
+               args.bandwidth * 1024 * 1024, args.corrupt)
+        for _ in range(args.seeders)
+    ]
+    ports = [await seeder.start() for seeder in seeders]
+    tracker = await start_tracker(ports)
+    decoded[b"announce"] = f"http://127.0.0.1:{tracker}/announce".encode()
+
+    options = {"storage_backend": args.backend, "hash_pool": args.hash_pool, "dht": False}
+    context = multiprocessing.get_context("spawn")
+    loop = asyncio.get_running_loop()
+    print(
+        f"{args.size:g}MB, {args.piece_length}KiB pieces, {args.seeders} seeders, "
+        f"{args.latency:g}ms latency, "
+        f"{f'{args.bandwidth:g}MB/s' if args.bandwidth else 'unlimited'} each, "
+        f"{args.corrupt:.1%} corrupt blocks, {args.backend}/{args.hash_pool}"
+    )
+
+    runs = []
+    for attempt in range(args.repeat):
+        payload = tracker_payload(info_hash.hex())
+        payload["left"] = size
+        payload["port"] = free_port()
+        with tempfile.TemporaryDirectory(prefix="fluxo-swarm-") as workdir:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=run_client, args=(decoded, payload, workdir, options, sender))
+            process.start()
+            sender.close()
+            await loop.run_in_executor(None, process.join)
+            if process.exitcode or not receiver.poll():
+                raise SystemExit(f"client exited with {process.exitcode}")
+            result = receiver.recv()
+
+            with open(os.path.join(workdir, "swarm.bin"), "rb") as file:
+                if hashlib.sha1(file.read()).digest() != hashlib.sha1(data).digest():
+                    raise SystemExit("downloaded file doesn't match")
+        runs.append(result)
+        print(
+            f"  run {attempt + 1}: {result['seconds']:7.2f}s {size / result['seconds'] / 1e6:8.1f}MB/s "
+            f"cpu {result['cpu']:6.2f}s rss {result['rss'] / 1e6:7.1f}MB"
+        )
+
+    median = statistics.median(run["seconds"] for run in runs)
+    print(
+        f"  median {median:.2f}s {size / median / 1e6:.1f}MB/s, "
+        f"{sum(s.served for s in seeders) / 1e6:.1f}MB served, "
+        f"{sum(s.corrupted for s in seeders)} corrupted blocks"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=float, default=128, help="torrent size in MB")
+    parser.add_argument("--piece-length", type=int, default=256, help="piece length in KiB")
+    parser.add_argument("--seeders", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0, help="per request, in ms")
+    parser.add_argument("--bandwidth", type=float, default=0, help="per seeder in MB/s, 0 for unlimited")
+    parser.add_argument("--corrupt", type=float, default=0, help="probability of a corrupted block")
+    parser.add_argument("--backend", default="pwrite", choices=("pwrite", "mmap"))
+    parser.add_argument("--hash-pool", default="thread", choices=("thread", "process"))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault("FLUXO_LOG_LEVEL", "WARNING")     # read by the client process
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
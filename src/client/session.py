@@ -0,0 +1,411 @@
+import asyncio
+import functools
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.dht.node import CACHE_PATH, DhtNode
+from src.metrics import client as metrics, exporter
+from src.metrics.log import log
+from src.peer.bandwidth import TokenBucket
+from src.peer.choker import Choker
+from src.peer.connections import (
+    bootstrap_nodes, build_handshake, close_writer, handle_peer, listen, save_resume_loop,
+)
+from src.peer.manager import ConnectionManager, PeerStats
+from src.peer.pex import PeerExchange
+from src.peer.webseed import WebSeed, web_seeds
+from src.peer.wire import WireProtocol
+from src.torrent import resume
+from src.torrent.budget import Budget
+from src.torrent.cache import PieceCache
+from src.torrent.download import Download, build_download
+from src.torrent.storage import StorageWriter, open_storage
+from src.torrent.stream import Stream
+from src.torrent.verify import PieceVerifier
+from src.tracker.announce import Announcer
+from src.tracker.http import HttpClient
+from src.tracker.udp import UdpClient
+
+
+@dataclass
+class Limits:
+    """Caps shared by every torrent of a session."""
+    connections: int = 200                          # open peer connections, both directions
+    requests: int = 4096                            # block requests in flight
+    buffer_bytes: int = 256 * 1024 * 1024           # in-progress piece buffers
+    disk_queue_bytes: int = 64 * 1024 * 1024        # verified pieces waiting for the disk
+    peers_per_torrent: int = 30
+    web_seed_streams: int = 4                       # concurrent range requests per HTTP mirror
+    # bytes per second, 0 for unlimited
+    upload_rate: float = 0
+    download_rate: float = 0
+    peer_upload_rate: float = 0
+    peer_download_rate: float = 0
+
+
+class Torrent:
+    """One torrent of a session: its download and everything that feeds it.
+
+    While running it has its own trackers, connection manager, choker,
+    Peer Exchange and web seeds; storage is opened on every start and closed,
+    with the fast-resume sidecar saved, on every stop. Its bandwidth
+    buckets sit between the session's and its peers'.
+    """
+
+    def __init__(self, session: "Session", decoded: dict, payload: dict,
+                 download: Download, seed: bool = False):
+        self.session = session
+        self.decoded = decoded
+        self.payload = payload
+        self.info_hash = payload["info_hash"]
+        self.handshake = build_handshake(self.info_hash, payload["peer_id"])
+        self.download = download
+        self.seed = seed
+        # private torrents (BEP 27) only get peers from their trackers
+        self.private = decoded[b"info"].get(b"private") == 1
+        limits = session.limits
+        self.upload_limit = TokenBucket(0, session.upload_limit, child_rate=limits.peer_upload_rate)
+        self.download_limit = TokenBucket(0, session.download_limit, child_rate=limits.peer_download_rate)
+
+        self.task: asyncio.Task | None = None
+        self.choker: Choker | None = None
+        self.connect = None         # handle_peer bound to this torrent, set while running
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self) -> None:
+        if not self.running:
+            self.task = asyncio.create_task(self.run())
+
+    def set_rates(self, upload: float | None = None, download: float | None = None) -> None:
+        """Changes the torrent's own limits, in bytes per second; 0 is unlimited."""
+        if upload is not None:
+            self.upload_limit.set_rate(upload)
+        if download is not None:
+            self.download_limit.set_rate(download)
+
+    def stream(self, window: int = 16) -> Stream:
+        """A reader of the payload; whatever it reads next is downloaded first."""
+        return Stream(self.download, window, self.session.storage_backend)
+
+    async def stop(self) -> None:
+        if self.running:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def run(self) -> None:
+        """Exchanges pieces until the download is complete, or until cancelled when seeding."""
+        session, download = self.session, self.download
+        if not download.remaining:
+            log.info("DOWNLOAD COMPLETE")
+            if not self.seed:
+                return
+
+        storage = open_storage(download.layout, session.storage_backend)
+        download.storage = StorageWriter(storage, budget=session.disk_queue)
+        download.verifier = session.verifier
+        download.cache = PieceCache(download.storage, download.piece_length, download.file_size)
+
+        peers = asyncio.Queue()
+        announcer = Announcer(self.decoded, download, self.payload, peers, session.http, session.udp)
+        announcer.start()
+        pex = None if self.private else PeerExchange(peers, session.port)
+
+        stop_event = asyncio.Event()
+        self.choker = Choker(download)
+        self.connect = functools.partial(
+            handle_peer, handshake=self.handshake, download=download, stop_event=stop_event,
+            choker=self.choker, seed=self.seed, pex=pex, requests=session.requests,
+            upload_limit=self.upload_limit, download_limit=self.download_limit,
+        )
+        manager = ConnectionManager(
+            self.connect, max_peers=session.limits.peers_per_torrent, budget=session.connections,
+        )
+        tasks = [
+            asyncio.create_task(manager.run(peers)),
+            asyncio.create_task(self.choker.run()),
+            asyncio.create_task(save_resume_loop(download, self.info_hash)),
+        ]
+        if session.dht is not None and not self.private:
+            tasks.append(asyncio.create_task(session.dht.discover(
+                self.info_hash, session.port, peers, nodes=bootstrap_nodes(self.decoded),
+            )))
+        mirrors = [
+            WebSeed(
+                url, self.decoded[b"info"], download, stop_event, seed=self.seed,
+                streams=session.limits.web_seed_streams, on_piece=self.choker.have,
+                limit=self.download_limit.child(),
+            )
+            for url in web_seeds(self.decoded)
+        ]
+        tasks += [asyncio.create_task(mirror.run()) for mirror in mirrors]
+
+        try:
+            await stop_event.wait()
+        finally:
+            self.connect = None
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await announcer.stop()
+            await download.storage.close()
+            await asyncio.to_thread(
+                resume.save, download, self.info_hash, download.downloaded, download.buffers.snapshot(),
+            )
+            self.summary(pex, mirrors)
+
+    def summary(self, pex: PeerExchange | None, mirrors: list[WebSeed]) -> None:
+        download = self.download
+        endgame = download.endgame.stats()
+        if endgame["duplicate_blocks"]:
+            log.info(
+                "ENDGAME", "%d duplicate blocks, %d bytes wasted",
+                endgame["duplicate_blocks"], endgame["wasted_bytes"],
+            )
+        if pex is not None and pex.received:
+            log.info("PEX", "%d endpoints learned from peers", pex.received)
+        for mirror in mirrors:
+            if mirror.received:
+                log.info("WEBSEED", "%d bytes from %s", mirror.received, mirror.url)
+        if download.bytes_uploaded:
+            log.info(
+                "UPLOAD", "%d bytes, read cache hit ratio %.0f%%",
+                download.bytes_uploaded, download.cache.stats()["hit_ratio"] * 100,
+            )
+
+
+class Session:
+    """Runs any number of torrents on one event loop.
+
+    The torrents share one listening port, DHT node, pair of tracker
+    clients and hashing pool, and draw on the same Limits: connections,
+    block requests in flight, piece-buffer memory and disk-queue bytes
+    are budgets every torrent takes from and gives back to, so adding a
+    torrent divides the capacity instead of multiplying it. Incoming
+    connections are routed to their torrent by the info hash of their
+    handshake.
+    """
+
+    def __init__(self, port: int = 6881, limits: Limits | None = None,
+                 storage_backend: str = "pwrite", hash_workers: int | None = None,
+                 hash_pool: str = "thread", dht: bool = True, metrics_port: int | None = None,
+                 dht_cache: str | None = CACHE_PATH):
+        """
+        :param storage_backend: How pieces are written to disk, "pwrite" or "mmap".
+        :param hash_workers: Size of the piece verification pool, one per core by default.
+        :param hash_pool: Whether pieces are hashed on a "thread" or "process" pool.
+        :param dht: Also find peers through the Mainline DHT, for torrents that aren't private.
+        :param metrics_port: Serve Prometheus metrics on this localhost port.
+        :param dht_cache: Where the DHT node keeps its id and routing table.
+        """
+        self.port = port
+        self.limits = limits or Limits()
+        self.storage_backend = storage_backend
+        self.hash_workers = hash_workers
+        self.hash_pool = hash_pool
+        self.use_dht = dht
+        self.dht_cache = dht_cache
+        self.metrics_port = metrics_port
+
+        self.connections = Budget(self.limits.connections)
+        self.requests = Budget(self.limits.requests)
+        self.buffers = Budget(self.limits.buffer_bytes)
+        self.disk_queue = Budget(self.limits.disk_queue_bytes)
+        self.upload_limit = TokenBucket(self.limits.upload_rate, direction="upload")
+        self.download_limit = TokenBucket(self.limits.download_rate, direction="download")
+
+        self.torrents: dict[bytes, Torrent] = {}
+        self.verifier: PieceVerifier | None = None
+        self.http: HttpClient | None = None
+        self.udp: UdpClient | None = None
+        self.dht: DhtNode | None = None
+        self.metrics_server = None
+        self.tasks = []
+
+    async def start(self) -> None:
+        self.verifier = PieceVerifier(self.hash_workers, self.hash_pool)
+        self.http = HttpClient()
+        self.udp = UdpClient()
+        self.tasks.append(asyncio.create_task(listen(self.port, self.accept, self.limits.connections)))
+        if self.use_dht:
+            self.dht = DhtNode(self.port, cache_path=self.dht_cache)
+            self.tasks.append(asyncio.create_task(self.dht.run()))
+        self.watch()
+        if self.metrics_port is not None:
+            self.metrics_server = await exporter.serve(metrics.registry, port=self.metrics_port)
+
+    def watch(self) -> None:
+        """Points the queue-depth gauges at the whole session."""
+        def entries():
+            return [entry for torrent in self.torrents.values() if torrent.running and torrent.choker
+                    for entry in torrent.choker.entries]
+
+        metrics.PEERS.set_function(lambda: len(entries()))
+        metrics.WRITE_QUEUE_BYTES.set_function(lambda: self.disk_queue.used)
+        metrics.HASH_QUEUE.set_function(lambda: self.verifier.in_flight)
+        metrics.HASH_QUEUE_MAX_SECONDS.set_function(lambda: self.verifier.max_queue_seconds)
+        metrics.PIECE_BUFFER_BYTES.set_function(lambda: self.buffers.used)
+        metrics.REQUESTS_IN_FLIGHT.set_function(lambda: self.requests.used)
+        metrics.UPLOAD_QUEUE.set_function(lambda: sum(len(entry.protocol.uploads) for entry in entries()))
+        metrics.ENDGAME_TORRENTS.set_function(lambda: sum(
+            torrent.download.endgame.active for torrent in self.torrents.values() if torrent.running
+        ))
+
+    async def add(self, decoded: dict, payload: dict, seed: bool = False, recheck: bool = False,
+                  paused: bool = False, downloaded: np.ndarray | None = None) -> Torrent:
+        """Registers a torrent and starts it unless paused.
+
+        Progress is restored from the fast-resume sidecar when there is one.
+        If the file was written to after the sidecar was saved, the pieces
+        it doesn't list are rechecked against their hashes.
+
+        :param payload: The torrent's tracker payload; its port becomes the session's.
+        :param seed: Keep uploading once the download is complete, until removed.
+        :param recheck: Ignore the sidecar and hash every piece of an existing file.
+        :param downloaded: A zeroed bool array, one per piece, to keep the
+            downloaded bitfield in.
+        """
+        info_hash = payload["info_hash"]
+        if info_hash in self.torrents:
+            raise ValueError(f"torrent {info_hash.hex()} is already in the session")
+        payload["port"] = self.port
+
+        download = build_download(decoded, buffer_budget=self.buffers, downloaded=downloaded)
+        stale = await asyncio.to_thread(resume.load, download, info_hash)
+        if recheck or stale:
+            log.info("RECHECK", "hashing existing data")
+            await asyncio.to_thread(resume.recheck, download, only_missing=not recheck)
+        if stale is not None or recheck:
+            have = download.total_pieces - download.remaining
+            log.info("RESUME", "%d/%d pieces already downloaded", have, download.total_pieces)
+
+        torrent = self.torrents[info_hash] = Torrent(self, decoded, payload, download, seed)
+        if not paused:
+            torrent.start()
+        return torrent
+
+    def set_rates(self, upload: float | None = None, download: float | None = None,
+                  peer_upload: float | None = None, peer_download: float | None = None) -> None:
+        """Changes the session-wide and per-peer limits, in bytes per second; 0 is unlimited.
+
+        Transfers already waiting continue at the new rates.
+        """
+        limits = self.limits
+        if upload is not None:
+            limits.upload_rate = upload
+            self.upload_limit.set_rate(upload)
+        if download is not None:
+            limits.download_rate = download
+            self.download_limit.set_rate(download)
+        for torrent in self.torrents.values():
+            if peer_upload is not None:
+                torrent.upload_limit.set_child_rate(peer_upload)
+            if peer_download is not None:
+                torrent.download_limit.set_child_rate(peer_download)
+        if peer_upload is not None:
+            limits.peer_upload_rate = peer_upload
+        if peer_download is not None:
+            limits.peer_download_rate = peer_download
+
+    async def pause(self, info_hash: bytes) -> None:
+        """Disconnects a torrent's peers and closes its files, keeping its progress."""
+        await self.torrents[info_hash].stop()
+
+    def resume(self, info_hash: bytes) -> None:
+        self.torrents[info_hash].start()
+
+    async def remove(self, info_hash: bytes) -> Torrent:
+        """Stops a torrent and hands its buffered memory back to the session."""
+        torrent = self.torrents.pop(info_hash)
+        await torrent.stop()
+        for index in list(torrent.download.buffers.buffers):
+            torrent.download.buffers.discard(index)
+        return torrent
+
+    async def wait(self) -> None:
+        """Returns once no torrent is running, i.e. every download not seeding is complete.
+
+        :raises Exception: Whatever stopped a torrent, other than a pause.
+        """
+        while True:
+            tasks = [torrent.task for torrent in self.torrents.values() if torrent.running]
+            if not tasks:
+                return
+            done, _ = await asyncio.wait(tasks)
+            for task in done:
+                if not task.cancelled():
+                    task.result()
+
+    async def accept(self, stats: PeerStats, wire: WireProtocol) -> None:
+        """Hands an incoming connection to the torrent its handshake asks for."""
+        try:
+            handshake = await asyncio.wait_for(wire.peek_handshake(), timeout=10)
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            await close_writer(wire)
+            return
+        torrent = self.torrents.get(handshake[28:48])
+        if torrent is None or torrent.connect is None or not self.connections.free():
+            await close_writer(wire)
+            return
+        self.connections.take(1)
+        try:
+            await torrent.connect(stats, connect_slots=None, wire=wire)
+        finally:
+            self.connections.give(1)
+
+    async def close(self) -> None:
+        """Stops every torrent, saving its progress, and releases the shared resources."""
+        await asyncio.gather(*(torrent.stop() for torrent in self.torrents.values()))
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.http.close()
+        self.udp.close()
+        self.verifier.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+
+        hashing = self.verifier.stats()
+        log.info(
+            "HASHING", "%d pieces, queue wait avg %.1fms max %.1fms, hash avg %.1fms",
+            hashing["hashed"], hashing["avg_queue_seconds"] * 1000,
+            hashing["max_queue_seconds"] * 1000, hashing["avg_hash_seconds"] * 1000,
+        )
+        for stage, (count, average) in metrics.profiler.summary().items():
+            log.info("PROFILE", "%s: %d samples, avg %.3fms", stage, count, average * 1000)
+
+
+async def download_one(decoded, tracker_payload: dict, seed=False, recheck=False, **options) -> None:
+    session = Session(tracker_payload["port"], **options)
+    await session.start()
+    try:
+        await session.add(decoded, tracker_payload, seed=seed, recheck=recheck)
+        await session.wait()
+    finally:
+        await session.close()
+
+
+def contact_peer(decoded, tracker_payload: dict, storage_backend="pwrite",
+                 hash_workers=None, hash_pool="thread", recheck=False, seed=False,
+                 metrics_port=None, profile=False, dht=True, limits: Limits | None = None):
+    """Downloads one torrent in a session of its own, listening on the payload's port.
+
+    :param storage_backend: How pieces are written to disk, "pwrite" or "mmap".
+    :param hash_workers: Size of the piece verification pool, one per core by default.
+    :param hash_pool: Whether pieces are hashed on a "thread" or "process" pool.
+    :param recheck: Ignore the sidecar and hash every piece of an existing file.
+    :param seed: Keep uploading once the download is complete, until interrupted.
+    :param metrics_port: Serve Prometheus metrics on this localhost port.
+    :param profile: Time every stage of the piece pipeline, summarised at the end.
+    :param dht: Also find peers through the Mainline DHT, unless the torrent is private.
+    :param limits: Caps on connections, memory and bandwidth.
+    """
+    metrics.profiler.enabled = profile
+    asyncio.run(download_one(
+        decoded, tracker_payload, seed=seed, recheck=recheck, storage_backend=storage_backend,
+        hash_workers=hash_workers, hash_pool=hash_pool, metrics_port=metrics_port, dht=dht,
+        limits=limits,
+    ))
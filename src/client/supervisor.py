@@ -0,0 +1,273 @@
+import asyncio
+import dataclasses
+import multiprocessing
+import os
+import queue
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src.client.session import Limits, Session
+from src.dht.node import CACHE_PATH
+from src.metrics.log import log
+
+
+@dataclass(eq=False)
+class Shard:
+    """The supervisor's view of one torrent and the worker running it."""
+    info_hash: bytes
+    worker: int
+    seed: bool
+    memory: shared_memory.SharedMemory
+    downloaded: np.ndarray          # the worker's Download.downloaded, in shared memory
+    state: str = "running"          # running, paused, done, failed or removed
+    error: str | None = None
+
+    def progress(self) -> tuple[int, int]:
+        """(pieces downloaded, total pieces)"""
+        return int(np.count_nonzero(self.downloaded)), len(self.downloaded)
+
+
+class Supervisor:
+    """Shards torrents across worker processes, one Session each.
+
+    One process spends a core on parsing and bookkeeping long before a
+    fast link is full, so torrents are spread over workers processes,
+    each added to the worker running the fewest. Worker i listens on
+    port + i and gets an equal share of limits.
+
+    Every torrent's downloaded bitfield lives in shared memory owned by
+    the supervisor, so progress is read straight from the workers'
+    downloads without a round trip. Commands go to each worker on its
+    own queue and workers report finished or failed torrents on a
+    common one.
+    """
+
+    def __init__(self, workers: int | None = None, port: int = 6881,
+                 limits: Limits | None = None, **options):
+        """
+        :param options: Passed on to every worker's Session. A
+            metrics_port is offset by the worker's index, like its port.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.port = port
+        self.limits = limits or Limits()
+        self.options = options
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.commands = []
+        self.processes = []
+        self.shards: dict[bytes, Shard] = {}
+        self.releasing: dict[bytes, shared_memory.SharedMemory] = {}    # removed, still mapped by a worker
+
+    def worker_limits(self) -> Limits:
+        share = {
+            name: max(getattr(self.limits, name) // self.workers, 1)
+            for name in ("connections", "requests", "buffer_bytes", "disk_queue_bytes")
+        }
+        share["upload_rate"] = self.limits.upload_rate / self.workers
+        share["download_rate"] = self.limits.download_rate / self.workers
+        return dataclasses.replace(self.limits, **share)
+
+    def set_rates(self, upload: float | None = None, download: float | None = None,
+                  peer_upload: float | None = None, peer_download: float | None = None) -> None:
+        """Changes the global and per-peer limits, in bytes per second; 0 is unlimited.
+
+        Global rates are split evenly between the workers.
+        """
+        self.limits = dataclasses.replace(self.limits, **{
+            name: rate for name, rate in (
+                ("upload_rate", upload), ("download_rate", download),
+                ("peer_upload_rate", peer_upload), ("peer_download_rate", peer_download),
+            ) if rate is not None
+        })
+        upload = None if upload is None else upload / self.workers
+        download = None if download is None else download / self.workers
+        for commands in self.commands:
+            commands.put(("rates", None, upload, download, peer_upload, peer_download))
+
+    def start(self) -> None:
+        limits = self.worker_limits()
+        for index in range(self.workers):
+            options = dict(self.options)
+            options.setdefault("hash_workers", max((os.cpu_count() or 1) // self.workers, 1))
+            if options.get("metrics_port") is not None:
+                options["metrics_port"] += index
+            if index:
+                options["dht_cache"] = f"{options.get('dht_cache', CACHE_PATH)}.{index}"
+
+            commands = self.context.Queue()
+            process = self.context.Process(
+                target=run_worker, args=(self.port + index, limits, options, commands, self.events),
+                name=f"fluxo-worker-{index}", daemon=True,
+            )
+            process.start()
+            self.commands.append(commands)
+            self.processes.append(process)
+
+    def add(self, decoded: dict, payload: dict, seed: bool = False, recheck: bool = False,
+            paused: bool = False) -> Shard:
+        """Hands a torrent to the worker running the fewest.
+
+        :returns: Its shard, whose progress() can be read at any time.
+        """
+        info_hash = payload["info_hash"]
+        if info_hash in self.shards:
+            raise ValueError(f"torrent {info_hash.hex()} is already in the session")
+        load = [0] * self.workers
+        for shard in self.shards.values():
+            load[shard.worker] += shard.state == "running"
+        worker = load.index(min(load))
+
+        total_pieces = len(decoded[b"info"][b"pieces"]) // 20
+        memory = shared_memory.SharedMemory(create=True, size=max(total_pieces, 1))
+        downloaded = np.ndarray(total_pieces, dtype=bool, buffer=memory.buf)
+        downloaded[:] = False
+        shard = self.shards[info_hash] = Shard(
+            info_hash, worker, seed, memory, downloaded, "paused" if paused else "running",
+        )
+        self.commands[worker].put(("add", info_hash, decoded, payload, seed, recheck, paused, memory.name))
+        return shard
+
+    def pause(self, info_hash: bytes) -> None:
+        shard = self.shards[info_hash]
+        shard.state = "paused"
+        self.commands[shard.worker].put(("pause", info_hash))
+
+    def resume(self, info_hash: bytes) -> None:
+        shard = self.shards[info_hash]
+        shard.state = "running"
+        self.commands[shard.worker].put(("resume", info_hash))
+
+    def remove(self, info_hash: bytes) -> None:
+        """Stops a torrent. Its shared memory is released once the worker lets go of it."""
+        shard = self.shards.pop(info_hash)
+        shard.state = "removed"
+        shard.downloaded = None
+        self.releasing[info_hash] = shard.memory
+        self.commands[shard.worker].put(("remove", info_hash))
+
+    def progress(self) -> dict[bytes, tuple[int, int]]:
+        return {info_hash: shard.progress() for info_hash, shard in self.shards.items()}
+
+    def poll(self, timeout: float | None = None) -> bool:
+        """Applies the next report from the workers.
+
+        :returns: False if none arrived within timeout.
+        :raises RuntimeError: A torrent failed, or a worker died.
+        """
+        try:
+            event, info_hash, *details = self.events.get(timeout=timeout)
+        except queue.Empty:
+            for index, process in enumerate(self.processes):
+                if process.exitcode is not None:
+                    raise RuntimeError(f"worker {index} exited with {process.exitcode}")
+            return False
+
+        if event == "released":
+            memory = self.releasing.pop(info_hash, None)
+            if memory is not None:
+                memory.close()
+                memory.unlink()
+            return True
+        shard = self.shards.get(info_hash)
+        if shard is None or shard.state != "running":
+            return True     # a report that crossed a pause or remove
+        if event == "done":
+            shard.state = "done"
+        elif event == "failed":
+            shard.state = "failed"
+            shard.error = details[0]
+            raise RuntimeError(f"torrent {info_hash.hex()}: {shard.error}")
+        return True
+
+    def wait(self) -> None:
+        """Returns once no download is running, i.e. every one not seeding is complete."""
+        while any(shard.state == "running" and not shard.seed for shard in self.shards.values()):
+            self.poll(timeout=1.0)
+
+    def close(self, timeout: float = 30) -> None:
+        """Stops every worker, which saves its torrents' progress, and frees the shared memory."""
+        for commands in self.commands:
+            commands.put(("close", None))
+        for process in self.processes:
+            process.join(timeout)
+            if process.exitcode is None:
+                log.warning("WORKER", "%s didn't stop, terminating it", process.name)
+                process.terminate()
+                process.join()
+        for shard in self.shards.values():
+            shard.downloaded = None
+            self.releasing[shard.info_hash] = shard.memory
+        for memory in self.releasing.values():
+            memory.close()
+            memory.unlink()
+        self.shards.clear()
+        self.releasing.clear()
+
+
+def run_worker(port: int, limits: Limits, options: dict, commands, events) -> None:
+    """Entry point of a worker process."""
+    try:
+        asyncio.run(serve(port, limits, options, commands, events))
+    except KeyboardInterrupt:
+        pass
+
+
+async def serve(port: int, limits: Limits, options: dict, commands, events) -> None:
+    """Runs a Session on the supervisor's commands until told to close."""
+    session = Session(port, limits, **options)
+    await session.start()
+    memories: dict[bytes, shared_memory.SharedMemory] = {}
+    reporters = set()
+
+    async def report(torrent) -> None:
+        try:
+            await torrent.task
+        except asyncio.CancelledError:
+            return      # paused or removed
+        except Exception as e:
+            events.put(("failed", torrent.info_hash, str(e)))
+            return
+        events.put(("done", torrent.info_hash))
+
+    def watch(torrent) -> None:
+        if torrent.running:
+            reporter = asyncio.create_task(report(torrent))
+            reporters.add(reporter)
+            reporter.add_done_callback(reporters.discard)
+
+    try:
+        while True:
+            command, info_hash, *args = await asyncio.to_thread(commands.get)
+            if command == "close":
+                break
+            if command == "add":
+                decoded, payload, seed, recheck, paused, name = args
+                memory = memories[info_hash] = shared_memory.SharedMemory(name)
+                total_pieces = len(decoded[b"info"][b"pieces"]) // 20
+                downloaded = np.ndarray(total_pieces, dtype=bool, buffer=memory.buf)
+                try:
+                    torrent = await session.add(
+                        decoded, payload, seed=seed, recheck=recheck, paused=paused, downloaded=downloaded,
+                    )
+                except (OSError, ValueError) as e:
+                    events.put(("failed", info_hash, str(e)))
+                    continue
+                watch(torrent)
+            elif command == "rates":
+                session.set_rates(*args)
+            elif command == "pause":
+                await session.pause(info_hash)
+            elif command == "resume":
+                session.resume(info_hash)
+                watch(session.torrents[info_hash])
+            elif command == "remove":
+                torrent = await session.remove(info_hash)
+                torrent.download.downloaded = None
+                del torrent
+                memories.pop(info_hash).close()
+                events.put(("released", info_hash))
+    finally:
+        await session.close()
@@ -0,0 +1,138 @@
+import asyncio
+import random
+import socket
+import struct
+from typing import Callable
+
+from src.torrent import bencode
+
+NODE = struct.Struct("!20s4sH")     # compact node info: id, IPv4 address, port
+PEER = struct.Struct("!4sH")        # compact peer info
+
+GENERIC_ERROR, SERVER_ERROR, PROTOCOL_ERROR, METHOD_UNKNOWN = 201, 202, 203, 204
+
+
+class KrpcError(Exception):
+    """An error reply, or a query the client answers with one."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"[{code}] {message}")
+        self.code = code
+        self.message = message
+
+
+def compact_nodes(nodes) -> bytes:
+    return b"".join(NODE.pack(node.id, socket.inet_aton(node.addr[0]), node.addr[1]) for node in nodes)
+
+
+def parse_nodes(data: bytes) -> list[tuple[bytes, tuple[str, int]]]:
+    """(id, (ip, port)) of every node in a compact node string."""
+    nodes = []
+    for i in range(0, len(data) - len(data) % NODE.size, NODE.size):
+        node_id, ip, port = NODE.unpack_from(data, i)
+        if port:
+            nodes.append((node_id, (socket.inet_ntoa(ip), port)))
+    return nodes
+
+
+def compact_peer(endpoint: tuple[str, int]) -> bytes:
+    return PEER.pack(socket.inet_aton(endpoint[0]), endpoint[1])
+
+
+def parse_peers(values: list) -> list[tuple[str, int]]:
+    """Endpoints of the compact peer strings in a get_peers reply."""
+    peers = []
+    for value in values:
+        if isinstance(value, bytes) and len(value) == PEER.size:
+            ip, port = PEER.unpack(value)
+            if port:
+                peers.append((socket.inet_ntoa(ip), port))
+    return peers
+
+
+class KrpcProtocol(asyncio.DatagramProtocol):
+    """KRPC, the bencoded query/response protocol of the DHT, on one UDP socket.
+
+    Any number of queries can be in flight: replies are matched to their
+    query by transaction id and source address. Incoming queries are
+    answered with whatever handler returns, or with an error reply if it
+    raises KrpcError.
+    """
+
+    def __init__(self, handler: Callable[[bytes, dict, tuple], dict]):
+        self.handler = handler
+        self.transport = None
+        self.pending: dict[bytes, tuple[asyncio.Future, tuple]] = {}
+        self.next_id = random.getrandbits(16)
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(exc or ConnectionError("DHT socket closed"))
+
+    def error_received(self, exc: Exception) -> None:
+        pass    # ICMP errors can't be tied to a query; its timeout covers it
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            message = bencode.decode(data)
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+        kind = message.get(b"y")
+        transaction = message.get(b"t")
+        if not isinstance(transaction, bytes):
+            return
+
+        if kind == b"q":
+            self.answer(message, transaction, addr[:2])
+        elif kind in (b"r", b"e"):
+            entry = self.pending.get(transaction)
+            if entry is None or entry[1] != addr[:2] or entry[0].done():
+                return
+            future = entry[0]
+            if kind == b"r" and isinstance(message.get(b"r"), dict):
+                future.set_result(message[b"r"])
+            else:
+                error = message.get(b"e")
+                if isinstance(error, list) and len(error) == 2:
+                    code, text = error
+                    future.set_exception(KrpcError(code, bytes(text).decode(errors="replace")))
+                else:
+                    future.set_exception(KrpcError(PROTOCOL_ERROR, "malformed reply"))
+
+    def answer(self, message: dict, transaction: bytes, addr: tuple) -> None:
+        method, args = message.get(b"q"), message.get(b"a")
+        try:
+            if not isinstance(method, bytes) or not isinstance(args, dict):
+                raise KrpcError(PROTOCOL_ERROR, "malformed query")
+            reply = {b"t": transaction, b"y": b"r", b"r": self.handler(method, args, addr)}
+        except KrpcError as e:
+            reply = {b"t": transaction, b"y": b"e", b"e": [e.code, e.message.encode()]}
+        self.send(reply, addr)
+
+    def send(self, message: dict, addr: tuple) -> None:
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.sendto(bencode.encode(message), addr)
+
+    async def query(self, addr: tuple, method: bytes, args: dict, timeout: float) -> dict:
+        """Sends a query and waits for its reply.
+
+        :returns: The reply's "r" dictionary.
+        :raises KrpcError: The node answered with an error.
+        :raises asyncio.TimeoutError: It didn't answer within timeout.
+        """
+        transaction = self.next_id.to_bytes(2, "big")
+        self.next_id = (self.next_id + 1) & 0xFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.pending[transaction] = (future, addr)
+        try:
+            self.send({b"t": transaction, b"y": b"q", b"q": method, b"a": args}, addr)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if self.pending.get(transaction, (None,))[0] is future:
+                del self.pending[transaction]
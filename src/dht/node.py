@@ -0,0 +1,316 @@
+import asyncio
+import hashlib
+import os
+import random
+import socket
+import time
+
+from src.dht.krpc import (
+    METHOD_UNKNOWN, PROTOCOL_ERROR, KrpcError, KrpcProtocol,
+    compact_nodes, compact_peer, parse_nodes, parse_peers,
+)
+from src.dht.routing import K, RoutingTable, distance
+from src.metrics.log import log
+from src.torrent import bencode
+
+BOOTSTRAP = (
+    ("router.bittorrent.com", 6881),
+    ("dht.transmissionbt.com", 6881),
+    ("router.utorrent.com", 6881),
+)
+CACHE_PATH = "fluxo.dht"
+TOKEN_LIFETIME = 5 * 60     # secrets rotate this often; tokens from the last two are accepted
+PEER_LIFETIME = 30 * 60     # announced peers are forgotten after this long
+MAX_VALUES = 50             # peers per get_peers reply, so it fits in one datagram
+REFRESH = 15 * 60
+
+
+class DhtNode:
+    """A Mainline DHT (BEP 5) node.
+
+    Answers ping, find_node, get_peers and announce_peer from other
+    nodes, and finds a torrent's peers with iterative lookups: the alpha
+    closest nodes not asked yet are queried concurrently, every reply
+    brings nodes closer to the target, and the lookup ends once the k
+    closest nodes it knows of have all been asked. Every query shares
+    one UDP socket.
+
+    The node id and routing table are saved to cache_path on close and
+    loaded on start, so a restart bootstraps from the nodes it knew
+    instead of the public routers.
+    """
+
+    def __init__(self, port: int = 6881, node_id: bytes | None = None,
+                 cache_path: str | None = CACHE_PATH, bootstrap=BOOTSTRAP,
+                 alpha: int = 8, k: int = K, timeout: float = 2.0, host: str = "0.0.0.0"):
+        self.port = port
+        self.host = host
+        self.id = node_id or os.urandom(20)
+        self.fixed_id = node_id is not None
+        self.cache_path = cache_path
+        self.routers = bootstrap
+        self.alpha = alpha
+        self.k = k
+        self.timeout = timeout
+
+        self.table = RoutingTable(self.id, k)
+        self.protocol: KrpcProtocol | None = None
+        self.ready = asyncio.Event()
+        self.storage: dict[bytes, dict[tuple[str, int], float]] = {}    # info_hash -> peer -> announced at
+        self.secrets = [os.urandom(16), os.urandom(16)]
+        self.rotated = time.monotonic()
+
+    # lifetime
+
+    async def start(self) -> None:
+        self.load()
+        loop = asyncio.get_running_loop()
+        _, self.protocol = await loop.create_datagram_endpoint(
+            lambda: KrpcProtocol(self.handle), local_addr=(self.host, self.port),
+        )
+
+    def close(self) -> None:
+        if self.protocol is None:
+            return
+        self.protocol.transport.close()
+        self.protocol = None
+        self.save()
+
+    def load(self) -> None:
+        if self.cache_path is None:
+            return
+        try:
+            with open(self.cache_path, "rb") as f:
+                cache = bencode.decode(f.read())
+        except (OSError, ValueError):
+            return
+        if not isinstance(cache, dict):
+            return
+        cached_id = cache.get(b"id")
+        if not self.fixed_id and isinstance(cached_id, bytes) and len(cached_id) == 20:
+            self.id = cached_id
+            self.table = RoutingTable(self.id, self.k)
+        nodes = cache.get(b"nodes")
+        if isinstance(nodes, bytes):
+            for node_id, addr in parse_nodes(nodes):
+                self.table.seen(node_id, addr)
+
+    def save(self) -> None:
+        if self.cache_path is None or not len(self.table):
+            return
+        contents = bencode.encode({b"id": self.id, b"nodes": compact_nodes(self.table.nodes())})
+        try:
+            with open(self.cache_path + ".tmp", "wb") as f:
+                f.write(contents)
+            os.replace(self.cache_path + ".tmp", self.cache_path)
+        except OSError as e:
+            log.warning("DHT", "can't save node cache: %s", e)
+
+    async def run(self, nodes=()) -> None:
+        """Joins the DHT and keeps the routing table fresh until cancelled.
+
+        :param nodes: Extra (host, port) bootstrap nodes, such as the
+            torrent's "nodes" list.
+        """
+        try:
+            await self.start()
+        except OSError as e:
+            log.error("DHT: can't listen on UDP port %d: %s", self.port, e)
+            return
+        try:
+            await self.bootstrap(nodes)
+            log.info("DHT", "%d nodes in the routing table", len(self.table))
+            self.ready.set()
+            while True:
+                await asyncio.sleep(REFRESH)
+                await self.lookup(self.id, b"find_node")
+                self.save()
+        finally:
+            self.close()
+
+    async def bootstrap(self, nodes=()) -> None:
+        """Fills the routing table with a lookup of the node's own id.
+
+        Cached nodes are enough when there are k of them; otherwise the
+        given nodes and the public routers are asked first.
+        """
+        if len(self.table) < self.k:
+            await self.contact([*nodes, *self.routers])
+        await self.lookup(self.id, b"find_node")
+
+    async def contact(self, nodes) -> None:
+        """Asks (host, port) nodes for their neighbours, adding the ones that answer."""
+        loop = asyncio.get_running_loop()
+        addrs = []
+        for host, port in nodes:
+            try:
+                infos = await loop.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            except OSError:
+                continue
+            addrs += (info[4][:2] for info in infos[:1])
+        await asyncio.gather(*(self.query(addr, b"find_node", {b"target": self.id}) for addr in addrs))
+
+    # answering queries
+
+    def token(self, ip: str, secret: bytes) -> bytes:
+        return hashlib.sha1(secret + ip.encode()).digest()[:8]
+
+    def handle(self, method: bytes, args: dict, addr: tuple) -> dict:
+        sender = args.get(b"id")
+        if not isinstance(sender, bytes) or len(sender) != 20:
+            raise KrpcError(PROTOCOL_ERROR, "missing id")
+        self.table.seen(sender, addr)
+
+        if method == b"ping":
+            return {b"id": self.id}
+        if method == b"find_node":
+            target = self.key(args, b"target")
+            return {b"id": self.id, b"nodes": compact_nodes(self.table.closest(target))}
+        if method == b"get_peers":
+            info_hash = self.key(args, b"info_hash")
+            reply = {b"id": self.id, b"token": self.token(addr[0], self.secret())}
+            peers = self.stored(info_hash)
+            if peers:
+                reply[b"values"] = [compact_peer(peer) for peer in peers]
+            else:
+                reply[b"nodes"] = compact_nodes(self.table.closest(info_hash))
+            return reply
+        if method == b"announce_peer":
+            info_hash = self.key(args, b"info_hash")
+            self.secret()
+            if args.get(b"token") not in [self.token(addr[0], secret) for secret in self.secrets]:
+                raise KrpcError(PROTOCOL_ERROR, "bad token")
+            port = addr[1] if args.get(b"implied_port") else args.get(b"port")
+            if not isinstance(port, int) or not 0 < port < 65536:
+                raise KrpcError(PROTOCOL_ERROR, "bad port")
+            self.storage.setdefault(info_hash, {})[(addr[0], port)] = time.monotonic()
+            return {b"id": self.id}
+        raise KrpcError(METHOD_UNKNOWN, "method unknown")
+
+    @staticmethod
+    def key(args: dict, name: bytes) -> bytes:
+        value = args.get(name)
+        if not isinstance(value, bytes) or len(value) != 20:
+            raise KrpcError(PROTOCOL_ERROR, f"missing {name.decode()}")
+        return value
+
+    def secret(self) -> bytes:
+        """The current token secret, rotated every TOKEN_LIFETIME."""
+        now = time.monotonic()
+        if now - self.rotated >= TOKEN_LIFETIME:
+            self.secrets = [os.urandom(16), self.secrets[0]]
+            self.rotated = now
+        return self.secrets[0]
+
+    def stored(self, info_hash: bytes) -> list[tuple[str, int]]:
+        peers = self.storage.get(info_hash)
+        if not peers:
+            return []
+        expired = time.monotonic() - PEER_LIFETIME
+        for peer in [peer for peer, announced in peers.items() if announced < expired]:
+            del peers[peer]
+        if len(peers) <= MAX_VALUES:
+            return list(peers)
+        return random.sample(list(peers), MAX_VALUES)
+
+    # queries
+
+    async def query(self, addr: tuple, method: bytes, args: dict) -> dict | None:
+        """Queries a node and records it in the routing table if it answers.
+
+        :returns: The reply, or None if the node didn't answer or sent an error.
+        """
+        try:
+            reply = await self.protocol.query(addr, method, {b"id": self.id, **args}, self.timeout)
+        except (asyncio.TimeoutError, KrpcError, OSError):
+            return None
+        node_id = reply.get(b"id")
+        if isinstance(node_id, bytes):
+            self.table.seen(node_id, addr)
+        return reply
+
+    async def lookup(self, target: bytes, method: bytes = b"get_peers"):
+        """Walks towards target, alpha queries at a time.
+
+        :param method: b"get_peers" to collect peers and tokens on the
+            way, b"find_node" to only find nodes.
+        :returns: The peers found and (node id, addr, token) of the k
+            closest nodes that answered, closest first.
+        """
+        key = b"info_hash" if method == b"get_peers" else b"target"
+        candidates = {node.id: node.addr for node in self.table.closest(target, 2 * self.k)}
+        queried, answered, peers = set(), {}, set()
+        in_flight: dict[asyncio.Task, bytes] = {}
+
+        def order(node_id: bytes) -> int:
+            return distance(node_id, target)
+
+        try:
+            while True:
+                for node_id in sorted(candidates, key=order)[:self.k]:
+                    if len(in_flight) >= self.alpha:
+                        break
+                    if node_id not in queried:
+                        queried.add(node_id)
+                        query = self.query(candidates[node_id], method, {key: target})
+                        in_flight[asyncio.create_task(query)] = node_id
+                if not in_flight:
+                    break
+
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    node_id = in_flight.pop(task)
+                    reply = task.result()
+                    if reply is None:
+                        self.table.failed(node_id)
+                        del candidates[node_id]
+                        continue
+                    answered[node_id] = reply.get(b"token")
+                    nodes = reply.get(b"nodes")
+                    if isinstance(nodes, bytes):
+                        for found, addr in parse_nodes(nodes):
+                            if found != self.id and found not in queried:
+                                candidates.setdefault(found, addr)
+                    values = reply.get(b"values")
+                    if isinstance(values, list):
+                        peers.update(parse_peers(values))
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+        closest = sorted(answered, key=order)[:self.k]
+        return peers, [(node_id, candidates[node_id], answered[node_id]) for node_id in closest]
+
+    async def announce(self, info_hash: bytes, port: int) -> set[tuple[str, int]]:
+        """Looks up a torrent's peers and announces the client to the closest nodes.
+
+        :returns: The peers found.
+        """
+        peers, closest = await self.lookup(info_hash)
+        await asyncio.gather(*(
+            self.query(addr, b"announce_peer", {b"info_hash": info_hash, b"port": port, b"token": token})
+            for _, addr, token in closest if isinstance(token, bytes)
+        ))
+        return peers
+
+    async def discover(self, info_hash: bytes, port: int, peers: asyncio.Queue,
+                       interval: float = REFRESH, retry: float = 60, nodes=()) -> None:
+        """Feeds a torrent's peers from the DHT into the peers queue until cancelled.
+
+        Lookups are repeated every interval, or every retry seconds
+        while they find nobody. Only peers not handed out before are queued.
+
+        :param nodes: The torrent's own (host, port) bootstrap nodes,
+            contacted once the node has joined.
+        """
+        await self.ready.wait()
+        if nodes:
+            await self.contact(nodes)
+        seen = set()
+        while True:
+            found = await self.announce(info_hash, port) - seen
+            if found:
+                seen |= found
+                peers.put_nowait(list(found))
+            log.info("DHT", "%d new peers for %s", len(found), info_hash.hex()[:8])
+            await asyncio.sleep(interval if seen else retry)
@@ -0,0 +1,91 @@
+import heapq
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+K = 8                   # nodes per bucket, and nodes returned by a lookup
+ID_BITS = 160
+MAX_FAILURES = 3        # unanswered queries before a node is dropped
+STALE_AFTER = 15 * 60   # seconds without contact before a node may be replaced
+
+
+def distance(a: bytes, b: bytes) -> int:
+    return int.from_bytes(a, "big") ^ int.from_bytes(b, "big")
+
+
+@dataclass(eq=False)
+class Node:
+    id: bytes
+    addr: tuple[str, int]
+    last_seen: float = field(default_factory=time.monotonic)
+    failures: int = 0
+
+    def stale(self, now: float) -> bool:
+        return self.failures > 0 or now - self.last_seen > STALE_AFTER
+
+
+class RoutingTable:
+    """Kademlia k-buckets around the client's own node id.
+
+    Bucket i holds up to k nodes whose XOR distance to the own id is
+    i + 1 bits long, so the table knows many nodes close to itself and
+    a few in every other part of the id space. Buckets are kept in
+    least recently seen order. A full bucket only takes a new node in
+    place of a stale one, as long-lived nodes are the likeliest to stay.
+    """
+
+    def __init__(self, own_id: bytes, k: int = K):
+        self.own_id = own_id
+        self.k = k
+        self.buckets: list[OrderedDict[bytes, Node]] = [OrderedDict() for _ in range(ID_BITS)]
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self.buckets)
+
+    def bucket(self, node_id: bytes) -> OrderedDict[bytes, Node]:
+        return self.buckets[distance(self.own_id, node_id).bit_length() - 1]
+
+    def seen(self, node_id: bytes, addr: tuple[str, int]) -> Node | None:
+        """Records a node that answered a query or sent one.
+
+        :returns: The node's entry, or None if its bucket is full of
+            live nodes.
+        """
+        if len(node_id) != 20 or node_id == self.own_id:
+            return None
+        bucket = self.bucket(node_id)
+        node = bucket.get(node_id)
+        now = time.monotonic()
+        if node is not None:
+            node.addr, node.last_seen, node.failures = addr, now, 0
+            bucket.move_to_end(node_id)
+            return node
+
+        if len(bucket) >= self.k:
+            stale = next((n for n in bucket.values() if n.stale(now)), None)
+            if stale is None:
+                return None
+            del bucket[stale.id]
+        node = bucket[node_id] = Node(node_id, addr, now)
+        return node
+
+    def failed(self, node_id: bytes) -> None:
+        if len(node_id) != 20 or node_id == self.own_id:
+            return
+        bucket = self.bucket(node_id)
+        node = bucket.get(node_id)
+        if node is not None:
+            node.failures += 1
+            if node.failures >= MAX_FAILURES:
+                del bucket[node_id]
+
+    def nodes(self) -> list[Node]:
+        return [node for bucket in self.buckets for node in bucket.values()]
+
+    def closest(self, target: bytes, count: int | None = None) -> list[Node]:
+        """The count nodes nearest to target, nearest first."""
+        target = int.from_bytes(target, "big")
+        return heapq.nsmallest(
+            count or self.k, self.nodes(),
+            key=lambda node: int.from_bytes(node.id, "big") ^ target,
+        )
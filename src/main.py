@@ -3,33 +3,66 @@
     Author: Bruno Fernandes (github.com/realBruno)
     Date: 24/jan/2026
 """
+import asyncio
 import sys
 
+from src.client.session import Session
+from src.client.supervisor import Supervisor
 from src.torrent import metainfo
 from src.torrent.modes.single_file import single_file
-from src.peer.connections import contact_peer
+from src.torrent.modes.multi_file import multi_file
 
 
-def make_request(path: str):
+def make_request(path: str) -> tuple[dict, dict]:
     print("Parsing torrent file metadata")
     decoded, info_hash, is_single = metainfo.get_file_info(path)
+    print("Building tracker payload")
     if is_single:
-        print("Building tracker payload and making request")
-        t_payload, t_response = single_file(decoded, info_hash)
-        print("Establishing connection with peers")
-        contact_peer(decoded, t_response, t_payload)
+        t_payload = single_file(decoded, info_hash)
     else:
-        raise TypeError("Multi-file mode is under development")
+        t_payload = multi_file(decoded, info_hash)
+    return decoded, t_payload
 
 
-def get_path():
-    if len(sys.argv) == 2:
-        return sys.argv[1]
-    elif len(sys.argv) == 1:
-        return input("Path to file: ")
-    else:
-        raise TypeError(f"Takes exactly 1 argument. {len(sys.argv) - 1} given.")
+async def download_all(paths: list[str]):
+    session = Session()
+    await session.start()
+    try:
+        for path in paths:
+            decoded, t_payload = make_request(path)
+            await session.add(decoded, t_payload)
+        print("Announcing to trackers and connecting to peers")
+        await session.wait()
+    finally:
+        await session.close()
+
+
+def supervise(paths: list[str], workers: int):
+    supervisor = Supervisor(workers)
+    supervisor.start()
+    try:
+        for path in paths:
+            supervisor.add(*make_request(path))
+        print(f"Announcing to trackers and connecting to peers from {workers} workers")
+        supervisor.wait()
+    finally:
+        supervisor.close()
 
 
-file_loc = get_path()
-make_request(file_loc)
\ No newline at end of file
+def get_args() -> tuple[list[str], int]:
+    """Torrent paths, and the number of worker processes given with --workers N."""
+    args = sys.argv[1:]
+    workers = 1
+    if "--workers" in args:
+        i = args.index("--workers")
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    return args or [input("Path to file: ")], workers
+
+
+if __name__ == "__main__":
+    file_locs, worker_count = get_args()
+    if worker_count > 1:
+        supervise(file_locs, worker_count)
+    else:
+        asyncio.run(download_all(file_locs))
@@ -0,0 +1,55 @@
+"""The client's metrics, registered on the default registry."""
+from src.metrics.profile import Profiler
+from src.metrics.registry import Registry
+
+BYTES = (1024, 16 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024,
+         16 * 1024 * 1024, 64 * 1024 * 1024)
+
+registry = Registry()
+
+# transfer
+PEER_BYTES_RECEIVED = registry.counter(
+    "fluxo_peer_bytes_received_total", "Block payload received from each connected peer.", ("peer",))
+PEER_BYTES_SENT = registry.counter(
+    "fluxo_peer_bytes_sent_total", "Block payload sent to each connected peer.", ("peer",))
+WEBSEED_BYTES = registry.counter(
+    "fluxo_webseed_bytes_total", "Piece data received from each web seed.", ("host",))
+PEERS = registry.gauge("fluxo_peers", "Connected peers.")
+UNREQUESTED_BYTES = registry.counter(
+    "fluxo_unrequested_bytes_total", "Block payload peers sent unasked, or that didn't fit its piece.")
+PIECES_VERIFIED = registry.counter("fluxo_pieces_verified_total", "Pieces that passed the hash check.")
+PIECES_FAILED = registry.counter("fluxo_pieces_failed_total", "Pieces that failed the hash check.")
+ENDGAME_TORRENTS = registry.gauge("fluxo_endgame_torrents", "Running torrents in endgame mode.")
+PIECE_RATE = registry.meter("fluxo_pieces_per_second", "Verified pieces per second over the last 10s.")
+ENDGAME_DUPLICATE_BLOCKS = registry.counter(
+    "fluxo_endgame_duplicate_blocks_total", "Requested blocks dropped because another copy arrived first.")
+ENDGAME_WASTED_BYTES = registry.counter(
+    "fluxo_endgame_wasted_bytes_total", "Payload of the blocks dropped as endgame duplicates.")
+REQUEST_RTT = registry.histogram("fluxo_request_rtt_seconds", "Block request to block arrival.")
+THROTTLE_SECONDS = registry.counter(
+    "fluxo_throttle_seconds_total", "Time transfers waited for a bandwidth limit.", ("direction",))
+
+# hashing and disk
+HASH_SECONDS = registry.histogram("fluxo_hash_seconds", "Time spent hashing a piece.")
+HASH_QUEUE_SECONDS = registry.histogram(
+    "fluxo_hash_queue_seconds", "Time a piece waited for a hashing worker.")
+HASH_QUEUE_MAX_SECONDS = registry.gauge(
+    "fluxo_hash_queue_max_seconds", "Longest time a piece waited for a hashing worker.")
+CACHE_HITS = registry.counter("fluxo_cache_hits_total", "Upload reads served from the piece cache.")
+CACHE_MISSES = registry.counter("fluxo_cache_misses_total", "Upload reads that had to load the piece from disk.")
+DISK_WRITE_SECONDS = registry.histogram("fluxo_disk_write_seconds", "Duration of one coalesced disk write.")
+DISK_WRITE_BYTES = registry.histogram(
+    "fluxo_disk_write_bytes", "Size of one coalesced disk write.", buckets=BYTES)
+LOCK_WAIT_SECONDS = registry.histogram(
+    "fluxo_download_lock_wait_seconds", "Time spent waiting for the download lock.")
+
+# queue depths, read from functions set up by the download
+WRITE_QUEUE_BYTES = registry.gauge("fluxo_write_queue_bytes", "Verified bytes waiting for the disk.")
+HASH_QUEUE = registry.gauge("fluxo_hash_queue", "Pieces handed to the hashing pool and not done yet.")
+PIECE_BUFFER_BYTES = registry.gauge("fluxo_piece_buffer_bytes", "Bytes held by in-progress piece buffers.")
+REQUESTS_IN_FLIGHT = registry.gauge("fluxo_requests_in_flight", "Block requests sent and not answered.")
+UPLOAD_QUEUE = registry.gauge("fluxo_upload_queue", "Block requests from peers waiting to be served.")
+
+STAGE_SECONDS = registry.histogram(
+    "fluxo_stage_seconds", "Time spent in each stage of the piece pipeline (profiling only).", ("stage",))
+profiler = Profiler(STAGE_SECONDS)
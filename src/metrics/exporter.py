@@ -0,0 +1,30 @@
+import asyncio
+
+from src.metrics.registry import Registry
+
+
+async def serve(registry: Registry, host: str = "127.0.0.1", port: int = 9464) -> asyncio.Server:
+    """Serves the registry in the Prometheus text format over HTTP.
+
+    Every GET, whatever its path, gets the full exposition. Bound to
+    localhost by default, since the metrics include peer addresses.
+    """
+
+    async def handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            body = registry.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                b"Content-Length: %d\r\n"
+                b"Connection: close\r\n\r\n" % len(body) + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handler, host, port)
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+
+from colorama import Fore
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+
+TAG_COLORS = {
+    "ERROR": Fore.RED,
+    "WARNING": Fore.YELLOW,
+    "REQUEST": Fore.YELLOW,
+    "SUCCESS": Fore.GREEN,
+    "DOWNLOAD COMPLETE": Fore.LIGHTBLUE_EX,
+}
+
+
+class Logger:
+    """Leveled console log with a rate limit per message.
+
+    Messages are written as "TAG: message" with the tag colored, like
+    the rest of the client's output. Each tag and format string gets a
+    token bucket of burst messages refilled at rate per second; what
+    doesn't fit is dropped without being formatted, and the number of
+    dropped messages is added to the next one that gets through.
+    """
+
+    def __init__(self, level: int = INFO, rate: float = 10, burst: int = 50, stream=None):
+        self.level = level
+        self.rate = rate
+        self.burst = burst
+        self.stream = stream
+        self.buckets: dict[tuple[str, str], list] = {}      # key -> [tokens, updated, suppressed]
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def log(self, level: int, tag: str, message: str = "", *args) -> None:
+        if level < self.level:
+            return
+
+        key = (tag, message)
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now, 0]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return
+        bucket[0] -= 1
+
+        text = message % args if args else message
+        if bucket[2]:
+            text += f" ({bucket[2]} similar messages suppressed)"
+            bucket[2] = 0
+        color = TAG_COLORS.get(tag, Fore.CYAN)
+        line = f"{color}{tag}:{Fore.RESET} {text}" if text else f"{color}{tag}{Fore.RESET}"
+        print(line, file=self.stream or sys.stdout)
+
+    def debug(self, tag: str, message: str = "", *args) -> None:
+        self.log(DEBUG, tag, message, *args)
+
+    def info(self, tag: str, message: str = "", *args) -> None:
+        self.log(INFO, tag, message, *args)
+
+    def warning(self, tag: str, message: str = "", *args) -> None:
+        self.log(WARNING, tag, message, *args)
+
+    def error(self, message: str, *args) -> None:
+        self.log(ERROR, "ERROR", message, *args)
+
+
+log = Logger(LEVELS.get(os.environ.get("FLUXO_LOG_LEVEL", "INFO").upper(), INFO))
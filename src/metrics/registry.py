@@ -0,0 +1,198 @@
+import bisect
+import math
+import time
+from collections import deque
+from typing import Callable
+
+
+class Metric:
+    """Base of every metric type.
+
+    A metric declared with label names is a family: values live in the
+    children returned by labels(), one per combination of label values.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.children: dict[tuple[str, ...], Metric] = {}
+
+    def labels(self, *values) -> "Metric":
+        key = tuple(str(v) for v in values)
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = self.child()
+        return child
+
+    def remove(self, *values) -> None:
+        self.children.pop(tuple(str(v) for v in values), None)
+
+    def child(self) -> "Metric":
+        return type(self)(self.name, self.help)
+
+    def series(self):
+        """(label values, metric) of every series, for rendering."""
+        if self.labelnames:
+            return list(self.children.items())
+        return [((), self)]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def get(self) -> float:
+        return self.value
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from a function when collected."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self.value = 0
+        self.function: Callable[[], float] | None = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float] | None) -> None:
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Meter(Gauge):
+    """Events per second over a sliding window of one-second buckets."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), window: int = 10):
+        super().__init__(name, help, labelnames)
+        self.window = window
+        self.buckets = deque()          # [second, count]
+
+    def child(self) -> "Meter":
+        return Meter(self.name, self.help, window=self.window)
+
+    def mark(self, count: int = 1) -> None:
+        second = int(time.monotonic())
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1][1] += count
+        else:
+            self.buckets.append([second, count])
+
+    def get(self) -> float:
+        now = int(time.monotonic())
+        while self.buckets and self.buckets[0][0] <= now - self.window:
+            self.buckets.popleft()
+        return sum(count for _, count in self.buckets) / self.window
+
+
+SECONDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = SECONDS):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)      # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def child(self) -> "Histogram":
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get(self) -> dict:
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class Registry:
+    """A named set of metrics that can be snapshotted or rendered."""
+
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def meter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Meter:
+        return self.register(Meter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = SECONDS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self) -> dict:
+        """Current value of every metric.
+
+        Unlabelled metrics map to their value, labelled ones to a dict
+        keyed by label values. Histograms give count, sum and cumulative
+        (upper bound, count) buckets.
+        """
+        snapshot = {}
+        for name, metric in self.metrics.items():
+            if metric.labelnames:
+                snapshot[name] = {
+                    values if len(values) > 1 else values[0]: child.get()
+                    for values, child in metric.series()
+                }
+            else:
+                snapshot[name] = metric.get()
+        return snapshot
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for values, series in metric.series():
+                labels = [f'{k}="{escape(v)}"' for k, v in zip(metric.labelnames, values)]
+                if metric.kind == "histogram":
+                    data = series.get()
+                    for bound, count in data["buckets"]:
+                        le = 'le="%s"' % ("+Inf" if bound == math.inf else repr(bound))
+                        lines.append(f"{name}_bucket{{{','.join(labels + [le])}}} {count}")
+                    suffix = f"{{{','.join(labels)}}}" if labels else ""
+                    lines.append(f"{name}_sum{suffix} {data['sum']}")
+                    lines.append(f"{name}_count{suffix} {data['count']}")
+                else:
+                    suffix = f"{{{','.join(labels)}}}" if labels else ""
+                    lines.append(f"{name}{suffix} {series.get()}")
+        return "\n".join(lines) + "\n"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,98 @@
+import asyncio
+import time
+import weakref
+
+from src.metrics.client import THROTTLE_SECONDS
+
+BURST_SECONDS = 0.1         # idle time a bucket may save up, at its rate
+MIN_BURST = 64 * 1024       # so a whole block always fits
+
+
+class TokenBucket:
+    """Paces one direction of traffic to rate bytes per second; 0 is unlimited.
+
+    Buckets form a tree: every peer's bucket has its torrent's as parent,
+    and every torrent's has the session's, so a transfer waits until all
+    of them allow it. Reservations are served in the order they were
+    made. Each connection has at most one transfer waiting at a time,
+    which makes that order round-robin across peers, so a busy bucket is
+    shared evenly.
+
+    Rates can be changed at any time: waiting transfers are woken and
+    wait again at the new rate. child() makes buckets whose rate follows
+    child_rate, for per-peer limits.
+    """
+
+    def __init__(self, rate: float = 0, parent: "TokenBucket | None" = None,
+                 child_rate: float = 0, direction: str = ""):
+        self.rate = rate
+        self.parent = parent
+        self.child_rate = child_rate
+        self.direction = direction or (parent.direction if parent else "")
+        self.children = weakref.WeakSet()
+
+        self.reserved = 0.0         # bytes handed out since the bucket was made
+        self.allowance = 0.0        # bytes the rate has allowed so far
+        self.updated = time.monotonic()
+        self.changed = asyncio.Event()
+
+    def child(self) -> "TokenBucket":
+        bucket = TokenBucket(self.child_rate, parent=self)
+        self.children.add(bucket)
+        return bucket
+
+    def set_rate(self, rate: float) -> None:
+        self.refill(time.monotonic())
+        self.rate = rate
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def set_child_rate(self, rate: float) -> None:
+        self.child_rate = rate
+        for bucket in list(self.children):
+            bucket.set_rate(rate)
+
+    def refill(self, now: float) -> None:
+        if self.rate:
+            burst = max(self.rate * BURST_SECONDS, MIN_BURST)
+            self.allowance = min(self.allowance + (now - self.updated) * self.rate, self.reserved + burst)
+        else:
+            self.allowance = self.reserved
+        self.updated = now
+
+    def reserve(self, amount: int) -> list[tuple["TokenBucket", float]]:
+        """Takes amount from this bucket and its parents.
+
+        :returns: (bucket, mark) of every bucket that doesn't allow it
+            yet, for wait(); empty if it can be sent right away.
+        """
+        now = time.monotonic()
+        pending = []
+        bucket = self
+        while bucket is not None:
+            bucket.refill(now)
+            bucket.reserved += amount
+            if bucket.rate and bucket.allowance < bucket.reserved:
+                pending.append((bucket, bucket.reserved))
+            bucket = bucket.parent
+        return pending
+
+    async def wait(self, pending: list[tuple["TokenBucket", float]]) -> None:
+        """Waits until every bucket's allowance has reached its mark."""
+        started = time.monotonic()
+        for bucket, mark in pending:
+            while True:
+                bucket.refill(time.monotonic())
+                if bucket.allowance >= mark:
+                    break
+                changed = bucket.changed
+                try:
+                    await asyncio.wait_for(changed.wait(), (mark - bucket.allowance) / bucket.rate)
+                except asyncio.TimeoutError:
+                    pass
+        THROTTLE_SECONDS.labels(self.direction).inc(time.monotonic() - started)
+
+    async def consume(self, amount: int) -> None:
+        pending = self.reserve(amount)
+        if pending:
+            await self.wait(pending)
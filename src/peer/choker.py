@@ -0,0 +1,99 @@
+import asyncio
+import random
+from dataclasses import dataclass
+
+from src.peer.peer import Peer
+from src.peer.protocol import PeerProtocol
+from src.torrent.download import Download
+
+
+@dataclass(eq=False)
+class ChokerEntry:
+    """A connected peer, as seen by the choker."""
+    peer: Peer
+    protocol: PeerProtocol
+    downloaded_mark: int = 0
+    uploaded_mark: int = 0
+    rate: float = 0.0               # bytes per second over the last round
+
+
+class Choker:
+    """Decides which peers the client uploads to.
+
+    Every interval the interested peers that gave the client the most
+    data in the last round are unchoked, tit-for-tat. Once the download
+    is complete there is nothing to reciprocate, so the peers that took
+    data the fastest are kept instead. One extra slot is handed out at
+    random every few rounds, so new peers get a chance to prove
+    themselves.
+    """
+
+    def __init__(self, download: Download, slots: int = 4, interval: float = 10,
+                 optimistic_rounds: int = 3):
+        self.download = download
+        self.slots = slots
+        self.interval = interval
+        self.optimistic_rounds = optimistic_rounds
+        self.entries: set[ChokerEntry] = set()
+        self.optimistic: ChokerEntry | None = None
+
+    def add(self, peer: Peer, protocol: PeerProtocol) -> ChokerEntry:
+        entry = ChokerEntry(peer, protocol, protocol.pipeline.total_bytes, peer.uploaded)
+        self.entries.add(entry)
+        return entry
+
+    def remove(self, entry: ChokerEntry) -> None:
+        self.entries.discard(entry)
+        if self.optimistic is entry:
+            self.optimistic = None
+
+    def have(self, index: int) -> None:
+        """Tells every peer that lacks it about a newly verified piece."""
+        for entry in self.entries:
+            if not entry.peer.bitfield[index]:
+                entry.protocol.send_have(index)
+
+    async def interested(self, entry: ChokerEntry) -> None:
+        """Unchokes a newly interested peer right away if a slot is free."""
+        entry.peer.peer_interested = True
+        unchoked = sum(1 for s in self.entries if not s.peer.am_choking)
+        if entry.peer.am_choking and unchoked < self.slots:
+            await entry.protocol.send_unchoke(entry.peer)
+
+    def measure(self) -> None:
+        seeding = not self.download.remaining
+        for entry in self.entries:
+            downloaded = entry.protocol.pipeline.total_bytes
+            uploaded = entry.peer.uploaded
+            gained = uploaded - entry.uploaded_mark if seeding else downloaded - entry.downloaded_mark
+            entry.rate = gained / self.interval
+            entry.downloaded_mark, entry.uploaded_mark = downloaded, uploaded
+
+    async def rechoke(self, rotate: bool) -> None:
+        self.measure()
+        interested = sorted(
+            (s for s in self.entries if s.peer.peer_interested),
+            key=lambda s: s.rate, reverse=True,
+        )
+        unchoke = set(interested[:self.slots - 1])
+
+        others = [s for s in interested if s not in unchoke]
+        if rotate or self.optimistic not in others:
+            self.optimistic = random.choice(others) if others else None
+        if self.optimistic is not None:
+            unchoke.add(self.optimistic)
+
+        sends = []
+        for entry in self.entries:
+            if entry in unchoke and entry.peer.am_choking:
+                sends.append(entry.protocol.send_unchoke(entry.peer))
+            elif entry not in unchoke and not entry.peer.am_choking:
+                sends.append(entry.protocol.send_choke(entry.peer))
+        await asyncio.gather(*sends, return_exceptions=True)
+
+    async def run(self) -> None:
+        rounds = 0
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.rechoke(rotate=rounds % self.optimistic_rounds == 0)
+            rounds += 1
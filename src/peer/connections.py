@@ -1,28 +1,38 @@
 import asyncio
 import contextlib
+import functools
 import math
 import struct
+import time
 
 import numpy as np
-from colorama import Fore
 
+from src.metrics.log import log
+from src.peer.bandwidth import TokenBucket
+from src.peer.choker import Choker
+from src.peer.fast import allowed_fast_set
+from src.peer.pex import HANDSHAKE_ID, PeerExchange, PexPeer
+from src.peer.manager import PeerStats
 from src.peer.peer import Peer
-from src.peer.protocol import PeerProtocol
-from src.torrent.download import Download, build_download
-from src.tracker.endpoints import sock_addr
+from src.peer.pipeline import RequestPipeline
+from src.peer.protocol import EXTENSION_BIT, FAST_BIT, PeerProtocol
+from src.peer.wire import WireProtocol
+from src.torrent import resume
+from src.torrent.budget import Budget
+from src.torrent.download import Download
 from src.   peer.messages import Message
 
 
 def build_handshake(info_hash: bytes, peer_id: str) -> bytes:
     pstr = b"BitTorrent protocol"
     pstrlen = len(pstr).to_bytes(1, byteorder="big")
-    reserved = bytes(8)
+    reserved = bytes([0, 0, 0, 0, 0, EXTENSION_BIT, 0, FAST_BIT])
     info_hash = info_hash
     peer_id = peer_id.encode()
     return pstrlen + pstr + reserved + info_hash + peer_id
 
 
-async def close_writer(writer: asyncio.StreamWriter):
+async def close_writer(writer: WireProtocol):
     if not writer:
         return
     writer.close()
@@ -32,118 +42,220 @@ async def close_writer(writer: asyncio.StreamWriter):
         pass
 
 
-async def handle_peer(endpoint, handshake, download, semaphore, stop_event):
-    ip, port = endpoint
-    writer = None
-    keep_alive_task = None
-    async with semaphore:
-        # noinspection PyBroadException
-        try:
-            connection = asyncio.open_connection(ip, port)
-            reader, writer = await asyncio.wait_for(connection, timeout=10)
+async def handle_peer(stats: PeerStats, connect_slots, handshake, download, stop_event,
+                      choker: Choker, seed=False, wire: WireProtocol | None = None,
+                      pex: PeerExchange | None = None, requests: Budget | None = None,
+                      upload_limit: TokenBucket | None = None,
+                      download_limit: TokenBucket | None = None):
+    """Exchanges pieces with one peer until it, or the whole download, is done.
 
-            peer = Peer(np.zeros(download.total_pieces, dtype=np.uint8))
-            peer_protocol = PeerProtocol(writer, reader)
-
-            keep_alive_task = asyncio.create_task(
-                peer_protocol.keep_alive_loop()
+    :param stats: The endpoint's record in the connection manager, which
+        gets the request pipeline to measure the peer with.
+    :param connect_slots: Semaphore held only while the connection is set up.
+    :param seed: Keep serving the peer after the download is complete.
+    :param wire: The connection of a peer that connected to the client,
+        which sends the first handshake. Outbound connections are made here.
+    :param pex: Peer Exchange shared by all connections, None to disable it.
+    :param requests: Budget of block requests in flight, shared by every connection.
+    :param upload_limit: The torrent's upload bucket; the peer gets a child of it.
+    :param download_limit: The torrent's download bucket, likewise.
+    """
+    writer = wire
+    peer = None
+    peer_protocol = None
+    entry = None
+    tasks = []
+    pex_state = PexPeer()
+    # noinspection PyBroadException
+    try:
+        async with connect_slots or contextlib.nullcontext():
+            peer = Peer(np.zeros(download.total_pieces, dtype=bool))
+            ip, port = stats.endpoint
+            if writer is None:
+                loop = asyncio.get_running_loop()
+                connection = loop.create_connection(WireProtocol, ip, port)
+                _, writer = await asyncio.wait_for(connection, timeout=10)
+            peer_protocol = PeerProtocol(
+                writer, pipeline=RequestPipeline(budget=requests), on_piece=choker.have, name=f"{ip}:{port}",
+                upload_limit=upload_limit.child() if upload_limit else None,
+                download_limit=download_limit.child() if download_limit else None,
             )
-
-            peer_handshake = await peer_protocol.send_handshake(handshake)
+            writer.block_sink = functools.partial(peer_protocol.store_block, download)
+            if wire is None:
+                peer_handshake = await peer_protocol.send_handshake(handshake)
+            else:
+                peer_handshake = await peer_protocol.accept_handshake(handshake)
             if peer_handshake is None: raise # drops connection with peer
+            if peer_handshake[48:68] == handshake[48:68]:
+                return  # connected to ourselves, e.g. through an address from PEX
+
+            if peer_protocol.fast or download.remaining < download.total_pieces:
+                await peer_protocol.send_bitfield(download)
+            if peer_protocol.fast:
+                pieces = allowed_fast_set(ip, handshake[28:48], download.total_pieces)
+                await peer_protocol.send_allowed_fast(download, pieces)
+            if pex is not None and peer_protocol.extended:
+                await peer_protocol.send_extended(HANDSHAKE_ID, pex.handshake())
+
+        if pex is not None and wire is None:
+            pex.joined(pex_state, stats.endpoint)   # it accepted our connection, so others can connect too
+
+        stats.connected_at = time.monotonic()
+        stats.pipeline = peer_protocol.pipeline
+        entry = choker.add(peer, peer_protocol)
+        tasks = [
+            asyncio.create_task(peer_protocol.keep_alive_loop()),
+            asyncio.create_task(peer_protocol.upload_loop(peer, download)),
+        ]
+        if pex is not None and peer_protocol.extended:
+            tasks.append(asyncio.create_task(peer_protocol.pex_loop(pex, pex_state)))
 
-            while not stop_event.is_set():
-                if np.all(download.downloaded):
-                    print(f"{Fore.LIGHTBLUE_EX}DOWNLOAD COMPLETE{Fore.RESET}")
+        while not stop_event.is_set():
+            if not download.remaining:
+                if not seed:
                     stop_event.set()
                     return
+                if peer.pieces == download.total_pieces:
+                    return  # two seeds have nothing to say to each other
 
-                length, message_id, payload = await peer_protocol.read_response()
-                if message_id is not None:
-                    match message_id:
-                        case Message.choke:
-                            peer.peer_choking = True
-                        case Message.unchoke:
-                            peer.peer_choking = False
-                            requested = await peer_protocol.send_request(peer, download)
-                            if not requested:
-                                return
-                        # case Message.interested:
-                        #     await peer_protocol.handle_interested()
-                        # case Message.not_interested:
-                        #     await peer_protocol.handle_not_interested()
-                        case Message.have:
-                            await peer_protocol.handle_have(peer)
-                        case Message.bitfield:
-                            peer.bitfield = await peer_protocol.handle_bitfield(download.total_pieces, payload)
-                            if peer.bitfield is None:
-                                return # drops connection with peer
-                            wanted = np.any(peer.bitfield & ~download.downloaded)
-                            if not wanted:
-                                await peer_protocol.send_not_interested(peer)
-                            else:
-                                await peer_protocol.send_interested(peer)
-                        case Message.piece:
-                            await peer_protocol.handle_piece(peer, download, payload)
-                            # if not peer.peer_choking:
-                            #     await peer_protocol.send_request(peer, download)
-                        # case Message.cancel:
-                        #     await peer_protocol.handle_cancel()
-                        # case Message.port:
-                        #     await peer_protocol.handle_port()
-        except asyncio.TimeoutError:
-            print(f"{Fore.RED}ERROR:{Fore.RESET} Peer did not respond")
-        except ConnectionError as c:
-            print(f"{Fore.RED}ERROR:{Fore.RESET} Connection: {c}")
-        except asyncio.IncompleteReadError:
-            print(f"{Fore.RED}ERROR:{Fore.RESET} Peer closed connection")
-        except asyncio.CancelledError:
-            raise
-        except Exception as e:
-            print(f"{Fore.RED}ERROR:{Fore.RESET} {e}")
-        finally:
-            if keep_alive_task:
-                keep_alive_task.cancel()
-                with contextlib.suppress(asyncio.CancelledError):
-                    await keep_alive_task
+            length, message_id, payload = await peer_protocol.read_response()
+            if message_id is not None:
+                match message_id:
+                    case Message.choke:
+                        peer.peer_choking = True
+                        peer_protocol.cancelled.clear()     # a choking peer drops what it had queued
+                        if not peer_protocol.fast:
+                            peer_protocol.pipeline.requeue()    # Fast peers reject each one instead
+                    case Message.unchoke:
+                        peer.peer_choking = False
+                        peer_protocol.refused.clear()
+                        requested = await peer_protocol.send_request(peer, download)
+                        if not requested and not peer.peer_interested:
+                            return
+                    case Message.interested:
+                        await choker.interested(entry)
+                    case Message.not_interested:
+                        peer.peer_interested = False
+                    case Message.have:
+                        await peer_protocol.handle_have(peer, download, payload)
+                    case Message.bitfield:
+                        bitfield = await peer_protocol.handle_bitfield(download.total_pieces, payload)
+                        if bitfield is None:
+                            return # drops connection with peer
+                        await peer_protocol.set_bitfield(peer, download, bitfield)
+                    case Message.request:
+                        peer_protocol.handle_request(peer, download, payload)
+                    case Message.piece:
+                        await peer_protocol.handle_piece(peer, download, payload)
+                    case Message.cancel:
+                        peer_protocol.handle_cancel(payload)
+                    case (Message.have_all | Message.have_none | Message.reject_request
+                          | Message.allowed_fast | Message.suggest_piece) if not peer_protocol.fast:
+                        return  # Fast Extension messages without the extension
+                    case Message.have_all:
+                        await peer_protocol.set_bitfield(
+                            peer, download, np.ones(download.total_pieces, dtype=bool))
+                    case Message.have_none:
+                        await peer_protocol.set_bitfield(
+                            peer, download, np.zeros(download.total_pieces, dtype=bool))
+                    case Message.reject_request:
+                        await peer_protocol.handle_reject(peer, download, payload)
+                    case Message.allowed_fast:
+                        await peer_protocol.handle_allowed_fast(peer, download, payload)
+                    case Message.suggest_piece:
+                        peer_protocol.handle_suggest(peer, download, payload)
+                    case Message.extended if pex is not None and peer_protocol.extended:
+                        peer_protocol.handle_extended(pex, pex_state, ip, payload)
+                    # case Message.port:
+                    #     await peer_protocol.handle_port()
+    except asyncio.TimeoutError:
+        log.warning("PEER", "did not respond")
+    except ConnectionError as c:
+        log.warning("PEER", "connection: %s", c)
+    except asyncio.IncompleteReadError:
+        log.warning("PEER", "closed connection")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log.error("%s", e)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if entry is not None:
+            choker.remove(entry)
+        if pex is not None:
+            pex.left(pex_state)
+        if peer_protocol is not None:
+            peer_protocol.forget_metrics()
+        if peer is not None:
+            download.picker.remove_bitfield(peer.bitfield)
+        if peer_protocol is not None:
+            download.endgame.forget(peer_protocol, peer_protocol.pipeline.blocks())
+            peer_protocol.pipeline.close()
             async with download.lock:
-                for i in range(download.total_pieces):
-                    if download.downloading[i] and not download.downloaded[i]:
-                        download.downloading[i] = False
-            await close_writer(writer)
+                download.forget(peer_protocol)
+        await close_writer(writer)
 
 
-async def handle_peers(endpoints, handshake, download):
-    semaphore = asyncio.Semaphore(30)
-    stop_event = asyncio.Event()
-    tasks = [
-        asyncio.create_task(
-            handle_peer(endpoint, handshake, download, semaphore, stop_event)
-        )
-        for endpoint in endpoints
-    ]
+async def listen(port: int, handle, max_inbound: int = 20) -> None:
+    """Accepts connections from peers on the announced port until cancelled.
 
-    await stop_event.wait()
+    :param handle: Coroutine function run for every accepted peer with
+        a PeerStats for its address and its WireProtocol, which has no
+        block sink yet.
+    :param max_inbound: Connections beyond this many are closed right away.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = set()
 
-    for t in tasks:
-        t.cancel()
+    async def serve(wire: WireProtocol):
+        while wire.transport is None:
+            await asyncio.sleep(0)      # connection_made runs right after the factory
+        if len(tasks) > max_inbound:
+            await close_writer(wire)
+            return
+        await handle(PeerStats(wire.transport.get_extra_info("peername")[:2]), wire=wire)
 
-    await asyncio.gather(*tasks, return_exceptions=True)
+    def accept():
+        wire = WireProtocol()
+        task = asyncio.create_task(serve(wire))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return wire
 
+    try:
+        server = await loop.create_server(accept, "0.0.0.0", port)
+    except OSError as e:
+        log.error("can't listen on port %d: %s", port, e)
+        return
 
-def contact_peer(decoded, t_response: dict, tracker_payload: dict):
-    # t_response = tracker_response
-    endpoints = sock_addr(t_response)
+    try:
+        await server.serve_forever()
+    finally:
+        server.close()
+        for task in list(tasks):
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-    # BUILDING HANDSHAKE
-    info_hash = tracker_payload["info_hash"]
-    peer_id = tracker_payload["peer_id"]
-    handshake = build_handshake(info_hash, peer_id)
 
-    download = build_download(decoded, t_response)
+async def save_resume_loop(download: Download, info_hash: bytes, interval=30):
+    """Periodically persists the pieces that have reached the disk."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            downloaded = download.downloaded.copy()
+            partial = download.buffers.snapshot()
+            await download.storage.sync()
+            await asyncio.to_thread(resume.save, download, info_hash, downloaded, partial)
+    except asyncio.CancelledError:
+        pass
 
-    with open(download.filename, "wb") as f:
-        f.seek(download.file_size - 1)
-        f.write(b'\0')
 
-    asyncio.run(handle_peers(endpoints, handshake, download))
\ No newline at end of file
+def bootstrap_nodes(decoded: dict) -> list[tuple[str, int]]:
+    """The DHT nodes listed in a trackerless torrent's "nodes" key."""
+    nodes = []
+    for entry in decoded.get(b"nodes", []):
+        if isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], bytes):
+            nodes.append((entry[0].decode(errors="replace"), entry[1]))
+    return nodes
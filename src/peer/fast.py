@@ -0,0 +1,34 @@
+import hashlib
+import ipaddress
+
+ALLOWED_FAST = 10       # pieces granted to every choked peer
+
+
+def allowed_fast_set(ip: str, info_hash: bytes, total_pieces: int, k: int = ALLOWED_FAST) -> list[int]:
+    """The canonical allowed-fast set of BEP 6 for a peer's address.
+
+    Peers behind the same /24 get the same set, so one host can't
+    collect more free pieces by opening connections from several
+    addresses. The set is only defined for IPv4.
+
+    :returns: Up to k piece indexes, empty for IPv6 peers.
+    """
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return []
+    if address.version != 4 or not total_pieces:
+        return []
+
+    k = min(k, total_pieces)
+    pieces = []
+    x = (int(address) & 0xFFFFFF00).to_bytes(4, "big") + info_hash
+    while len(pieces) < k:
+        x = hashlib.sha1(x).digest()
+        for i in range(0, 20, 4):
+            index = int.from_bytes(x[i:i + 4], "big") % total_pieces
+            if index not in pieces:
+                pieces.append(index)
+                if len(pieces) == k:
+                    break
+    return pieces
@@ -0,0 +1,180 @@
+import asyncio
+import math
+import time
+from dataclasses import dataclass
+
+from src.metrics.log import log
+from src.peer.pipeline import RequestPipeline
+from src.torrent.budget import Budget
+
+
+@dataclass
+class PeerStats:
+    """What the connection manager remembers about one endpoint."""
+    endpoint: tuple[str, int]
+
+    attempts: int = 0
+    failures: int = 0               # consecutive sessions that delivered nothing
+    retry_at: float = 0.0
+
+    connected_at: float | None = None
+    pipeline: RequestPipeline | None = None     # set while connected
+    sampled_bytes: int = 0
+    session_bytes: int = 0
+    rate: float = 0.0               # bytes per second, kept after disconnecting
+    rtt: float | None = None
+    churned: bool = False
+
+    def sample(self, elapsed: float | None) -> None:
+        """Folds the bytes received since the last sample into the rate.
+
+        :param elapsed: Seconds since the last sample, or None to only
+            count the bytes, e.g. when the connection has just closed.
+        """
+        if self.pipeline is None:
+            return
+        received = self.pipeline.total_bytes - self.sampled_bytes
+        self.sampled_bytes = self.pipeline.total_bytes
+        self.session_bytes += received
+        if elapsed:
+            self.rate = 0.7 * self.rate + 0.3 * received / elapsed
+        if self.pipeline.min_rtt is not None:
+            self.rtt = self.pipeline.min_rtt
+
+
+class ConnectionManager:
+    """Keeps max_peers connections open to the best endpoints it knows.
+
+    Endpoints never tried before come first, then the ones that were
+    fastest last time. Every churn_interval the slowest connections are
+    closed to make room for untried candidates, so the active set keeps
+    drifting towards the best peers in the swarm. Endpoints that fail
+    or deliver nothing are retried after an exponential backoff.
+
+    At most max_connecting connections are being set up at any time,
+    so a burst of dead endpoints can't stall the established peers.
+    Every connection also counts against budget, when one is shared with
+    the managers of other torrents.
+    """
+
+    def __init__(self, connect, max_peers: int = 30, max_connecting: int = 10,
+                 churn_interval: float = 30, churn_fraction: float = 0.1,
+                 grace: float = 20, backoff: float = 30, max_backoff: float = 1800,
+                 tick: float = 1.0, budget: Budget | None = None):
+        """
+        :param connect: Coroutine function run for every connection with
+            its PeerStats and the semaphore capping connection setup.
+        :param grace: Seconds a new connection gets before it can be churned.
+        :param budget: Connection budget shared with other torrents.
+        """
+        self.connect = connect
+        self.max_peers = max_peers
+        self.connect_slots = asyncio.Semaphore(max_connecting)
+        self.churn_interval = churn_interval
+        self.churn_fraction = churn_fraction
+        self.grace = grace
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.tick = tick
+        self.budget = budget
+
+        self.known: dict[tuple[str, int], PeerStats] = {}
+        self.active: dict[tuple[str, int], asyncio.Task] = {}
+        self.changed = asyncio.Event()
+
+    def add(self, endpoints: list[tuple[str, int]]) -> None:
+        for endpoint in endpoints:
+            if endpoint not in self.known:
+                self.known[endpoint] = PeerStats(endpoint)
+                self.changed.set()
+
+    def candidates(self, now: float) -> list[PeerStats]:
+        """Idle endpoints that may be connected to now, best first."""
+        ready = [
+            stats for endpoint, stats in self.known.items()
+            if endpoint not in self.active and stats.retry_at <= now
+        ]
+        ready.sort(key=lambda stats: (stats.attempts > 0, -stats.rate))
+        return ready
+
+    def fill(self, now: float) -> None:
+        free = self.max_peers - len(self.active)
+        if self.budget is not None:
+            free = min(free, self.budget.free())
+        if free <= 0:
+            return
+        for stats in self.candidates(now)[:free]:
+            stats.attempts += 1
+            if self.budget is not None:
+                self.budget.take(1)
+            task = asyncio.create_task(self.connect(stats, self.connect_slots))
+            self.active[stats.endpoint] = task
+            task.add_done_callback(lambda _, stats=stats: self.finished(stats))
+
+    def finished(self, stats: PeerStats) -> None:
+        self.active.pop(stats.endpoint, None)
+        if self.budget is not None:
+            self.budget.give(1)
+        stats.sample(None)
+        if stats.churned:
+            delay = self.backoff        # slow, not broken
+        elif stats.session_bytes:
+            stats.failures = 0
+            delay = 0
+        else:
+            stats.failures += 1
+            delay = self.backoff * 2 ** (stats.failures - 1)
+        stats.retry_at = time.monotonic() + min(delay, self.max_backoff)
+        stats.connected_at = stats.pipeline = None
+        stats.sampled_bytes = stats.session_bytes = 0
+        stats.churned = False
+        self.changed.set()
+
+    def churn(self, now: float) -> None:
+        """Closes the slowest settled connections if better ones may exist."""
+        untried = sum(1 for stats in self.candidates(now) if not stats.attempts)
+        if not untried or len(self.active) < self.max_peers:
+            return
+        settled = [
+            self.known[endpoint] for endpoint in self.active
+            if self.known[endpoint].connected_at is not None
+            and now - self.known[endpoint].connected_at >= self.grace
+        ]
+        settled.sort(key=lambda stats: stats.rate)
+        drop = min(math.ceil(self.max_peers * self.churn_fraction), untried, len(settled))
+        for stats in settled[:drop]:
+            log.info("CHURN", "dropping %s:%d at %.1f KiB/s", *stats.endpoint, stats.rate / 1024)
+            stats.churned = True
+            self.active[stats.endpoint].cancel()
+
+    async def run(self, peers: asyncio.Queue) -> None:
+        """Feeds endpoints from the trackers into the active set until cancelled."""
+        feed = asyncio.create_task(self.feed(peers))
+        last_sample = last_churn = time.monotonic()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), self.tick)
+                except asyncio.TimeoutError:
+                    pass
+                self.changed.clear()
+
+                now = time.monotonic()
+                if now - last_sample >= self.tick:
+                    for endpoint in self.active:
+                        self.known[endpoint].sample(now - last_sample)
+                    last_sample = now
+                if now - last_churn >= self.churn_interval:
+                    self.churn(now)
+                    last_churn = now
+                self.fill(now)
+        finally:
+            feed.cancel()
+            tasks = list(self.active.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(feed, *tasks, return_exceptions=True)
+
+    async def feed(self, peers: asyncio.Queue) -> None:
+        while True:
+            self.add(await peers.get())
@@ -12,4 +12,12 @@ class Message:
     request: int = 6
     piece: int = 7
     cancel: int = 8
-    port: int = 9
\ No newline at end of file
+    port: int = 9
+    # Fast Extension (BEP 6)
+    suggest_piece: int = 13
+    have_all: int = 14
+    have_none: int = 15
+    reject_request: int = 16
+    allowed_fast: int = 17
+    # Extension Protocol (BEP 10)
+    extended: int = 20
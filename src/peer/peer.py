@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 
 import numpy as np
 
@@ -10,4 +11,11 @@ class Peer:
     peer_interested: bool = False   # peer is interested in this client
 
     am_choking: bool = True         # this client is choking the peer
-    am_interested: bool = False     # this client is interested in the peer
\ No newline at end of file
+    am_interested: bool = False     # this client is interested in the peer
+
+    uploaded: int = 0               # block bytes sent to the peer
+    pieces: int = 0                 # pieces set in bitfield
+
+    # Fast Extension
+    allowed_fast: set[int] = field(default_factory=set)    # may be requested while choked
+    suggested: deque = field(default_factory=lambda: deque(maxlen=16))
\ No newline at end of file
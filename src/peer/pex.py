@@ -0,0 +1,147 @@
+import asyncio
+import ipaddress
+import struct
+import time
+from dataclasses import dataclass, field
+
+from src.torrent import bencode
+
+HANDSHAKE_ID = 0        # extended message id of the BEP 10 handshake
+UT_PEX = 1              # the id the client assigns to ut_pex
+CLIENT_NAME = b"Fluxo"
+
+MAX_ENDPOINTS = 50      # per family and list, as BEP 11 asks
+REACHABLE = 0x10        # added.f flag: the endpoint accepts connections
+
+
+def compact(endpoints: list[tuple[str, int]]) -> tuple[bytes, bytes]:
+    """Packs endpoints into the compact IPv4 and IPv6 strings of ut_pex."""
+    v4, v6 = bytearray(), bytearray()
+    for ip, port in endpoints:
+        address = ipaddress.ip_address(ip)
+        out = v4 if address.version == 4 else v6
+        out += address.packed + struct.pack("!H", port)
+    return bytes(v4), bytes(v6)
+
+
+def endpoints(data: bytes, size: int) -> list[tuple[str, int]]:
+    """Unpacks a compact string of 6-byte IPv4 or 18-byte IPv6 endpoints.
+
+    Entries past MAX_ENDPOINTS, with port 0 or a trailing partial entry
+    are ignored.
+    """
+    found = []
+    for i in range(0, min(len(data) // size, MAX_ENDPOINTS) * size, size):
+        ip = str(ipaddress.ip_address(data[i:i + size - 2]))
+        port = struct.unpack_from("!H", data, i + size - 2)[0]
+        if port:
+            found.append((ip, port))
+    return found
+
+
+@dataclass
+class PexPeer:
+    """ut_pex state of one connection."""
+    endpoint: tuple[str, int] | None = None     # where the peer accepts connections
+    remote_id: int = 0                          # the peer's id for ut_pex, 0 if unsupported
+    sent: set = field(default_factory=set)      # endpoints the peer has been told about
+    received_at: float = float("-inf")
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class PeerExchange:
+    """Peer Exchange (BEP 11) over the extension protocol (BEP 10).
+
+    Keeps the reachable endpoints of every live connection and, every
+    interval, tells each peer which of them were added or dropped since
+    its last message. Endpoints peers send back are deduplicated and put
+    on the same queue as the trackers' peers. Messages arriving less than
+    min_interval after the previous one from the same peer are ignored,
+    so a chatty peer can't flood the connection manager.
+    """
+
+    def __init__(self, peers: asyncio.Queue, port: int, interval: float = 60,
+                 min_interval: float = 30):
+        self.peers = peers
+        self.port = port
+        self.interval = interval
+        self.min_interval = min_interval
+        self.connected: dict[tuple[str, int], int] = {}     # endpoint -> live connections
+        self.seen: set[tuple[str, int]] = set()
+        self.received = 0
+
+    def handshake(self) -> bytes:
+        return bencode.encode({b"m": {b"ut_pex": UT_PEX}, b"p": self.port, b"v": CLIENT_NAME})
+
+    def joined(self, state: PexPeer, endpoint: tuple[str, int]) -> None:
+        if state.endpoint is not None:
+            return
+        state.endpoint = endpoint
+        self.seen.add(endpoint)
+        self.connected[endpoint] = self.connected.get(endpoint, 0) + 1
+
+    def left(self, state: PexPeer) -> None:
+        endpoint = state.endpoint
+        if endpoint is None:
+            return
+        if self.connected[endpoint] > 1:
+            self.connected[endpoint] -= 1
+        else:
+            del self.connected[endpoint]
+
+    def handle_handshake(self, state: PexPeer, ip: str, payload: bytes) -> None:
+        """Reads the peer's extension ids and listen port from its extended handshake."""
+        message = bencode.decode(payload)
+        if not isinstance(message, dict):
+            raise ValueError("extended handshake is not a dictionary")
+        extensions = message.get(b"m", {})
+        remote_id = extensions.get(b"ut_pex", 0) if isinstance(extensions, dict) else 0
+        state.remote_id = remote_id if isinstance(remote_id, int) and 0 < remote_id < 256 else 0
+        port = message.get(b"p")
+        if isinstance(port, int) and 0 < port < 65536:
+            self.joined(state, (ip, port))
+        if state.remote_id:
+            state.ready.set()
+
+    def handle_message(self, state: PexPeer, payload: bytes) -> None:
+        """Queues the endpoints of a ut_pex message that weren't seen before."""
+        now = time.monotonic()
+        if now - state.received_at < self.min_interval:
+            return
+        state.received_at = now
+
+        message = bencode.decode(payload)
+        if not isinstance(message, dict):
+            raise ValueError("ut_pex message is not a dictionary")
+        found = []
+        for key, size in ((b"added", 6), (b"added6", 18)):
+            data = message.get(key, b"")
+            if isinstance(data, bytes):
+                found += (e for e in endpoints(data, size) if e not in self.seen)
+        if found:
+            self.seen.update(found)
+            self.received += len(found)
+            self.peers.put_nowait(found)
+
+    def message(self, state: PexPeer) -> bytes | None:
+        """The next ut_pex message for a peer, or None if nothing changed."""
+        current = self.connected.keys() - {state.endpoint}
+        added = [e for e in current if e not in state.sent]
+        dropped = [e for e in state.sent if e not in current]
+        added = added[:MAX_ENDPOINTS]
+        dropped = dropped[:MAX_ENDPOINTS]
+        if not added and not dropped:
+            return None
+        state.sent.difference_update(dropped)
+        state.sent.update(added)
+
+        added4, added6 = compact(added)
+        dropped4, dropped6 = compact(dropped)
+        return bencode.encode({
+            b"added": added4,
+            b"added.f": bytes([REACHABLE]) * (len(added4) // 6),
+            b"added6": added6,
+            b"added6.f": bytes([REACHABLE]) * (len(added6) // 18),
+            b"dropped": dropped4,
+            b"dropped6": dropped6,
+        })
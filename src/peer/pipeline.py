@@ -0,0 +1,175 @@
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from src.metrics.client import REQUEST_RTT
+from src.torrent.budget import Budget
+
+
+@dataclass
+class RequestPipeline:
+    """Keeps a target number of block requests in flight with one peer.
+
+    The target depth follows the bandwidth-delay product of the peer:
+    measured rate times the lowest observed round trip, doubled so the
+    pipeline keeps probing for more throughput until the link saturates.
+    Every in-flight block also counts against budget, when one is shared
+    with other connections; a pipeline with nothing in flight may still
+    send one request, so no connection starves.
+    """
+    block_size: int = 16384
+    min_depth: int = 4
+    max_depth: int = 256
+    depth: int = 16
+    rate_window: float = 1.0
+
+    pending: deque = field(default_factory=deque)       # (index, begin, length) not yet requested
+    outstanding: dict = field(default_factory=dict)     # (index, begin) -> (length, sent_at)
+
+    min_rtt: float | None = None
+    rate: float = 0.0                                   # bytes per second
+    total_bytes: int = 0                                # received over the connection
+    window_bytes: int = 0
+    window_start: float = field(default_factory=time.monotonic)
+    budget: Budget | None = None
+
+    def queue_piece(self, index: int, blocks: list[tuple[int, int]]) -> None:
+        """Queues the (begin, length) blocks of a claimed piece."""
+        for begin, length in blocks:
+            self.pending.append((index, begin, length))
+
+    def free_slots(self) -> int:
+        slots = max(self.depth - len(self.outstanding), 0)
+        if self.budget is not None:
+            shared = self.budget.free()
+            slots = min(slots, shared if self.outstanding else max(shared, 1))
+        return slots
+
+    def take(self, allowed: set[int] | None = None) -> list[tuple[int, int, int]]:
+        """Moves as many pending blocks as there are free slots to in-flight.
+
+        :param allowed: Only take blocks of these pieces, as while the peer
+            is choking the client but lets it fetch its allowed-fast pieces.
+        :returns: The (index, begin, length) of every block to request now.
+        """
+        now = time.monotonic()
+        blocks = []
+        if allowed is None:
+            for _ in range(min(self.free_slots(), len(self.pending))):
+                index, begin, length = self.pending.popleft()
+                self.outstanding[(index, begin)] = (length, now)
+                blocks.append((index, begin, length))
+            self.taken(len(blocks))
+            return blocks
+
+        kept = deque()
+        slots = self.free_slots()
+        for block in self.pending:
+            if len(blocks) < slots and block[0] in allowed:
+                self.outstanding[block[:2]] = (block[2], now)
+                blocks.append(block)
+            else:
+                kept.append(block)
+        self.pending = kept
+        self.taken(len(blocks))
+        return blocks
+
+    def taken(self, count: int) -> None:
+        if self.budget is not None:
+            self.budget.take(count)
+
+    def given(self, count: int) -> None:
+        if self.budget is not None and count:
+            self.budget.give(count)
+
+    def received(self, index: int, begin: int, length: int) -> bool:
+        """Retires an in-flight block and updates the rate and RTT estimates.
+
+        :returns: False if the block was never requested from this peer.
+        """
+        entry = self.outstanding.pop((index, begin), None)
+        if entry is None:
+            return False
+        self.given(1)
+
+        now = time.monotonic()
+        rtt = now - entry[1]
+        REQUEST_RTT.observe(rtt)
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+
+        self.total_bytes += length
+        self.window_bytes += length
+        elapsed = now - self.window_start
+        if elapsed >= self.rate_window:
+            sample = self.window_bytes / elapsed
+            self.rate = sample if not self.rate else 0.7 * self.rate + 0.3 * sample
+            self.window_bytes = 0
+            self.window_start = now
+            self.adapt()
+        return True
+
+    def adapt(self) -> None:
+        bdp = 2 * self.rate * (self.min_rtt or 0) / self.block_size
+        self.depth = min(max(math.ceil(bdp), self.min_depth), self.max_depth)
+
+    def requeue(self) -> None:
+        """Puts in-flight blocks back in front of the queue.
+
+        A choking peer discards every request it has not served yet,
+        so they have to be sent again after the next unchoke.
+        """
+        for (index, begin), (length, _) in sorted(self.outstanding.items(), reverse=True):
+            self.pending.appendleft((index, begin, length))
+        self.given(len(self.outstanding))
+        self.outstanding.clear()
+
+    def requeue_block(self, index: int, begin: int) -> bool:
+        """Puts a block a choking peer discarded back in front of the queue.
+
+        :returns: False if the block wasn't in flight.
+        """
+        entry = self.outstanding.pop((index, begin), None)
+        if entry is None:
+            return False
+        self.given(1)
+        self.pending.appendleft((index, begin, entry[0]))
+        return True
+
+    def reject(self, index: int, begin: int) -> list[tuple[int, int]] | None:
+        """Drops a block the peer refused, and the rest of its piece still queued.
+
+        :returns: (index, begin) of every block dropped, or None if the
+            block wasn't in flight.
+        """
+        if self.outstanding.pop((index, begin), None) is None:
+            return None
+        self.given(1)
+        dropped = [(index, begin)] + [(i, b) for i, b, _ in self.pending if i == index]
+        self.pending = deque(block for block in self.pending if block[0] != index)
+        return dropped
+
+    def cancel(self, index: int, begin: int) -> bool:
+        """Forgets a block another peer delivered first.
+
+        :returns: True if the request had already been sent, so the
+            peer should be told to cancel it.
+        """
+        if self.outstanding.pop((index, begin), None) is not None:
+            self.given(1)
+            return True
+        for i, block in enumerate(self.pending):
+            if block[0] == index and block[1] == begin:
+                del self.pending[i]
+                break
+        return False
+
+    def close(self) -> None:
+        """Returns the in-flight blocks to the budget once the connection is gone."""
+        self.given(len(self.outstanding))
+        self.outstanding.clear()
+
+    def blocks(self) -> list[tuple[int, int]]:
+        """(index, begin) of every block queued or in flight."""
+        return list(self.outstanding) + [(index, begin) for index, begin, _ in self.pending]
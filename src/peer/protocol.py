@@ -1,32 +1,66 @@
-import hashlib
 import math
 import time
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 import asyncio
 import struct
 
-from typing import Any
+from typing import Any, Callable
 
 import numpy as np
-from colorama import Fore
 
+from src.metrics import client as metrics
+from src.metrics.client import profiler
+from src.metrics.log import log
+from src.peer.bandwidth import TokenBucket
 from src.peer.messages import Message
 from src.peer.peer import Peer
+from src.peer.pex import HANDSHAKE_ID, UT_PEX, PeerExchange, PexPeer
+from src.peer.pipeline import RequestPipeline
+from src.peer.wire import WireProtocol
 from src.torrent.download import Download
 
+REQUEST = struct.Struct("!IBIII")
+PIECE = struct.Struct("!IBII")
+HAVE = struct.Struct("!IBI")
+MAX_REQUEST = 128 * 1024        # larger requests are dropped, as most clients do
+MAX_UPLOADS = 256               # requests queued per peer
+FAST_BIT = 0x04                 # last reserved byte of the handshake, BEP 6
+EXTENSION_BIT = 0x10            # sixth reserved byte of the handshake, BEP 10
 
-@dataclass
+
+@dataclass(eq=False)
 class PeerProtocol:
-    writer: asyncio.StreamWriter
-    reader: asyncio.StreamReader
+    wire: WireProtocol
     last_sent: float = None
+    pipeline: RequestPipeline = field(default_factory=RequestPipeline)
+    on_piece: Callable[[int], None] | None = None   # called with every verified piece
+    name: str = ""                                  # "ip:port", the peer label of its metrics
+
+    uploads: deque = field(default_factory=deque)   # (index, begin, length) the peer asked for
+    upload_ready: asyncio.Event = field(default_factory=asyncio.Event)
+
+    fast: bool = False                              # both sides support the Fast Extension
+    granted: set[int] = field(default_factory=set)  # pieces the peer may request while choked
+    cancelled: set = field(default_factory=set)     # (index, begin) cancelled after being requested
+    refused: set[int] = field(default_factory=set)  # pieces the peer rejected since it last unchoked us
+    extended: bool = False                          # both sides support the Extension Protocol
+
+    upload_limit: TokenBucket | None = None         # the peer's own buckets, children of the torrent's
+    download_limit: TokenBucket | None = None
 
     def __post_init__(self):
         self.last_sent = time.monotonic()
+        self.bytes_received = metrics.PEER_BYTES_RECEIVED.labels(self.name)
+        self.bytes_sent = metrics.PEER_BYTES_SENT.labels(self.name)
+
+    def forget_metrics(self) -> None:
+        metrics.PEER_BYTES_RECEIVED.remove(self.name)
+        metrics.PEER_BYTES_SENT.remove(self.name)
 
     async def send(self, data: bytes):
-        self.writer.write(data)
-        await self.writer.drain()
+        self.wire.write(data)
+        await self.wire.drain()
         self.last_sent = time.monotonic()
 
     async def send_handshake(self, handshake: bytes) -> bytes | None:
@@ -38,20 +72,34 @@ class PeerProtocol:
         await self.send(handshake)
         return await self.read_handshake(handshake)
 
+    async def accept_handshake(self, handshake: bytes) -> bytes | None:
+        """Answers the handshake of a peer that connected to the client.
+
+        :returns: The peer's handshake bytes if valid, otherwise None
+        """
+        response = await self.read_handshake(handshake)
+        if response is not None:
+            await self.send(handshake)
+        return response
+
     async def read_handshake(self, handshake: bytes) -> bytes | None:
         """ Reads and validates peer's handshake.
 
         Each handshake should be 68 bytes long. The info_hash
         of the response, which is 20 bytes long and is located at
         positions 28 to 48, should equal the client's info_hash.
+        The Fast Extension and the Extension Protocol are used if both
+        sides set their reserved bits.
 
         :param handshake: Handshake message.
         :returns: The peer's handshake bytes if valid, otherwise None.
         """
         response = await asyncio.wait_for(
-            self.reader.readexactly(68), timeout=10
+            self.wire.read_handshake(), timeout=10
         )
         if response[28:48] == handshake[28:48]:
+            self.fast = bool(response[27] & handshake[27] & FAST_BIT)
+            self.extended = bool(response[25] & handshake[25] & EXTENSION_BIT)
             return response
         return None
 
@@ -60,21 +108,19 @@ class PeerProtocol:
 
             Peer's responds with one of the values in the "Message" dataclass.
         """
-        peer.am_choking = False
         peer.am_interested = True
 
         message = struct.pack("!IB", msg_len := 1, Message.interested)
         await self.send(message)
 
     async def send_not_interested(self, peer: Peer) -> None:
-        peer.am_choking = True
         peer.am_interested = False
 
         message = struct.pack("!IB", msg_len := 1, Message.not_interested)
         await self.send(message)
 
     async def send_keep_alive(self) -> None:
-        print(f"{Fore.CYAN}KEEP-ALIVE:{Fore.RESET} client has avoided timeout")
+        log.debug("KEEP-ALIVE", "client has avoided timeout")
         message = struct.pack("!I", msg_len := 0)
         # TODO IMPLEMENT COUNTER
         await self.send(message)
@@ -88,18 +134,78 @@ class PeerProtocol:
         except asyncio.CancelledError:
             pass
 
-    # TODO
-    # async def handle_interested(self):
-    #     ...
+    async def send_choke(self, peer: Peer) -> None:
+        """Stops serving the peer; its queued requests are dropped.
+
+        With the Fast Extension, requests for allowed-fast pieces are
+        still served and every other one is rejected explicitly.
+        """
+        peer.am_choking = True
+        if self.fast:
+            kept = deque()
+            for request in self.uploads:
+                if request[0] in self.granted:
+                    kept.append(request)
+                else:
+                    self.send_reject(*request)
+            self.uploads = kept
+        else:
+            self.uploads.clear()
+        await self.send(struct.pack("!IB", msg_len := 1, Message.choke))
+
+    async def send_unchoke(self, peer: Peer) -> None:
+        peer.am_choking = False
+        await self.send(struct.pack("!IB", msg_len := 1, Message.unchoke))
+
+    async def send_bitfield(self, download: Download) -> None:
+        """Announces the client's pieces; have_all or have_none when the peer knows them."""
+        if self.fast and not download.remaining:
+            await self.send(struct.pack("!IB", 1, Message.have_all))
+        elif self.fast and download.remaining == download.total_pieces:
+            await self.send(struct.pack("!IB", 1, Message.have_none))
+        else:
+            bits = np.packbits(download.downloaded).tobytes()
+            await self.send(struct.pack("!IB", 1 + len(bits), Message.bitfield) + bits)
 
-    # TODO
-    # async def handle_not_interested(self):
-    #     ...
+    async def send_allowed_fast(self, download: Download, pieces: list[int]) -> None:
+        """Lets the peer request these pieces even while it is choked.
 
-    async def handle_have(self, peer: Peer):
-        index = await self.reader.readexactly(4)
-        index = struct.unpack("!I", index)[0]
+        Only the ones the client has are announced, but all of them are
+        served once the client gets them.
+        """
+        self.granted = set(pieces)
+        messages = [HAVE.pack(5, Message.allowed_fast, index) for index in pieces if download.downloaded[index]]
+        if messages:
+            await self.send(b"".join(messages))
+
+    def send_reject(self, index: int, begin: int, length: int) -> None:
+        """Tells a Fast Extension peer a request won't be served."""
+        if self.fast:
+            self.wire.write(REQUEST.pack(13, Message.reject_request, index, begin, length))
+
+    def send_have(self, index: int) -> None:
+        """Announces a new piece without waiting for the socket to drain."""
+        self.wire.write(HAVE.pack(5, Message.have, index))
+
+    async def handle_have(self, peer: Peer, download: Download, payload):
+        index = struct.unpack("!I", payload)[0]
+        if index >= download.total_pieces or peer.bitfield[index]:
+            return
         peer.bitfield[index] = True
+        peer.pieces += 1
+        self.refused.discard(index)
+        download.picker.add_have(index)
+
+    async def set_bitfield(self, peer: Peer, download: Download, bitfield: np.ndarray) -> None:
+        """Replaces the peer's pieces, from a bitfield, have_all or have_none."""
+        download.picker.remove_bitfield(peer.bitfield)
+        download.picker.add_bitfield(bitfield)
+        peer.bitfield = bitfield
+        peer.pieces = int(np.count_nonzero(bitfield))
+        if np.any(bitfield & ~download.downloaded):
+            await self.send_interested(peer)
+        else:
+            await self.send_not_interested(peer)
 
     @staticmethod
     async def handle_bitfield(total_pieces, payload):
@@ -113,104 +219,338 @@ class PeerProtocol:
 
         rounded_size = total_pieces + 8 - (total_pieces % 8)
         if bits.size > rounded_size:
-            print(f"{Fore.RED}ERROR:{Fore.RESET} bitfield larger than expected")
+            log.error("bitfield larger than expected")
             return None
         return bits[:total_pieces]
 
-    async def handle_piece(self, peer: Peer, download: Download, payload):
-        index = struct.unpack("!I", payload[0:4])[0]
-        begin = struct.unpack("!I", payload[4:8])[0]
-        block = payload[8:]
+    def store_block(self, download: Download, index: int, begin: int, block: memoryview) -> None:
+        """Copies a block out of the receive buffer into its piece buffer.
 
-        full_piece = None
+        Called synchronously by the wire protocol while the frame is
+        still in its buffer, so this is the only copy of the block data.
+        A block that can't be added is dropped: if the peer was asked
+        for it, it's a duplicate another copy beat, counted as wasted;
+        otherwise it was never requested or doesn't fit its piece, and
+        is counted separately.
+        """
+        download.bytes_downloaded += len(block)
+        buffer = download.buffers.get(index)
+        if profiler.enabled:
+            started = time.perf_counter()
+            added = buffer is not None and buffer.add(begin, block)
+            profiler.record("assemble", time.perf_counter() - started)
+        else:
+            added = buffer is not None and buffer.add(begin, block)
+        cancelled = False
+        if self.cancelled and (index, begin) in self.cancelled:
+            self.cancelled.discard((index, begin))
+            cancelled = True
+        if added:
+            return
+        if cancelled or (index, begin) in self.pipeline.outstanding or download.endgame.asked(self, index, begin):
+            download.endgame.wasted(len(block))
+        else:
+            metrics.UNREQUESTED_BYTES.inc(len(block))
+            log.debug("PEER", "%s sent a block that wasn't requested: %d:%d", self.name, index, begin)
 
-        async with download.lock:
-            if index not in download.piece_blocks:
-                download.piece_blocks[index] = {}
+    async def handle_piece(self, peer: Peer, download: Download, payload):
+        index, begin, length = payload
 
-            if begin in download.piece_blocks[index]:
-                return
+        self.pipeline.received(index, begin, length)
+        self.bytes_received.inc(length)
+        for other in download.endgame.arrived(self, index, begin):
+            other.cancel_block(index, begin, length)
+        if self.can_request(peer):
+            await self.send_request(peer, download, wait=False)
 
-            download.piece_blocks[index][begin] = block
+        await self.complete_piece(download, index)
 
-            if len(download.piece_blocks[index]) == download.total_blocks:
-                blocks = download.piece_blocks.pop(index)
-                full_piece = b''.join(blocks[offset] for offset in sorted(blocks))
+        # the pipeline ran dry while the buffer pool was full
+        if self.can_request(peer) and not self.pipeline.outstanding:
+            await self.send_request(peer, download)
+        await self.pace_download(length)
 
-        if full_piece is None:
+    async def pace_download(self, length: int) -> None:
+        """Stops reading from the peer until length bytes fit in its download limit."""
+        if self.download_limit is None:
+            return
+        pending = self.download_limit.reserve(length)
+        if pending:
+            self.wire.hold(True)
+            try:
+                await self.download_limit.wait(pending)
+            finally:
+                self.wire.hold(False)
+
+    async def complete_piece(self, download: Download, index: int):
+        async with download.lock:
+            buffer = download.buffers.take_complete(index)
+        if buffer is None:
             return
 
+        full_piece = memoryview(buffer.data)
         expected_hash = download.pieces[index * 20: (index + 1) * 20]
-        hash_obtained = hashlib.sha1(full_piece).digest()
-
-        if expected_hash != hash_obtained:
-            print(f"{Fore.RED}ERROR:{Fore.RESET}: peer has sent invalid block")
+        if profiler.enabled:
+            started = time.monotonic()
+            profiler.record("receive", started - buffer.started)
+
+        if not await download.verifier.verify(full_piece, expected_hash):
+            log.error("peer has sent invalid block")
+            metrics.PIECES_FAILED.inc()
+            download.buffers.release(buffer)
+            async with download.lock:
+                download.unclaim(index)
             return
 
-        print(f"{Fore.GREEN}SUCCESS:{Fore.RESET} piece number {index} has been downloaded")
+        metrics.PIECES_VERIFIED.inc()
+        metrics.PIECE_RATE.mark()
+        log.info("SUCCESS", "piece number %d has been downloaded", index)
+        if profiler.enabled:
+            verified = time.monotonic()
+            profiler.record("verify", verified - started)
 
-        if not peer.peer_choking:
-            await self.send_request(peer, download)
+        # waits here while the disk is behind, which stops reads from this peer
+        await download.storage.put(index * download.piece_length, full_piece)
+        download.buffers.release(buffer)
+        if profiler.enabled:
+            profiler.record("write", time.monotonic() - verified)
 
         async with download.lock:
-            download.downloaded[index] = True
-            download.downloading[index] = False
+            download.finish(index)
 
-        position = index * download.piece_length
+        if self.on_piece is not None:
+            self.on_piece(index)
+        if not download.remaining:
+            log.info("DOWNLOAD COMPLETE")
 
-        if index == download.total_pieces - 1:
-            expected_size = download.file_size - position
-            full_piece = full_piece[:expected_size]
+    def handle_request(self, peer: Peer, download: Download, payload) -> None:
+        """Queues a block request from the peer for upload_loop.
 
-        with open(download.filename, "r+b") as f:
-            f.seek(position)
-            f.write(full_piece)
-
-    async def handle_cancel(self):
-        ...
+        Requests from choked peers, for pieces the client doesn't have
+        or for blocks that don't fit in the piece are ignored, or
+        rejected if the peer supports the Fast Extension. Choked peers
+        may still request their allowed-fast pieces.
+        """
+        index, begin, length = struct.unpack("!III", payload)
+        if (peer.am_choking and index not in self.granted) or len(self.uploads) >= MAX_UPLOADS:
+            self.send_reject(index, begin, length)
+            return
+        if index >= download.total_pieces or not download.downloaded[index]:
+            self.send_reject(index, begin, length)
+            return
+        if not 0 < length <= MAX_REQUEST or begin + length > download.piece_size(index):
+            self.send_reject(index, begin, length)
+            return
+        self.uploads.append((index, begin, length))
+        self.upload_ready.set()
 
-    async def send_request(self, peer: Peer, download: Download):
+    def cancel_block(self, index: int, begin: int, length: int) -> None:
+        """Withdraws a request for a block another peer has delivered."""
+        if self.pipeline.cancel(index, begin):
+            self.cancelled.add((index, begin))
+            self.wire.write(REQUEST.pack(13, Message.cancel, index, begin, length))
 
+    def handle_cancel(self, payload) -> None:
+        try:
+            self.uploads.remove(struct.unpack("!III", payload))
+        except ValueError:
+            pass    # already sent, or never queued
+
+    async def handle_reject(self, peer: Peer, download: Download, payload) -> None:
+        """Gives up a block the peer won't send, rather than waiting for it forever.
+
+        A choking peer rejects everything it had queued, so those blocks
+        are requeued for the next unchoke, as with peers without the Fast
+        Extension. Any other reject means the peer won't serve the piece:
+        it is released for other peers and not requested from this one
+        again until the peer unchokes us anew or announces it.
+        """
+        index, begin, _ = struct.unpack("!III", payload)
+        if peer.peer_choking and index not in peer.allowed_fast:
+            self.pipeline.requeue_block(index, begin)
+            return
+        dropped = self.pipeline.reject(index, begin)
+        if dropped is None:
+            return
+        self.refused.add(index)
         async with download.lock:
-            next_piece = None
-            for piece_index in range(download.total_pieces):
-                if (
-                        peer.bitfield[piece_index]
-                        and not download.downloaded[piece_index]
-                        and not download.downloading[piece_index]
-                ):
-                    next_piece = piece_index
-                    download.downloading[piece_index] = True
-                    break
-
-            if next_piece is None:
-                return 0
-
-        if next_piece == download.total_pieces - 1:
-            piece_size = download.file_size - next_piece * download.piece_length
-        else:
-            piece_size = download.piece_length
-
-        block_size = download.block_size
-        total_blocks = math.ceil(piece_size / block_size)
-
-        print(f"{Fore.YELLOW}REQUEST:{Fore.RESET} piece number {next_piece}")
-
-        for block in range(total_blocks):
-            begin = block * block_size
-            length = min(block_size, piece_size - begin)
+            download.endgame.forget(self, dropped)
+            if download.owners.get(index) is self:
+                download.unclaim(index)
+        if self.can_request(peer):
+            await self.send_request(peer, download, wait=False)
+
+    async def handle_allowed_fast(self, peer: Peer, download: Download, payload) -> None:
+        """Starts downloading an allowed-fast piece right away if the peer is choking us."""
+        index = struct.unpack("!I", payload)[0]
+        if index >= download.total_pieces:
+            return
+        peer.allowed_fast.add(index)
+        if peer.peer_choking and peer.bitfield[index] and not download.downloaded[index]:
+            await self.send_request(peer, download, wait=False)
 
-            message = struct.pack(
-                "!IBIII",
-                13,
-                Message.request,
-                next_piece,
-                begin,
-                length,
-            )
-            await self.send(message)
+    @staticmethod
+    def handle_suggest(peer: Peer, download: Download, payload) -> None:
+        index = struct.unpack("!I", payload)[0]
+        if index < download.total_pieces and index not in peer.suggested:
+            peer.suggested.append(index)
 
-        return 1
+    @staticmethod
+    def can_request(peer: Peer) -> bool:
+        """Whether the peer would serve any request: unchoked, or with allowed-fast pieces."""
+        return not peer.peer_choking or bool(peer.allowed_fast)
+
+    async def upload_loop(self, peer: Peer, download: Download) -> None:
+        """Sends the blocks the peer requested, in order, from the read cache."""
+        while True:
+            await self.upload_ready.wait()
+            while self.uploads:
+                index, begin, length = self.uploads.popleft()
+                block = await download.cache.block(index, begin, length)
+                if self.upload_limit is not None:
+                    await self.upload_limit.consume(length)
+                if peer.am_choking and index not in self.granted:
+                    self.send_reject(index, begin, length)
+                    continue    # choked while the piece was being read
+                self.wire.write(PIECE.pack(9 + length, Message.piece, index, begin))
+                self.wire.write(block)
+                await self.wire.drain()
+                self.last_sent = time.monotonic()
+                peer.uploaded += length
+                download.bytes_uploaded += length
+                self.bytes_sent.inc(length)
+            self.upload_ready.clear()
+
+    async def send_request(self, peer: Peer, download: Download, wait=True) -> int:
+        """Tops up the peer's request pipeline.
+
+        New pieces are claimed whenever the pipeline has more free slots
+        than queued blocks, so requests keep flowing across piece
+        boundaries. Pieces other peers left half done are taken first,
+        then the ones the peer suggested. While the peer is choking the
+        client only its allowed-fast pieces are requested. Every new
+        request goes out in a single write.
+
+        :param wait: When the buffer pool is full and nothing is in flight,
+            wait for room instead of returning empty-handed.
+        :returns: Number of requests in flight with the peer.
+        """
+        pipeline = self.pipeline
+        buffers = download.buffers
+        ready = []
+        allowed = None
+        available = peer.bitfield
+        if peer.peer_choking:
+            allowed = peer.allowed_fast
+            available = np.zeros_like(peer.bitfield)
+            available[list(allowed)] = True
+            available &= peer.bitfield
+        if self.refused:
+            available = available.copy()
+            available[list(self.refused)] = False
+
+        while pipeline.free_slots() > len(pipeline.pending):
+            async with download.lock:
+                wanted = pipeline.free_slots() - len(pipeline.pending)
+                needed = math.ceil(wanted / download.total_blocks)
+                room = buffers.room(download.piece_length)
+                partial = buffers.partial(available, download.downloading)[:needed]
+                suggested = [
+                    index for index in peer.suggested
+                    if available[index] and not download.downloaded[index] and not download.downloading[index]
+                ][:min(needed - len(partial), room)]
+                download.claim(self, partial + suggested)
+                picked = download.picker.pick(
+                    available,
+                    download.downloaded,
+                    download.downloading,
+                    min(needed - len(partial) - len(suggested), room - len(suggested)),
+                ).tolist()
+                download.claim(self, picked)
+                claimed = partial + suggested + picked
+                for index in claimed:
+                    buffers.acquire(index, download.piece_size(index))
+
+                download.endgame.active = download.all_claimed()
+                duplicates = 0
+                if not claimed and download.endgame.active:
+                    duplicates = self.endgame_blocks(available, download, wanted)
+
+            for next_piece in claimed:
+                log.debug("REQUEST", "piece number %d", next_piece)
+                missing = buffers.get(next_piece).missing_blocks()
+                if missing:
+                    pipeline.queue_piece(next_piece, missing)
+                    download.endgame.requested(self, next_piece, missing)
+                else:
+                    # all blocks arrived, but whoever got the last one left before hashing
+                    ready.append(next_piece)
+
+            if claimed or duplicates or not wait or pipeline.outstanding or pipeline.pending:
+                break
+            if buffers.room(download.piece_length):
+                break   # the peer has nothing we still need
+            await buffers.wait_for_room(download.piece_length)
+
+        blocks = pipeline.take(allowed)
+        if blocks:
+            await self.send(b"".join(
+                REQUEST.pack(13, Message.request, index, begin, length)
+                for index, begin, length in blocks
+            ))
+
+        for index in ready:
+            await self.complete_piece(download, index)
+
+        return len(pipeline.outstanding)
+
+    def endgame_blocks(self, available: np.ndarray, download: Download, wanted: int) -> int:
+        """Queues blocks other peers are already fetching, once nothing is left to claim.
+
+        Only blocks this peer hasn't been asked for yet are queued, so
+        each block is requested at most once per peer.
+
+        :param available: The pieces that can be requested from the peer.
+        :returns: Number of blocks queued.
+        """
+        queued = 0
+        for index in download.owners:
+            if not available[index]:
+                continue
+            buffer = download.buffers.get(index)
+            if buffer is None:
+                continue    # complete and being hashed
+            blocks = [
+                (begin, length) for begin, length in buffer.missing_blocks()
+                if not download.endgame.asked(self, index, begin)
+            ][:wanted - queued]
+            if blocks:
+                self.pipeline.queue_piece(index, blocks)
+                download.endgame.requested(self, index, blocks)
+                queued += len(blocks)
+            if queued >= wanted:
+                break
+        return queued
+
+    async def send_extended(self, message_id: int, payload: bytes) -> None:
+        await self.send(struct.pack("!IBB", 2 + len(payload), Message.extended, message_id) + payload)
+
+    def handle_extended(self, pex: PeerExchange, state: PexPeer, ip: str, payload) -> None:
+        """Dispatches an extended message by the id the client assigned to it."""
+        message_id, body = payload[0], payload[1:]
+        if message_id == HANDSHAKE_ID:
+            pex.handle_handshake(state, ip, body)
+        elif message_id == UT_PEX:
+            pex.handle_message(state, body)
+
+    async def pex_loop(self, pex: PeerExchange, state: PexPeer) -> None:
+        """Sends peer list updates once the peer has announced ut_pex support."""
+        await state.ready.wait()
+        while True:
+            message = pex.message(state)
+            if message is not None:
+                await self.send_extended(state.remote_id, message)
+            await asyncio.sleep(pex.interval)
 
     async def handle_port(self):
         ...
@@ -221,19 +561,10 @@ class PeerProtocol:
         The response from a peer may vary in length:
         If length is 0, peer is sending a "keep-alive" message.
         If 1, it sent requests of (un)choke or (not) interested.
-        Otherwise, peer has sent data on the files requested.
+        Otherwise, peer has sent data on the files requested. Block data
+        of piece messages has already been stored by store_block, so their
+        payload is only (index, begin, length).
 
         :return: A tuple with length, and message_id and payload or None
         """
-        length = await self.reader.readexactly(4)
-        length = struct.unpack("!I", length)[0]
-        if length == 0:
-            return length, None, None
-
-        message_id = await self.reader.readexactly(1)
-        message_id = struct.unpack("!B", message_id)[0]
-        if length == 1:
-            return length, message_id, None
-
-        payload = await self.reader.readexactly(length - 1)
-        return length, message_id, payload
\ No newline at end of file
+        return await self.wire.read_message()
@@ -0,0 +1,202 @@
+import asyncio
+import time
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+from src.metrics import client as metrics
+from src.metrics.log import log
+from src.peer.bandwidth import TokenBucket
+from src.torrent.download import Download
+from src.tracker.http import HttpClient
+
+MAX_RANGE = 4 * 1024 * 1024     # adjacent pieces fetched with one request
+IDLE = 1.0                      # seconds between looks while peers hold every missing piece
+
+
+class WebSeed:
+    """An HTTP mirror of the torrent (BEP 19), downloaded from next to the peers.
+
+    Each of streams tasks claims a run of adjacent pieces nobody is
+    downloading, starting from the picker's choice so that priority
+    windows and rarity still decide what comes next, and fetches the
+    run with one Range request per file it covers. Requests go over
+    keep-alive connections pooled for the mirror. Pieces are verified
+    and stored like the ones peers send. A mirror that fails or sends
+    bad data is retried after a backoff.
+    """
+
+    def __init__(self, url: str, info: dict, download: Download, stop_event: asyncio.Event,
+                 seed: bool = False, streams: int = 4, max_range: int = MAX_RANGE,
+                 on_piece=None, limit: TokenBucket | None = None,
+                 backoff: float = 30, max_backoff: float = 1800):
+        """
+        :param on_piece: Called with the index of every piece stored.
+        :param limit: Paces the mirror's downloads, like a peer's bucket.
+        """
+        self.url = url
+        self.urls = file_urls(url, info)
+        self.host = urlsplit(url).netloc
+        self.download = download
+        self.stop_event = stop_event
+        self.seed = seed
+        self.streams = streams
+        self.max_range = max_range
+        self.on_piece = on_piece
+        self.limit = limit
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.http = HttpClient(timeout=60, max_idle=streams)
+        self.everything = np.ones(download.total_pieces, dtype=bool)
+        self.failures = 0
+        self.retry_at = 0.0
+        self.received = 0
+        self.bytes = metrics.WEBSEED_BYTES.labels(self.host)
+
+    async def run(self) -> None:
+        """Downloads until every piece is in, then stops the torrent unless it seeds."""
+        streams = [asyncio.create_task(self.stream()) for _ in range(self.streams)]
+        try:
+            # a stream only returns once the download is complete
+            done, _ = await asyncio.wait(streams, return_when=asyncio.FIRST_COMPLETED)
+            for stream in done:
+                stream.result()
+        finally:
+            for stream in streams:
+                stream.cancel()
+            await asyncio.gather(*streams, return_exceptions=True)
+            async with self.download.lock:
+                self.download.forget(self)
+            self.http.close()
+        if not self.seed:
+            self.stop_event.set()
+
+    async def stream(self) -> None:
+        download = self.download
+        while download.remaining:
+            delay = self.retry_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            run = await self.claim()
+            if not run:
+                await asyncio.sleep(IDLE)
+                continue
+            try:
+                data = await self.fetch(
+                    run[0] * download.piece_length, sum(download.piece_size(index) for index in run),
+                )
+                await self.store(run, data)
+            except (OSError, ValueError, EOFError, asyncio.TimeoutError, asyncio.LimitOverrunError) as e:
+                self.failed(f"{type(e).__name__}: {e}")
+            finally:
+                # whatever wasn't stored
+                download.buffers.budget.give(sum(download.piece_size(index) for index in run))
+                async with download.lock:
+                    for index in run:
+                        if download.owners.get(index) is self:
+                            download.unclaim(index)
+
+    async def claim(self) -> list[int]:
+        """Claims the picker's next piece and the unclaimed ones after it, up to max_range.
+
+        Their size is taken from the buffer budget until they're stored.
+        """
+        download = self.download
+        buffers = download.buffers
+        await buffers.wait_for_room(download.piece_length)
+        async with download.lock:
+            room = min(buffers.room(download.piece_length), max(self.max_range // download.piece_length, 1))
+            picked = download.picker.pick(self.everything, download.downloaded, download.downloading, 1)
+            if not room or not picked.size:
+                return []
+            run = [int(picked[0])]
+            while len(run) < room:
+                index = run[-1] + 1
+                if index >= download.total_pieces or download.downloaded[index] or download.downloading[index]:
+                    break
+                run.append(index)
+            download.claim(self, run)
+            buffers.budget.take(sum(download.piece_size(index) for index in run))
+        return run
+
+    async def fetch(self, offset: int, length: int) -> bytes:
+        """Reads a range of the torrent from the mirror, one request per file it spans."""
+        parts = []
+        for i, file_offset, size in self.download.layout.spans(offset, length):
+            status, reason, body = await self.http.get(
+                self.urls[i], {"Range": f"bytes={file_offset}-{file_offset + size - 1}"},
+            )
+            if status == 200 and len(body) == self.download.layout.files[i][1]:
+                body = body[file_offset:file_offset + size]     # the server ignored the range
+            elif status != 206 or len(body) != size:
+                raise ValueError(f"{self.urls[i]} answered {status} {reason} with {len(body)} bytes")
+            parts.append(body)
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    async def store(self, run: list[int], data: bytes) -> None:
+        """Verifies and stores the pieces of a fetched run, removing each one stored from run."""
+        download = self.download
+        view = memoryview(data)
+        start = run[0] * download.piece_length
+        for index in list(run):
+            begin = index * download.piece_length - start
+            size = download.piece_size(index)
+            piece = view[begin:begin + size]
+            download.bytes_downloaded += size
+            self.received += size
+            self.bytes.inc(size)
+            if self.limit is not None:
+                await self.limit.consume(size)
+
+            if not await download.verifier.verify(piece, download.pieces[index * 20:(index + 1) * 20]):
+                metrics.PIECES_FAILED.inc()
+                raise ValueError(f"piece {index} failed the hash check")
+
+            metrics.PIECES_VERIFIED.inc()
+            metrics.PIECE_RATE.mark()
+            log.info("SUCCESS", "piece number %d has been downloaded", index)
+            await download.storage.put(index * download.piece_length, piece)
+            download.buffers.budget.give(size)
+            run.remove(index)
+
+            async with download.lock:
+                download.buffers.discard(index)     # a copy a peer left half done
+                finished = download.finish(index)
+            self.failures = 0
+            if finished and self.on_piece is not None:
+                self.on_piece(index)
+        if not download.remaining:
+            log.info("DOWNLOAD COMPLETE")
+
+    def failed(self, reason: str) -> None:
+        self.failures += 1
+        delay = min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+        self.retry_at = time.monotonic() + delay
+        log.warning("WEBSEED", "%s: %s, retrying in %.0fs", self.url, reason, delay)
+
+
+def file_urls(url: str, info: dict) -> list[str]:
+    """Each file's URL on a mirror, in the order of the torrent's files.
+
+    A URL ending in / is a directory holding the torrent's name; any
+    other single-file URL is the file itself.
+    """
+    name = quote(info[b"name"])
+    if b"files" not in info:
+        return [url + name if url.endswith("/") else url]
+    root = url.rstrip("/") + "/" + name
+    return [root + "/" + "/".join(quote(part) for part in f[b"path"]) for f in info[b"files"]]
+
+
+def web_seeds(decoded: dict) -> list[str]:
+    """The mirrors in a torrent's "url-list", a single URL or a list of them."""
+    urls = decoded.get(b"url-list", [])
+    if isinstance(urls, bytes):
+        urls = [urls]
+    return [
+        url.decode(errors="replace") for url in urls
+        if isinstance(url, bytes) and url.startswith((b"http://", b"https://"))
+    ]
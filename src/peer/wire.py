@@ -0,0 +1,207 @@
+import asyncio
+import struct
+from collections import deque
+from typing import Callable
+
+from src.peer.messages import Message
+
+LENGTH = struct.Struct("!I")
+PIECE_HEADER = struct.Struct("!II")
+
+HANDSHAKE_LENGTH = 68
+MAX_FRAME = 4 * 1024 * 1024     # bitfield of ~32M pieces, far above any block
+MIN_READ = 32 * 1024
+
+
+class WireProtocol(asyncio.BufferedProtocol):
+    """Peer-wire receiver that parses frames in place.
+
+    The transport reads straight into one preallocated buffer and frames
+    are parsed with precompiled structs where they landed. Unparsed bytes
+    are moved back to the start only when less than MIN_READ is left at
+    the tail, which copies at most one partial frame. Block payloads are
+    handed to block_sink as memoryviews of the buffer, so they are copied
+    exactly once, into their destination; the sink must not keep the view.
+
+    Other messages are queued for read_message(), and the socket stops
+    being read while too many of them are waiting, or while held.
+    """
+
+    def __init__(self, block_sink: Callable[[int, int, memoryview], None] | None = None,
+                 buffer_size: int = 256 * 1024, max_queued: int = 256):
+        self.block_sink = block_sink
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0                  # first unparsed byte
+        self.end = 0                    # end of received data
+        self.handshaken = False
+
+        self.transport = None
+        self.messages = deque()
+        self.max_queued = max_queued
+        self.reading_paused = False
+        self.held = False
+        self.waiter = None
+        self.exception = None
+
+        self.writing_paused = False
+        self.drain_waiter = None
+        self.closed = None
+
+    # asyncio callbacks
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_lost(self, exc):
+        self.exception = exc or asyncio.IncompleteReadError(b"", None)
+        self.wake(self.waiter)
+        self.wake(self.drain_waiter)
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def eof_received(self):
+        return False
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self.wake(self.drain_waiter)
+
+    def get_buffer(self, sizehint):
+        if len(self.buffer) - self.end < MIN_READ:
+            pending = self.end - self.start
+            if len(self.buffer) - pending < MIN_READ:
+                # a single frame larger than the buffer
+                buffer = bytearray(2 * len(self.buffer))
+                buffer[:pending] = self.view[self.start:self.end]
+                self.buffer, self.view = buffer, memoryview(buffer)
+            else:
+                self.buffer[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+        try:
+            self.parse()
+        except ValueError as e:
+            self.exception = e
+            self.transport.close()
+        if self.start == self.end:
+            self.start = self.end = 0
+        self.wake(self.waiter)
+        if len(self.messages) >= self.max_queued and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    # parsing
+
+    def parse(self) -> None:
+        buffer, view = self.buffer, self.view
+        start, end = self.start, self.end
+
+        if not self.handshaken:
+            if end - start < HANDSHAKE_LENGTH:
+                return
+            self.messages.append(bytes(view[start:start + HANDSHAKE_LENGTH]))
+            start += HANDSHAKE_LENGTH
+            self.handshaken = True
+
+        while end - start >= 4:
+            length = LENGTH.unpack_from(buffer, start)[0]
+            if length > MAX_FRAME:
+                raise ValueError(f"frame of {length} bytes")
+            if end - start < 4 + length:
+                break
+            body = start + 4
+            start = body + length
+
+            if length == 0:
+                self.messages.append((0, None, None))
+                continue
+
+            message_id = buffer[body]
+            if message_id == Message.piece and length > 9:
+                index, begin = PIECE_HEADER.unpack_from(buffer, body + 1)
+                if self.block_sink is not None:
+                    self.block_sink(index, begin, view[body + 9:start])
+                self.messages.append((length, message_id, (index, begin, length - 9)))
+            elif length == 1:
+                self.messages.append((length, message_id, None))
+            else:
+                self.messages.append((length, message_id, bytes(view[body + 1:start])))
+
+        self.start = start
+
+    # coroutine side
+
+    @staticmethod
+    def wake(waiter):
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def next_message(self):
+        while not self.messages:
+            if self.exception is not None:
+                raise self.exception
+            self.waiter = asyncio.get_running_loop().create_future()
+            await self.waiter
+        message = self.messages.popleft()
+        if self.reading_paused and not self.held and len(self.messages) <= self.max_queued // 2:
+            self.reading_paused = False
+            self.transport.resume_reading()
+        return message
+
+    def hold(self, held: bool) -> None:
+        """Stops or restarts reading the socket, so TCP slows the sender down."""
+        self.held = held
+        if self.transport is None or self.transport.is_closing():
+            return
+        if held and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+        elif not held and self.reading_paused and len(self.messages) < self.max_queued:
+            self.reading_paused = False
+            self.transport.resume_reading()
+
+    async def read_handshake(self) -> bytes:
+        return await self.next_message()
+
+    async def peek_handshake(self) -> bytes:
+        """The peer's handshake, left in place for read_handshake()."""
+        handshake = await self.next_message()
+        self.messages.appendleft(handshake)
+        return handshake
+
+    async def read_message(self) -> tuple:
+        """Next frame as (length, message_id, payload).
+
+        payload is None for keep-alives and bodiless messages, and
+        (index, begin, block length) for pieces whose data has already
+        gone to the block sink.
+        """
+        return await self.next_message()
+
+    def write(self, data: bytes) -> None:
+        self.transport.write(data)
+
+    async def drain(self) -> None:
+        while self.writing_paused:
+            if self.exception is not None:
+                raise self.exception
+            self.drain_waiter = asyncio.get_running_loop().create_future()
+            await self.drain_waiter
+        if self.transport.is_closing() and self.exception is not None:
+            raise self.exception
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+
+    async def wait_closed(self) -> None:
+        if self.closed is not None:
+            await self.closed
@@ -1,25 +1,16 @@
 # DECODE FUNCTIONS
-def decode(path: str | bytes):
+def decode(path: str | bytes, spans: dict | None = None, span_depth: int | None = None):
+    """Decodes a bencoded file or byte-string.
+
+    :param spans: If given, filled with the (start, end) byte range of
+        every value, keyed by its path from the root, e.g. (b"info",).
+    :param span_depth: Only record spans of paths up to this length.
+    """
     contents = read(path) if type(path) is str else path
-    decoded = parse(contents, 0)[0]
+    decoded = parse(contents, 0, spans, span_depth)[0]
     return decoded
 
 
-def iterate(contents: bytes, index, caller='b'):
-    negative = 1
-    if caller == 'i':
-        index += 1
-        if contents[index] == 45:
-            negative = -1
-            index += 1
-    number = bytearray()
-    while 48 <= contents[index] <= 57:
-        number.append(contents[index])
-        index += 1
-    number = int(number) * negative
-    return number, index + 1
-
-
 def read(path: str):
     path = path.replace('\"', '')
     try:
@@ -29,63 +20,130 @@ def read(path: str):
         raise ValueError("File invalid or inaccessible") from e
 
 
-def parse(contents: bytes, index: int):
+def parse(contents: bytes, index: int, spans: dict | None = None, span_depth: int | None = None):
+    """Decodes the value starting at index without recursion.
+
+    Open dictionaries and lists are kept on an explicit stack, integers
+    and string lengths are converted with a single int() over a slice,
+    so deep or huge inputs cost no Python frames and no per-digit work.
+
+    :returns: The value and the index right after it.
+    """
     try:
-        if contents[index] == ord('d'):
+        if spans is not None and span_depth is None:
+            span_depth = -1
+        return _parse(contents, index, spans, span_depth or 0)
+    except (IndexError, ValueError, TypeError) as e:
+        raise ValueError("Invalid torrent file") from e
+
+
+_DICT, _LIST, _INT, _END = ord('d'), ord('l'), ord('i'), ord('e')
+_DIGITS = frozenset(b"0123456789")
+
+
+def _parse(contents: bytes, index: int, spans: dict | None, span_depth: int):
+    find = contents.index
+    size = len(contents)
+    # the innermost open container lives in locals; its parents are
+    # saved on the stack as (container, key, start, path) tuples
+    stack = []
+    container = key = path = None
+    opened = 0
+    record = span_depth != 0        # whether values at this depth get a span
+    while True:
+        start = index
+        token = contents[index]
+
+        if token in _DIGITS:
+            colon = find(b':', index)
+            index = colon + 1 + int(contents[index:colon])
+            if index > size:
+                raise ValueError("truncated string")
+            value = contents[colon + 1:index]
+        elif token == _INT:
+            end = find(b'e', index)
+            value = int(contents[index + 1:end])
+            index = end + 1
+        elif token == _DICT or token == _LIST:
+            if container is not None:
+                stack.append((container, key, opened, path))
+                if record:
+                    path = path + ((len(container),) if type(container) is list else (key,))
+                    record = span_depth < 0 or len(stack) < span_depth
+            else:
+                path = ()
+            container = {} if token == _DICT else []
+            key = None
+            opened = index
             index += 1
-            d = dict()
-            while contents[index] != ord('e'):
-                key = parse(contents, index)
-                value = parse(contents, key[1])
-                d[key[0]] = value[0]
-                index = value[1]
-            return d, index + 1
-        elif contents[index] == ord('l'):
+            continue
+        elif token == _END and container is not None:
+            if key is not None:
+                raise ValueError("dictionary key without value")
+            value, start = container, opened
             index += 1
-            l = list()
-            while contents[index] != ord('e'):
-                value = parse(contents, index)
-                l.append(value[0])
-                index = value[1]
-            return l, index + 1
-        elif contents[index] == ord('i'):
-            return iterate(contents, index, 'i')
-        elif 48 <= contents[index] <= 57:
-            length, index = iterate(contents, index)
-            string = contents[index: index + length]
-            return string, index + length
-    except Exception as e:
-        raise ValueError("Invalid torrent file") from e
+            if not stack:
+                return value, index
+            container, key, opened, path = stack.pop()
+            record = span_depth < 0 or len(stack) < span_depth
+        else:
+            raise ValueError(f"unexpected byte at {index}")
+
+        if container is None:
+            return value, index
+        if type(container) is list:
+            if record:
+                spans[path + (len(container),)] = (start, index)
+            container.append(value)
+        elif key is None:
+            if type(value) is not bytes:
+                raise TypeError("dictionary key is not a string")
+            key = value
+        else:
+            if record:
+                spans[path + (key,)] = (start, index)
+            container[key] = value
+            key = None
 
 
 # ENCODE FUNCTIONS
 def encode(parsed: dict):
     if type(parsed) != dict:
         raise ValueError("Data is not a dictionary")
-    bencoded = b'd'
-    for k, v in parsed.items():
-        bencoded += str(len(k)).encode() + b':' + k
-        bencoded += data(v)
-    bencoded += b'e'
-    return bencoded
+    return data(parsed)
 
 
 def data(v: list | dict | bytes | int):
-    content = b''
+    """Bencodes any value into one growing buffer.
+
+    Dictionary keys are written in sorted order, as the format requires.
+    """
+    out = bytearray()
+    _write(out, v)
+    return bytes(out)
+
+
+def _write(out: bytearray, v):
     match v:
-        case list():
-            content += b'l'
+        case bytes() | bytearray() | memoryview():
+            out += b'%d:' % len(v)
+            out += v
+        case str():
+            _write(out, v.encode())
+        case bool():
+            raise ValueError("Booleans can't be bencoded")
+        case int():
+            out += b'i%de' % v
+        case list() | tuple():
+            out += b'l'
             for item in v:
-                content += data(item)
-            content += b'e'
+                _write(out, item)
+            out += b'e'
         case dict():
-            content += b'd'
-            for key, val in v.items():
-                content += data(key)
-                content += data(val)
-            content += b'e'
-        case int():
-            content += b'i' + str(v).encode() + b'e'
-        case bytes():
-            content += str(len(v)).encode() + b':' + v
-    return content
+            out += b'd'
+            for key, val in sorted(v.items()):
+                _write(out, key)
+                _write(out, val)
+            out += b'e'
+        case _:
+            raise ValueError(f"Can't bencode {type(v).__name__}")
@@ -0,0 +1,30 @@
+import asyncio
+
+
+class Budget:
+    """A capacity drawn on by several users, such as every torrent of a session.
+
+    Users check free() before they take and give back what they took
+    themselves. One that has nothing taken yet may overdraw, so a busy
+    budget slows everyone down but never stalls anyone. wait() returns
+    the next time anything is given back.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.used = 0
+        self.freed = asyncio.Event()
+
+    def free(self) -> int:
+        return max(self.capacity - self.used, 0)
+
+    def take(self, amount: int) -> None:
+        self.used += amount
+
+    def give(self, amount: int) -> None:
+        self.used -= amount
+        self.freed.set()
+
+    async def wait(self) -> None:
+        self.freed.clear()
+        await self.freed.wait()
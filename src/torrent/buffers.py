@@ -0,0 +1,124 @@
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from src.torrent.budget import Budget
+
+
+@dataclass
+class PieceBuffer:
+    """One in-progress piece: its bytes and which blocks have arrived."""
+    index: int
+    data: bytearray
+    received: np.ndarray            # one bool per block
+    missing: int
+    block_size: int
+    started: float = field(default_factory=time.monotonic)
+
+    def add(self, begin: int, block) -> bool:
+        """Copies a block into place.
+
+        :returns: False for duplicates and blocks that don't fit the piece.
+        """
+        if begin % self.block_size or begin + len(block) > len(self.data):
+            return False
+        b = begin // self.block_size
+        if self.received[b]:
+            return False
+        self.data[begin:begin + len(block)] = block
+        self.received[b] = True
+        self.missing -= 1
+        return True
+
+    def missing_blocks(self) -> list[tuple[int, int]]:
+        """(begin, length) of every block still to be downloaded."""
+        size = len(self.data)
+        return [
+            (begin, min(self.block_size, size - begin))
+            for begin in (int(b) * self.block_size for b in np.flatnonzero(~self.received))
+        ]
+
+    def blocks(self) -> dict[int, bytes]:
+        return {
+            begin: bytes(self.data[begin:begin + length])
+            for begin, length in (
+                (int(b) * self.block_size, self.block_size) for b in np.flatnonzero(self.received)
+            )
+        }
+
+
+class PieceBufferPool:
+    """In-progress pieces, capped at a total number of bytes.
+
+    Each piece gets a single bytearray of its exact size, so assembling
+    it needs no sort and no join, and the last, shorter piece completes
+    like any other. Pieces are only claimed while their buffer fits in
+    the cap; a peer with nothing left in flight waits for room instead.
+    The cap can be a budget shared with other downloads.
+    """
+
+    def __init__(self, block_size: int, capacity: int = 256 * 1024 * 1024,
+                 budget: Budget | None = None):
+        self.block_size = block_size
+        self.budget = budget or Budget(capacity)
+        self.used = 0                   # this pool's share of the budget
+        self.buffers: dict[int, PieceBuffer] = {}
+
+    def room(self, piece_length: int) -> int:
+        """How many more pieces of piece_length fit under the cap.
+
+        One piece is still allowed when this pool buffers nothing, even
+        if it is larger than what's left of the cap, so every download
+        can always make progress.
+        """
+        if not self.used:
+            return max(self.budget.free() // piece_length, 1)
+        return self.budget.free() // piece_length
+
+    def acquire(self, index: int, size: int) -> PieceBuffer:
+        buffer = self.buffers.get(index)
+        if buffer is None:
+            blocks = (size + self.block_size - 1) // self.block_size
+            buffer = PieceBuffer(index, bytearray(size), np.zeros(blocks, dtype=bool), blocks, self.block_size)
+            self.buffers[index] = buffer
+            self.used += size
+            self.budget.take(size)
+        return buffer
+
+    def get(self, index: int) -> PieceBuffer | None:
+        return self.buffers.get(index)
+
+    def take_complete(self, index: int) -> PieceBuffer | None:
+        """Removes a piece once every block has arrived.
+
+        Its bytes still count against the cap until release().
+        """
+        buffer = self.buffers.get(index)
+        if buffer is None or buffer.missing:
+            return None
+        del self.buffers[index]
+        return buffer
+
+    def release(self, buffer: PieceBuffer) -> None:
+        self.used -= len(buffer.data)
+        self.budget.give(len(buffer.data))
+
+    def discard(self, index: int) -> None:
+        buffer = self.buffers.pop(index, None)
+        if buffer is not None:
+            self.release(buffer)
+
+    def partial(self, bitfield: np.ndarray, downloading: np.ndarray) -> list[int]:
+        """Started pieces nobody is working on that the peer can give us."""
+        return [
+            index for index in self.buffers
+            if bitfield[index] and not downloading[index]
+        ]
+
+    def snapshot(self) -> dict[int, dict[int, bytes]]:
+        return {index: buffer.blocks() for index, buffer in self.buffers.items()}
+
+    async def wait_for_room(self, piece_length: int) -> None:
+        while not self.room(piece_length):
+            await self.budget.wait()
@@ -0,0 +1,77 @@
+import asyncio
+from collections import OrderedDict
+
+from src.metrics.client import CACHE_HITS, CACHE_MISSES
+from src.torrent.storage import StorageWriter
+
+
+class PieceCache:
+    """LRU cache of whole pieces for serving uploads.
+
+    Peers request 16 KiB blocks, usually every block of a piece in a
+    row, so the first request reads the whole piece and the rest are
+    served from memory. Requests for a piece that is still being read
+    wait for that read instead of starting another one.
+    """
+
+    def __init__(self, storage: StorageWriter, piece_length: int, total_size: int,
+                 capacity: int = 64 * 1024 * 1024):
+        self.storage = storage
+        self.piece_length = piece_length
+        self.total_size = total_size
+        self.capacity = capacity
+        self.used = 0
+        self.pieces: OrderedDict[int, bytes] = OrderedDict()
+        self.reading: dict[int, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    async def block(self, index: int, begin: int, length: int) -> memoryview:
+        piece = self.pieces.get(index)
+        if piece is not None:
+            self.hits += 1
+            CACHE_HITS.inc()
+            self.pieces.move_to_end(index)
+        else:
+            self.misses += 1
+            CACHE_MISSES.inc()
+            piece = await self.load(index)
+        return memoryview(piece)[begin:begin + length]
+
+    async def load(self, index: int) -> bytes:
+        future = self.reading.get(index)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.reading[index] = future
+        try:
+            offset = index * self.piece_length
+            piece = await self.storage.read(offset, min(self.piece_length, self.total_size - offset))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()      # retrieved here, so nobody waiting is fine
+            raise
+        finally:
+            del self.reading[index]
+
+        future.set_result(piece)
+        self.pieces[index] = piece
+        self.used += len(piece)
+        while self.used > self.capacity and len(self.pieces) > 1:
+            _, evicted = self.pieces.popitem(last=False)
+            self.used -= len(evicted)
+        return piece
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+            "cached_bytes": self.used,
+        }
@@ -1,8 +1,20 @@
 import asyncio
-from dataclasses import dataclass
+from collections.abc import Hashable
+from dataclasses import dataclass, field
 
 import numpy as np
 
+from src.metrics.client import LOCK_WAIT_SECONDS
+from src.metrics.profile import TimedLock
+from src.torrent.budget import Budget
+from src.torrent.buffers import PieceBufferPool
+from src.torrent.cache import PieceCache
+from src.torrent.endgame import Endgame
+from src.torrent.layout import FileLayout, build_layout
+from src.torrent.picker import PiecePicker
+from src.torrent.storage import StorageWriter
+from src.torrent.verify import PieceVerifier
+
 
 @dataclass
 class Download:
@@ -12,9 +24,8 @@ class Download:
     piece_length: int
     total_pieces: int
     # bitfield_size: int
-    block_size = 16384
     pieces: bytes
-    total_blocks: int
+    total_blocks: int               # blocks in a full piece
 
     interval: int
     complete: int
@@ -22,11 +33,119 @@ class Download:
 
     downloading: np.ndarray
     downloaded: np.ndarray
-    piece_blocks = dict()
+    picker: PiecePicker
+    layout: FileLayout
+    buffers: PieceBufferPool
+    storage: StorageWriter | None = None
+    verifier: PieceVerifier | None = None
+    cache: PieceCache | None = None
+
+    bytes_downloaded: int = 0       # block payload received, for tracker stats
+    bytes_uploaded: int = 0
+    endgame: Endgame = field(default_factory=Endgame)
+    block_size: int = 16384
+
+    # pieces not downloaded yet, kept in step with downloaded by finish()
+    remaining: int = field(init=False, default=0)
+    # claimed pieces by claimer and claimer by piece, for pieces not downloaded yet
+    claims: dict[Hashable, set[int]] = field(default_factory=dict)
+    owners: dict[int, Hashable] = field(default_factory=dict)
+    # readers waiting for a piece to be downloaded
+    waiters: dict[int, list[asyncio.Future]] = field(default_factory=dict)
+
+    lock: TimedLock = field(default_factory=lambda: TimedLock(LOCK_WAIT_SECONDS))
+
+    def __post_init__(self):
+        self.recount()
+
+    def recount(self) -> None:
+        """Recomputes remaining after downloaded was changed in bulk, as on resume."""
+        self.remaining = self.total_pieces - int(np.count_nonzero(self.downloaded))
+
+    def claim(self, owner: Hashable, indexes: list[int]) -> None:
+        """Marks pieces nobody is downloading as being downloaded by owner."""
+        self.downloading[indexes] = True
+        self.claims.setdefault(owner, set()).update(indexes)
+        for index in indexes:
+            self.owners[index] = owner
+
+    def unclaim(self, index: int) -> None:
+        """Makes a piece available to claim again, as when it failed the hash check."""
+        self.downloading[index] = False
+        owner = self.owners.pop(index, None)
+        if owner is not None:
+            self.claims[owner].discard(index)
+
+    def finish(self, index: int) -> bool:
+        """Marks a verified piece as downloaded.
+
+        :returns: False if it already was.
+        """
+        if self.downloaded[index]:
+            return False
+        self.downloaded[index] = True
+        self.remaining -= 1
+        self.unclaim(index)
+        for waiter in self.waiters.pop(index, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+        return True
+
+    async def wait_for_piece(self, index: int) -> None:
+        """Returns once the piece is verified and handed to storage."""
+        if self.downloaded[index]:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(index, []).append(waiter)
+        try:
+            await waiter
+        finally:
+            waiters = self.waiters.get(index)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+
+    def forget(self, owner: Hashable) -> list[int]:
+        """Releases the pieces owner claimed and nobody finished or took over.
+
+        Costs one step per piece the owner holds, whatever the size of
+        the torrent.
+
+        :returns: The pieces that can be claimed again.
+        """
+        released = []
+        for index in self.claims.pop(owner, ()):
+            if self.owners.get(index) is owner:
+                del self.owners[index]
+                self.downloading[index] = False
+                released.append(index)
+        return released
+
+    def all_claimed(self) -> bool:
+        """Whether every missing piece is claimed, which starts the endgame."""
+        return len(self.owners) == self.remaining
+
+    def piece_size(self, index: int) -> int:
+        if index == self.total_pieces - 1:
+            return self.file_size - index * self.piece_length
+        return self.piece_length
+
+    def left(self) -> int:
+        """Bytes still missing from verified pieces."""
+        have = (self.total_pieces - self.remaining) * self.piece_length
+        if self.total_pieces and self.downloaded[-1]:
+            have -= self.piece_length - self.piece_size(self.total_pieces - 1)
+        return self.file_size - have
 
-    lock = asyncio.Lock()
 
-def build_download(decoded: dict, tracker_response: dict) -> Download:
+def build_download(decoded: dict, tracker_response: dict | None = None,
+                   buffer_budget: Budget | None = None,
+                   downloaded: np.ndarray | None = None) -> Download:
+    """
+    :param buffer_budget: Piece-buffer memory shared with other downloads.
+    :param downloaded: A zeroed bool array to keep the downloaded bitfield
+        in, such as one backed by shared memory.
+    """
+    tracker_response = tracker_response or {}
     info = decoded[b"info"]
 
     t_pieces = len(info[b"pieces"]) // 20
@@ -41,18 +160,23 @@ def build_download(decoded: dict, tracker_response: dict) -> Download:
 
     piece_length = info[b"piece length"]
     block_size = 16384
+    layout = build_layout(info)
 
     return Download(
-        file_size = info[b"length"],
+        file_size = layout.offsets[-1],
         filename = info[b"name"].decode(),
         piece_length = piece_length,
         total_pieces = t_pieces,
-        interval = tracker_response[b"interval"],
+        interval = tracker_response.get(b"interval", 0),
         complete = d_complete,
         incomplete = d_incomplete,
         # bitfield_size = math.ceil(t_pieces / 8),
-        downloaded = np.zeros(t_pieces, dtype=bool),
+        downloaded = np.zeros(t_pieces, dtype=bool) if downloaded is None else downloaded,
         downloading = np.zeros(t_pieces, dtype=bool),
+        picker = PiecePicker(np.zeros(t_pieces, dtype=np.int32)),
+        layout = layout,
+        buffers = PieceBufferPool(block_size, budget=buffer_budget),
         pieces = info[b"pieces"],
-        total_blocks = (piece_length + block_size - 1) // block_size
+        total_blocks = (piece_length + block_size - 1) // block_size,
+        block_size = block_size,
     )
\ No newline at end of file
@@ -0,0 +1,58 @@
+from collections.abc import Hashable, Iterable
+
+from src.metrics.client import ENDGAME_DUPLICATE_BLOCKS, ENDGAME_WASTED_BYTES
+
+
+class Endgame:
+    """Keeps track of which peers have been asked for which block.
+
+    During most of the download every block is requested from a single
+    peer. Once every missing piece is claimed, idle peers request the
+    blocks still in flight too, and whichever copy arrives first wins;
+    the other requesters are then sent a cancel. Copies that arrive
+    anyway are dropped and counted as wasted.
+    """
+
+    def __init__(self):
+        self.active = False         # every missing piece is claimed
+        self.requesters: dict[tuple[int, int], set] = {}   # (index, begin) -> requesters
+        self.duplicate_blocks = 0
+        self.wasted_bytes = 0
+
+    def requested(self, requester: Hashable, index: int, blocks: Iterable[tuple[int, int]]) -> None:
+        """Records the (begin, length) blocks of a piece queued with a requester."""
+        for begin, _ in blocks:
+            self.requesters.setdefault((index, begin), set()).add(requester)
+
+    def asked(self, requester: Hashable, index: int, begin: int) -> bool:
+        return requester in self.requesters.get((index, begin), ())
+
+    def arrived(self, requester: Hashable, index: int, begin: int) -> set:
+        """Retires a block.
+
+        :returns: The other peers that were asked for it.
+        """
+        others = self.requesters.pop((index, begin), set())
+        others.discard(requester)
+        return others
+
+    def forget(self, requester: Hashable, blocks: Iterable[tuple[int, int]]) -> None:
+        """Drops a requester that will never deliver, e.g. on disconnect."""
+        for key in blocks:
+            requesters = self.requesters.get(key)
+            if requesters is not None:
+                requesters.discard(requester)
+                if not requesters:
+                    del self.requesters[key]
+
+    def wasted(self, length: int) -> None:
+        self.duplicate_blocks += 1
+        self.wasted_bytes += length
+        ENDGAME_DUPLICATE_BLOCKS.inc()
+        ENDGAME_WASTED_BYTES.inc(length)
+
+    def stats(self) -> dict:
+        return {
+            "duplicate_blocks": self.duplicate_blocks,
+            "wasted_bytes": self.wasted_bytes,
+        }
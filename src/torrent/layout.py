@@ -0,0 +1,58 @@
+import itertools
+import os
+from bisect import bisect_right
+from dataclasses import dataclass
+
+
+@dataclass
+class FileLayout:
+    """Where the torrent's byte stream lands on disk.
+
+    offsets[i] is the position of files[i] in the concatenation of all
+    files, with the total size appended, so locating any byte is a
+    binary search instead of a walk over the file list.
+    """
+    files: list[tuple[str, int]]    # (path, length)
+    offsets: list[int]
+
+    def spans(self, offset: int, length: int) -> list[tuple[int, int, int]]:
+        """Splits a range of the torrent into per-file pieces.
+
+        Empty files never show up because bisect_right skips past them.
+
+        :returns: A list of (file index, offset in file, length).
+        """
+        spans = []
+        i = bisect_right(self.offsets, offset) - 1
+        while length > 0 and i < len(self.files):
+            file_offset = offset - self.offsets[i]
+            take = min(length, self.files[i][1] - file_offset)
+            if take > 0:
+                spans.append((i, file_offset, take))
+                offset += take
+                length -= take
+            i += 1
+        return spans
+
+
+def safe_path(root: str, parts: list[bytes]) -> str:
+    """Joins path components from the metainfo without leaving root."""
+    names = [part.decode(errors="replace") for part in parts]
+    for name in names:
+        if name in ("", ".", "..") or os.sep in name or (os.altsep and os.altsep in name):
+            raise ValueError(f"Invalid path in torrent: {names}")
+    return os.path.join(root, *names)
+
+
+def build_layout(info: dict) -> FileLayout:
+    name = safe_path("", [info[b"name"]])
+    if b"files" not in info:
+        files = [(name, info[b"length"])]
+    else:
+        files = []
+        for f in info[b"files"]:
+            if not f[b"path"]:
+                raise ValueError(f"Invalid path in torrent: {f[b'path']}")
+            files.append((safe_path(name, f[b"path"]), f[b"length"]))
+    offsets = list(itertools.accumulate((length for _, length in files), initial=0))
+    return FileLayout(files, offsets)
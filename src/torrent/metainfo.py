@@ -6,8 +6,17 @@ from src.torrent import bencode
 
 
 def get_file_info(path: str) -> tuple[dict, str, bool]:
-    decoded = bencode.decode(path)
-    info_hash = hashlib.sha1(bencode.encode(decoded[b"info"])).digest().hex()
+    """Decodes a .torrent file and computes its info_hash.
+
+    The hash is taken over the info dictionary's original bytes rather
+    than a re-encoding, so it matches the swarm's even when the file
+    isn't canonically encoded.
+    """
+    contents = bencode.read(path)
+    spans = {}
+    decoded = bencode.decode(contents, spans, span_depth=1)
+    start, end = spans[(b"info",)]
+    info_hash = hashlib.sha1(contents[start:end]).digest().hex()
     is_single = b"files" not in decoded[b"info"]
     return decoded, info_hash, is_single
 
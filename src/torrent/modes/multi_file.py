@@ -0,0 +1,7 @@
+from src.torrent import metainfo
+
+
+def multi_file(decoded: dict, info_hash: str) -> dict:
+    payload = metainfo.tracker_payload(info_hash)
+    payload["left"] = sum(f[b"length"] for f in decoded[b"info"][b"files"])
+    return payload
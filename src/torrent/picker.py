@@ -0,0 +1,55 @@
+from collections.abc import Hashable
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+@dataclass
+class PiecePicker:
+    """Swarm-wide piece availability and rarest-first selection.
+
+    availability[i] counts the connected peers that announced piece i.
+    It is kept up to date from bitfield and have messages and from
+    peers disconnecting, so a pick never has to look at other peers.
+
+    Streaming readers add priority windows of pieces [start, end) they
+    need soon. Pieces in a window are picked before any other, those
+    closest to the window's start, i.e. with the earliest deadline, first.
+    """
+    availability: np.ndarray
+    rng: np.random.Generator = field(default_factory=np.random.default_rng)
+    windows: dict[Hashable, tuple[int, int]] = field(default_factory=dict)     # reader -> (start, end)
+
+    def add_bitfield(self, bitfield: np.ndarray) -> None:
+        self.availability += bitfield
+
+    def remove_bitfield(self, bitfield: np.ndarray) -> None:
+        self.availability -= bitfield
+
+    def add_have(self, index: int) -> None:
+        self.availability[index] += 1
+
+    def pick(self, bitfield: np.ndarray, downloaded: np.ndarray,
+             downloading: np.ndarray, count: int = 1) -> np.ndarray:
+        """Chooses up to count of the rarest pieces the peer can give us.
+
+        Candidates are pieces the peer has that are neither downloaded
+        nor claimed. Adding a random fraction to the integer counts breaks
+        ties between equally rare pieces without changing their order.
+        Pieces in a priority window get negative keys, so they sort first.
+
+        :returns: Indexes of the chosen pieces, most urgent or rarest first.
+        """
+        candidates = np.flatnonzero(bitfield & ~downloaded & ~downloading)
+        if candidates.size == 0 or count <= 0:
+            return candidates[:0]
+
+        keys = self.availability[candidates] + self.rng.random(candidates.size)
+        for start, end in self.windows.values():
+            inside = (candidates >= start) & (candidates < end)
+            urgency = candidates[inside] - start - len(self.availability)
+            keys[inside] = np.minimum(keys[inside], urgency)
+        if count < candidates.size:
+            nearest = np.argpartition(keys, count)[:count]
+            return candidates[nearest[np.argsort(keys[nearest])]]
+        return candidates[np.argsort(keys)]
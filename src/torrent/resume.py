@@ -0,0 +1,175 @@
+import contextlib
+import hashlib
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.torrent import bencode
+from src.torrent.download import Download
+
+
+def resume_path(download: Download) -> str:
+    return download.filename + ".fastresume"
+
+
+def file_state(download: Download) -> tuple[int, int]:
+    """Total size and newest mtime of the download's files."""
+    stats = [os.stat(path) for path, _ in download.layout.files]
+    mtime = max((stat.st_mtime_ns for stat in stats), default=0)
+    if any(stat.st_size != length for stat, (_, length) in zip(stats, download.layout.files)):
+        return -1, mtime
+    return sum(stat.st_size for stat in stats), mtime
+
+
+def save(download: Download, info_hash: bytes, downloaded: np.ndarray, partial: dict) -> None:
+    """Writes the fast-resume sidecar next to the output file.
+
+    downloaded must only contain pieces already on stable storage. The
+    file's size and mtime are recorded so a later load can tell whether
+    the file was written to after this snapshot. Partial pieces, as
+    returned by PieceBufferPool.snapshot(), are kept with their blocks
+    so they don't have to be fetched again. Takes snapshots rather than
+    reading the download, so it can run on a worker thread.
+    """
+    size, mtime = file_state(download)
+    partial = [
+        [index, [[begin, block] for begin, block in sorted(blocks.items())]]
+        for index, blocks in sorted(partial.items())
+    ]
+    contents = bencode.encode({
+        b"info-hash": info_hash,
+        b"file-size": size,
+        b"file-mtime": mtime,
+        b"pieces": np.packbits(downloaded).tobytes(),
+        b"partial": partial,
+    })
+
+    path = resume_path(download)
+    with open(path + ".tmp", "wb") as f:
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load(download: Download, info_hash: bytes) -> bool | None:
+    """Restores downloaded pieces and partial pieces from the sidecar.
+
+    :returns: None if there is no usable sidecar for this file, False if
+        it was restored as is, True if the file was modified after the
+        sidecar was written and the missing pieces have to be rechecked.
+    """
+    try:
+        resume = bencode.decode(resume_path(download))
+        size, mtime = file_state(download)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(resume, dict):
+        return None
+    if resume.get(b"info-hash") != info_hash or size != download.file_size:
+        return None
+    if resume.get(b"file-size") != download.file_size:
+        return None
+    pieces, saved_mtime = resume.get(b"pieces"), resume.get(b"file-mtime")
+    if not isinstance(pieces, bytes) or not isinstance(saved_mtime, int):
+        return None
+    partial = parse_partial(resume.get(b"partial", []))
+    if partial is None:
+        return None
+
+    bits = np.unpackbits(np.frombuffer(pieces, dtype=np.uint8)).astype(bool)
+    if bits.size < download.total_pieces:
+        return None
+    download.downloaded[:] = bits[:download.total_pieces]
+    download.recount()
+
+    for index, blocks in partial:
+        if 0 <= index < download.total_pieces and not download.downloaded[index]:
+            buffer = download.buffers.acquire(index, download.piece_size(index))
+            for begin, block in blocks:
+                buffer.add(begin, block)
+
+    return mtime != saved_mtime
+
+
+def parse_partial(partial) -> list[tuple[int, list[tuple[int, bytes]]]] | None:
+    """The sidecar's partial pieces as [(index, [(begin, block)])], or None if malformed."""
+    if not isinstance(partial, list):
+        return None
+    pieces = []
+    for entry in partial:
+        if not (isinstance(entry, list) and len(entry) == 2
+                and isinstance(entry[0], int) and isinstance(entry[1], list)):
+            return None
+        blocks = []
+        for block in entry[1]:
+            if not (isinstance(block, list) and len(block) == 2
+                    and isinstance(block[0], int) and block[0] >= 0 and isinstance(block[1], bytes)):
+                return None
+            blocks.append((block[0], block[1]))
+        pieces.append((entry[0], blocks))
+    return pieces
+
+
+def recheck(download: Download, only_missing: bool = False, workers: int | None = None) -> int:
+    """Hashes the existing output files against the torrent's piece hashes.
+
+    Files are mapped read-only and the pieces split into one contiguous
+    run per task, so all cores hash in parallel (hashlib releases the
+    GIL). Pieces inside a single file are hashed straight from the
+    mapping; only pieces straddling files are copied.
+
+    :param only_missing: Keep pieces already marked as downloaded and only
+        check the rest.
+    :returns: Number of pieces found to be valid.
+    """
+    try:
+        size, _ = file_state(download)
+    except OSError:
+        return 0
+    if size != download.file_size or size == 0:
+        return 0
+
+    if only_missing:
+        indexes = np.flatnonzero(~download.downloaded)
+    else:
+        download.downloaded[:] = False
+        indexes = np.arange(download.total_pieces)
+    if indexes.size == 0:
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    with contextlib.ExitStack() as stack:
+        views = []
+        for path, length in download.layout.files:
+            if not length:
+                views.append(None)
+                continue
+            f = stack.enter_context(open(path, "rb"))
+            mapped = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            views.append(stack.enter_context(memoryview(mapped)))
+
+        def check(chunk: np.ndarray) -> list[int]:
+            valid = []
+            for index in chunk.tolist():
+                spans = download.layout.spans(index * download.piece_length, download.piece_size(index))
+                parts = [views[i][offset: offset + length] for i, offset, length in spans]
+                piece = parts[0] if len(parts) == 1 else b"".join(parts)
+                if hashlib.sha1(piece).digest() == download.pieces[index * 20: (index + 1) * 20]:
+                    valid.append(index)
+            return valid
+
+        found = 0
+        with ThreadPoolExecutor(workers) as executor:
+            for valid in executor.map(check, np.array_split(indexes, workers * 4)):
+                download.downloaded[valid] = True
+                found += len(valid)
+
+    download.recount()
+    for index in np.flatnonzero(download.downloaded).tolist():
+        download.buffers.discard(index)
+    return found
@@ -0,0 +1,245 @@
+import asyncio
+import mmap
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics.client import DISK_WRITE_BYTES, DISK_WRITE_SECONDS
+from src.torrent.budget import Budget
+from src.torrent.layout import FileLayout
+
+
+class Storage:
+    """Persistent handles on the preallocated output files.
+
+    Backends only differ in how bytes reach the page cache; all of them
+    keep every file open for the whole download instead of reopening it
+    for every piece. Writes are addressed by their offset in the torrent
+    and split across files with the layout's span map.
+    """
+
+    def __init__(self, layout: FileLayout):
+        self.layout = layout
+        self.fds = []
+        for path, length in layout.files:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(fd).st_size != length:
+                os.ftruncate(fd, length)
+            self.fds.append(fd)
+
+    def write(self, offset: int, buffers: list) -> None:
+        """Writes consecutive buffers starting at offset in the torrent.
+
+        Buffers are sliced at file boundaries into memoryviews, so every
+        file touched gets one vectored write and no data is copied.
+        """
+        views = [memoryview(b) for b in buffers]
+        total = sum(len(view) for view in views)
+        for i, file_offset, length in self.layout.spans(offset, total):
+            chunk = []
+            while length:
+                view = views[0]
+                if len(view) <= length:
+                    chunk.append(view)
+                    views.pop(0)
+                else:
+                    chunk.append(view[:length])
+                    views[0] = view[length:]
+                length -= len(chunk[-1])
+            self.write_file(i, file_offset, chunk)
+
+    def write_file(self, i: int, offset: int, views: list) -> None:
+        raise NotImplementedError
+
+    def read(self, offset: int, length: int) -> bytes:
+        return b"".join(
+            self.read_file(i, file_offset, size)
+            for i, file_offset, size in self.layout.spans(offset, length)
+        )
+
+    def read_file(self, i: int, offset: int, length: int) -> bytes:
+        return os.pread(self.fds[i], length, offset)
+
+    def flush(self) -> None:
+        for fd in self.fds:
+            os.fsync(fd)
+
+    def close(self) -> None:
+        for fd in self.fds:
+            os.close(fd)
+
+
+class PwriteStorage(Storage):
+    """Writes with positional, vectored syscalls on each descriptor."""
+
+    def write_file(self, i: int, offset: int, views: list) -> None:
+        while views:
+            written = os.pwritev(self.fds[i], views, offset)
+            offset += written
+            while views and written >= len(views[0]):
+                written -= len(views[0])
+                views.pop(0)
+            if written:
+                views[0] = views[0][written:]
+
+
+class MmapStorage(Storage):
+    """Copies into a shared mapping of each file."""
+
+    def __init__(self, layout: FileLayout):
+        super().__init__(layout)
+        self.maps = [
+            mmap.mmap(fd, length) if length else None
+            for fd, (_, length) in zip(self.fds, layout.files)
+        ]
+
+    def write_file(self, i: int, offset: int, views: list) -> None:
+        mapped = self.maps[i]
+        for view in views:
+            end = offset + len(view)
+            mapped[offset:end] = view
+            offset = end
+
+    def read_file(self, i: int, offset: int, length: int) -> bytes:
+        return self.maps[i][offset:offset + length]
+
+    def flush(self) -> None:
+        for mapped in self.maps:
+            if mapped is not None:
+                mapped.flush()
+
+    def close(self) -> None:
+        for mapped in self.maps:
+            if mapped is not None:
+                mapped.close()
+        super().close()
+
+
+BACKENDS = {
+    "pwrite": PwriteStorage,
+    "mmap": MmapStorage,
+}
+
+
+def open_storage(layout: FileLayout, backend: str = "pwrite") -> Storage:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return BACKENDS[backend](layout)
+
+
+class StorageWriter:
+    """Bounded write-back queue in front of a Storage.
+
+    Pieces are written by a background task on a dedicated thread, so
+    disk latency never blocks the event loop. Whatever has queued up
+    while the previous write ran is sorted and adjacent pieces are
+    merged into one vectored write. Once max_bytes are waiting, put()
+    blocks, which stops the calling peer from reading its socket and
+    lets TCP push back on the sender. The limit can be a budget shared
+    with the writers of other downloads.
+    """
+
+    def __init__(self, storage: Storage, max_bytes: int = 64 * 1024 * 1024,
+                 budget: Budget | None = None):
+        self.storage = storage
+        self.budget = budget or Budget(max_bytes)
+        self.pending = []
+        self.writing = []           # the batch the background task is on
+        self.pending_bytes = 0
+        self.queued = 0             # pieces handed to put()
+        self.written = 0            # pieces that reached the storage
+        self.error = None
+        self.closed = False
+        self.condition = asyncio.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self.task = asyncio.create_task(self.run())
+
+    async def put(self, offset: int, data: bytes) -> None:
+        while self.pending_bytes and not self.error and self.budget.free() < len(data):
+            await self.budget.wait()
+        async with self.condition:
+            if self.error:
+                raise self.error
+            self.pending.append((offset, data))
+            self.pending_bytes += len(data)
+            self.budget.take(len(data))
+            self.queued += 1
+            self.condition.notify_all()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: self.pending or self.closed)
+                if not self.pending:
+                    return
+                batch, self.pending = self.pending, []
+                self.writing = batch
+
+            batch.sort(key=lambda item: item[0])
+            runs = [[batch[0][0], [batch[0][1]], len(batch[0][1])]]
+            for offset, data in batch[1:]:
+                run = runs[-1]
+                if run[0] + run[2] == offset:
+                    run[1].append(data)
+                    run[2] += len(data)
+                else:
+                    runs.append([offset, [data], len(data)])
+
+            try:
+                for offset, buffers, length in runs:
+                    started = time.perf_counter()
+                    await loop.run_in_executor(self.executor, self.storage.write, offset, buffers)
+                    DISK_WRITE_SECONDS.observe(time.perf_counter() - started)
+                    DISK_WRITE_BYTES.observe(length)
+            except OSError as e:
+                self.error = e
+
+            async with self.condition:
+                written = sum(length for _, _, length in runs)
+                self.pending_bytes -= written
+                self.budget.give(written)
+                self.written += len(batch)
+                self.writing = []
+                self.condition.notify_all()
+            if self.error:
+                self.budget.give(self.pending_bytes)    # nothing else will be written
+                return
+
+    async def read(self, offset: int, length: int) -> bytes:
+        """Reads bytes back, including pieces that haven't reached the disk.
+
+        Queued pieces are served from memory; everything else is read on
+        the storage thread, after the writes already handed to it.
+        """
+        for start, data in self.pending + self.writing:
+            if start <= offset and offset + length <= start + len(data):
+                return bytes(memoryview(data)[offset - start:offset - start + length])
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.storage.read, offset, length)
+
+    async def sync(self) -> None:
+        """Returns once every piece queued so far is on stable storage."""
+        async with self.condition:
+            target = self.queued
+            await self.condition.wait_for(lambda: self.error or self.written >= target)
+        if self.error:
+            raise self.error
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.storage.flush)
+
+    async def close(self) -> None:
+        """Writes out everything still queued and releases the file."""
+        async with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        await self.task
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.storage.flush)
+        self.executor.shutdown()
+        self.storage.close()
+        if self.error:
+            raise self.error
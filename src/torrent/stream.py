@@ -0,0 +1,83 @@
+import asyncio
+from collections.abc import AsyncIterator
+
+from src.torrent.download import Download
+from src.torrent.storage import Storage, open_storage
+
+
+class Stream:
+    """Reads a download's bytes in order while it is still downloading.
+
+    Every read moves the stream's priority window to the pieces it
+    covers plus the next window pieces, so the picker fetches what the
+    reader needs next before anything else, nearest first. A read
+    returns as soon as its pieces are verified, served from the upload
+    cache, which already holds pieces still queued for disk. Once the
+    torrent has stopped, the stream reads the files itself.
+    """
+
+    def __init__(self, download: Download, window: int = 16, storage_backend: str = "pwrite"):
+        """
+        :param window: Pieces ahead of the reader to prioritize, e.g.
+            enough for a few seconds of playback.
+        """
+        self.download = download
+        self.window = window
+        self.storage_backend = storage_backend
+        self.storage: Storage | None = None     # opened once the torrent's own is closed
+        self.position = 0
+
+    def prioritize(self, offset: int, length: int) -> None:
+        download = self.download
+        first = offset // download.piece_length
+        last = (offset + max(length, 1) - 1) // download.piece_length
+        end = min(max(last + 1, first + self.window), download.total_pieces)
+        download.picker.windows[self] = (first, end)
+
+    def seek(self, offset: int) -> None:
+        self.position = offset
+        self.prioritize(offset, 1)
+
+    async def read(self, offset: int, length: int) -> bytes:
+        """Waits for and returns up to length bytes from offset, fewer at the end of the payload."""
+        download = self.download
+        end = min(offset + length, download.file_size)
+        if offset >= end:
+            return b""
+        self.prioritize(offset, end - offset)
+
+        chunks = []
+        while offset < end:
+            index = offset // download.piece_length
+            piece_start = index * download.piece_length
+            piece_end = min(piece_start + download.piece_length, end)
+            await download.wait_for_piece(index)
+            chunks.append(await self.read_piece(index, offset - piece_start, piece_end - offset))
+            offset = piece_end
+        self.position = end
+        return b"".join(chunks)
+
+    async def read_piece(self, index: int, begin: int, length: int) -> bytes:
+        download = self.download
+        if download.storage is not None and not download.storage.closed:
+            return bytes(await download.cache.block(index, begin, length))
+        if self.storage is None:
+            self.storage = open_storage(download.layout, self.storage_backend)
+        return await asyncio.to_thread(self.storage.read, index * download.piece_length + begin, length)
+
+    async def iter(self, offset: int = 0, end: int | None = None) -> AsyncIterator[bytes]:
+        """Yields the bytes [offset, end) a piece at a time, each as soon as it's verified."""
+        download = self.download
+        end = download.file_size if end is None else min(end, download.file_size)
+        while offset < end:
+            piece_end = min((offset // download.piece_length + 1) * download.piece_length, end)
+            chunk = await self.read(offset, piece_end - offset)
+            offset = piece_end
+            yield chunk
+
+    def close(self) -> None:
+        """Gives up the stream's priority window."""
+        self.download.picker.windows.pop(self, None)
+        if self.storage is not None:
+            self.storage.close()
+            self.storage = None
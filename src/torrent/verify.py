@@ -0,0 +1,78 @@
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from src.metrics.client import HASH_QUEUE_SECONDS, HASH_SECONDS
+
+
+def sha1(data: bytes) -> tuple[bytes, float, float]:
+    """Hashes a piece and reports when the worker started and finished.
+
+    Lives at module level so process pools can pickle it. CLOCK_MONOTONIC
+    is system-wide, so the timestamps are comparable across processes.
+    """
+    started = time.monotonic()
+    digest = hashlib.sha1(data).digest()
+    return digest, started, time.monotonic()
+
+
+class PieceVerifier:
+    """Checks piece hashes on a worker pool instead of the event loop.
+
+    Threads are the default because hashlib releases the GIL while
+    hashing large buffers; a process pool trades a copy of every piece
+    for independence from the GIL. At most max_pending pieces are handed
+    to the pool at once and further callers wait their turn.
+    """
+
+    def __init__(self, workers: int | None = None, kind: str = "thread",
+                 max_pending: int | None = None):
+        workers = workers or os.cpu_count() or 1
+        self.kind = kind
+        if kind == "thread":
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix="sha1")
+        elif kind == "process":
+            self.executor = ProcessPoolExecutor(workers)
+        else:
+            raise ValueError(f"Unknown verifier pool: {kind}")
+        self.slots = asyncio.Semaphore(max_pending or 2 * workers)
+
+        self.in_flight = 0
+        self.hashed = 0
+        self.queue_seconds = 0.0        # submitted -> worker picked it up
+        self.max_queue_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    async def verify(self, data: bytes | memoryview, expected: bytes) -> bool:
+        loop = asyncio.get_running_loop()
+        if self.kind == "process" and not isinstance(data, bytes):
+            data = bytes(data)      # memoryviews can't be pickled
+        submitted = time.monotonic()
+        self.in_flight += 1
+        try:
+            async with self.slots:
+                digest, started, finished = await loop.run_in_executor(self.executor, sha1, data)
+        finally:
+            self.in_flight -= 1
+
+        queued = started - submitted
+        HASH_QUEUE_SECONDS.observe(queued)
+        HASH_SECONDS.observe(finished - started)
+        self.hashed += 1
+        self.queue_seconds += queued
+        self.max_queue_seconds = max(self.max_queue_seconds, queued)
+        self.hash_seconds += finished - started
+        return digest == expected
+
+    def stats(self) -> dict:
+        return {
+            "hashed": self.hashed,
+            "avg_queue_seconds": self.queue_seconds / self.hashed if self.hashed else 0.0,
+            "max_queue_seconds": self.max_queue_seconds,
+            "avg_hash_seconds": self.hash_seconds / self.hashed if self.hashed else 0.0,
+        }
+
+    def close(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,201 @@
+import asyncio
+import contextlib
+import random
+from dataclasses import dataclass
+from urllib.parse import urlencode
+
+import numpy as np
+
+from src.metrics.log import log
+from src.torrent import bencode
+from src.torrent.download import Download
+from src.tracker.endpoints import sock_addr
+from src.tracker.http import HttpClient
+from src.tracker.udp import UdpClient
+
+
+@dataclass
+class Tracker:
+    url: str
+    tracker_id: bytes | None = None
+    failures: int = 0
+
+
+def build_tiers(decoded: dict) -> list[list[Tracker]]:
+    """Groups the torrent's trackers in tiers as described by BEP 12.
+
+    Each tier is shuffled once, and torrents without announce-list get
+    a single tier with their announce URL. Trackerless torrents, which
+    rely on the DHT, have no tiers.
+    """
+    if decoded.get(b"announce-list"):
+        urls = [[url.decode() for url in tier] for tier in decoded[b"announce-list"]]
+    elif decoded.get(b"announce"):
+        urls = [[decoded[b"announce"].decode()]]
+    else:
+        urls = []
+
+    tiers = []
+    for tier in urls:
+        trackers = [Tracker(url) for url in dict.fromkeys(tier)]
+        random.shuffle(trackers)
+        if trackers:
+            tiers.append(trackers)
+    return tiers
+
+
+class Announcer:
+    """Keeps every tracker tier informed and collects peers from them.
+
+    Tiers are announced to concurrently. Within a tier trackers are tried
+    in order and the first one to answer is moved to the front, so it is
+    the one used next time. Each tier re-announces on the interval its
+    tracker asked for, with the current transfer stats, and the peers of
+    every response are put on the peers queue as they arrive. Once the
+    download completes, each tier is woken to announce "completed"
+    straight away instead of waiting for its next interval.
+
+    The HTTP and UDP clients can be shared with other torrents' announcers;
+    only the ones created here are closed by stop().
+    """
+
+    def __init__(self, decoded: dict, download: Download, payload: dict,
+                 peers: asyncio.Queue, http: HttpClient | None = None,
+                 udp: UdpClient | None = None):
+        self.tiers = build_tiers(decoded)
+        self.download = download
+        self.payload = payload
+        self.peers = peers
+        self.http = http or HttpClient()
+        self.udp = udp or UdpClient()
+        self.owned = [client for client, given in ((self.http, http), (self.udp, udp)) if given is None]
+        self.tasks = []
+        self.was_complete = download.left() == 0
+        self.finished = asyncio.Event()     # set when the download completes while running
+        # tiers that don't need "completed", having been told or never needing it
+        self.reported = set(range(len(self.tiers))) if self.was_complete else set()
+
+    def params(self, tracker: Tracker, event: str | None) -> dict:
+        params = {k: v for k, v in self.payload.items() if k != "event"}
+        params["uploaded"] = self.download.bytes_uploaded
+        params["downloaded"] = self.download.bytes_downloaded
+        params["left"] = self.download.left()
+        if event:
+            params["event"] = event
+        if tracker.tracker_id:
+            params["trackerid"] = tracker.tracker_id
+        return params
+
+    async def announce(self, tracker: Tracker, event: str | None) -> dict:
+        if tracker.url.startswith("udp://"):
+            return await self.udp.announce(tracker.url, self.params(tracker, event))
+
+        separator = "&" if "?" in tracker.url else "?"
+        url = tracker.url + separator + urlencode(self.params(tracker, event))
+        status, reason, body = await self.http.get(url)
+
+        response = bencode.decode(body)
+        if not isinstance(response, dict):
+            raise ValueError("tracker response is not a dictionary")
+        if b"failure reason" in response:
+            raise ConnectionError(response[b"failure reason"].decode(errors="replace"))
+        if status != 200:
+            raise ConnectionError(f"[{status}]: {reason}")
+        if b"warning message" in response:
+            log.warning("WARNING", "%s", response[b"warning message"].decode(errors="replace"))
+
+        tracker.tracker_id = response.get(b"tracker id", tracker.tracker_id)
+        return response
+
+    async def announce_tier(self, tier: list[Tracker], event: str | None) -> int | None:
+        """Announces to the first tracker of the tier that answers.
+
+        :returns: Seconds until the next announce, or None if every
+            tracker of the tier failed.
+        """
+        for tracker in list(tier):
+            try:
+                response = await self.announce(tracker, event)
+            except (OSError, EOFError, ValueError, asyncio.TimeoutError, asyncio.LimitOverrunError) as e:
+                tracker.failures += 1
+                log.error("tracker %s: %s", tracker.url, e)
+                continue
+
+            tracker.failures = 0
+            tier.remove(tracker)
+            tier.insert(0, tracker)
+            self.update(response)
+            return max(response.get(b"interval", 1800), response.get(b"min interval", 0), 1)
+        return None
+
+    def update(self, response: dict) -> None:
+        download = self.download
+        download.interval = response.get(b"interval", download.interval)
+        download.complete = response.get(b"complete", download.complete)
+        download.incomplete = response.get(b"incomplete", download.incomplete)
+
+        endpoints = sock_addr(response) if b"peers" in response else []
+        if endpoints:
+            self.peers.put_nowait(endpoints)
+
+    async def tier_loop(self, index: int, tier: list[Tracker]) -> None:
+        event = "started"
+        failures = 0
+        while True:
+            if event == "completed":
+                # counted as sent even if stop() cancels the announce midway
+                self.reported.add(index)
+            delay = await self.announce_tier(tier, event)
+            if delay is None:
+                failures += 1
+                delay = min(60 * 2 ** (failures - 1), 1800)
+                if event == "completed":
+                    self.reported.discard(index)
+            else:
+                failures = 0
+                event = None
+
+            if index in self.reported or self.finished.is_set():
+                await asyncio.sleep(delay)
+            else:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.finished.wait(), delay)
+            if event is None and self.finished.is_set() and index not in self.reported:
+                event = "completed"
+
+    async def watch(self) -> None:
+        """Sets finished once every missing piece is downloaded."""
+        download = self.download
+        for index in np.flatnonzero(~download.downloaded):
+            await download.wait_for_piece(int(index))
+        self.finished.set()
+
+    def start(self) -> None:
+        self.tasks = [asyncio.create_task(self.tier_loop(i, tier)) for i, tier in enumerate(self.tiers)]
+        if not self.was_complete and self.tiers:
+            self.tasks.append(asyncio.create_task(self.watch()))
+
+    async def stop(self, timeout: float = 5) -> None:
+        """Stops re-announcing and says goodbye to the trackers in use.
+
+        Tiers that haven't announced "completed" for a download that
+        finished during this session get it first, then "stopped".
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        complete = self.download.left() == 0
+
+        async def goodbye(index, tracker):
+            if complete and index not in self.reported:
+                await self.announce(tracker, "completed")
+                self.reported.add(index)
+            await self.announce(tracker, "stopped")
+
+        await asyncio.gather(
+            *(asyncio.wait_for(goodbye(i, tier[0]), timeout) for i, tier in enumerate(self.tiers)),
+            return_exceptions=True,
+        )
+        for client in self.owned:
+            client.close()
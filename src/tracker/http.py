@@ -0,0 +1,109 @@
+import asyncio
+import ssl
+from urllib.parse import urlsplit
+
+
+class HttpClient:
+    """Minimal HTTP/1.1 GET client with pooled keep-alive connections.
+
+    Trackers are announced to over and over again, so connections are
+    kept open and reused per (scheme, host, port) instead of paying a
+    TCP (and TLS) handshake for every announce.
+    """
+
+    def __init__(self, timeout: float = 15, max_idle: int = 4):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle: dict[tuple, list] = {}
+        self.ssl_context = None
+
+    async def get(self, url: str, headers: dict[str, str] | None = None) -> tuple[int, str, bytes]:
+        """Fetches url.
+
+        :param headers: Extra request headers, such as Range.
+        :returns: Status code, reason phrase and body.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {parts.scheme}")
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        request = (
+            f"GET {target} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            "User-Agent: Fluxo/0.1\r\n"
+            "Accept-Encoding: identity\r\n"
+            "Connection: keep-alive\r\n"
+            + "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+            + "\r\n"
+        ).encode()
+
+        pooled = self.idle.get(key)
+        while pooled:
+            reader, writer = pooled.pop()
+            try:
+                return await asyncio.wait_for(
+                    self.exchange(key, reader, writer, request), self.timeout
+                )
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()      # the server closed the idle connection
+            except BaseException:
+                writer.close()
+                raise
+
+        reader, writer = await asyncio.wait_for(self.connect(key), self.timeout)
+        try:
+            return await asyncio.wait_for(
+                self.exchange(key, reader, writer, request), self.timeout
+            )
+        except BaseException:
+            writer.close()
+            raise
+
+    async def connect(self, key: tuple):
+        scheme, host, port = key
+        context = None
+        if scheme == "https":
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            context = self.ssl_context
+        return await asyncio.open_connection(host, port, ssl=context)
+
+    async def exchange(self, key, reader, writer, request) -> tuple[int, str, bytes]:
+        writer.write(request)
+        await writer.drain()
+
+        status_line = await reader.readuntil(b"\r\n")
+        _, status, *reason = status_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        reusable = headers.get("connection", "").lower() != "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while size := int((await reader.readuntil(b"\r\n")).split(b";")[0], 16):
+                body += await reader.readexactly(size)
+                await reader.readexactly(2)
+            while await reader.readuntil(b"\r\n") != b"\r\n":
+                pass        # trailers
+            body = bytes(body)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            reusable = False
+
+        pooled = self.idle.setdefault(key, [])
+        if reusable and len(pooled) < self.max_idle:
+            pooled.append((reader, writer))
+        else:
+            writer.close()
+        return int(status), " ".join(reason).strip(), body
+
+    def close(self) -> None:
+        for pooled in self.idle.values():
+            for _, writer in pooled:
+                writer.close()
+        self.idle.clear()
@@ -0,0 +1,178 @@
+import asyncio
+import random
+import socket
+import struct
+import time
+from urllib.parse import urlsplit
+
+PROTOCOL_ID = 0x41727101980
+CONNECT, ANNOUNCE, SCRAPE, ERROR = range(4)
+EVENTS = {None: 0, "completed": 1, "started": 2, "stopped": 3}
+
+REQUEST_HEADER = struct.Struct("!QII")          # connection id, action, transaction id
+HEADER = struct.Struct("!II")                   # action, transaction id
+CONNECT_RESPONSE = struct.Struct("!IIQ")
+ANNOUNCE_REQUEST = struct.Struct("!20s20sQQQIIIiH")
+ANNOUNCE_RESPONSE = struct.Struct("!IIIII")
+
+
+class UdpEndpoint(asyncio.DatagramProtocol):
+    """A single socket shared by every UDP tracker.
+
+    Responses are routed back to their request by transaction id, so
+    any number of announces can be in flight on it at once.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.waiting: dict[int, asyncio.Future] = {}
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if len(data) < HEADER.size:
+            return
+        _, transaction_id = HEADER.unpack_from(data)
+        future = self.waiting.get(transaction_id)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        # ICMP errors can't be tied to a request; the retransmits cover them
+        pass
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(exc or ConnectionError("UDP endpoint closed"))
+
+
+class UdpClient:
+    """Announces to udp:// trackers as described by BEP 15.
+
+    A connection id is valid for a minute, so it is cached per tracker
+    and most announces are a single request/response pair. Lost packets
+    are retransmitted after 15 * 2 ** n seconds; BEP 15 allows n to go up
+    to 8 (about an hour), which is capped by max_retries so a dead
+    tracker doesn't hold up the rest of its tier.
+    """
+
+    CONNECTION_ID_TTL = 60
+
+    def __init__(self, max_retries: int = 3, timeout: float = 15):
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.key = random.getrandbits(32)
+        self.endpoint: UdpEndpoint | None = None
+        self.opening: asyncio.Future | None = None
+        self.connections: dict[tuple, tuple[int, float]] = {}
+
+    async def open(self) -> UdpEndpoint:
+        if self.opening is None:
+            loop = asyncio.get_running_loop()
+            self.opening = asyncio.ensure_future(loop.create_datagram_endpoint(
+                UdpEndpoint, local_addr=("0.0.0.0", 0)
+            ))
+        _, self.endpoint = await self.opening
+        return self.endpoint
+
+    async def request(self, addr: tuple, message: bytes, transaction_id: int) -> bytes:
+        endpoint = await self.open()
+        future = asyncio.get_running_loop().create_future()
+        endpoint.waiting[transaction_id] = future
+        try:
+            for n in range(self.max_retries + 1):
+                endpoint.transport.sendto(message, addr)
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), self.timeout * 2 ** n)
+                except asyncio.TimeoutError:
+                    continue
+            raise asyncio.TimeoutError(f"no response after {self.max_retries + 1} attempts")
+        finally:
+            del endpoint.waiting[transaction_id]
+
+    async def exchange(self, addr: tuple, action: int, body: bytes) -> bytes:
+        """Sends one request and checks the header of its response.
+
+        :param body: The request after its REQUEST_HEADER, which is
+            filled in here.
+        """
+        connection_id = PROTOCOL_ID if action == CONNECT else await self.connection_id(addr)
+        transaction_id = random.getrandbits(32)
+        message = REQUEST_HEADER.pack(connection_id, action, transaction_id) + body
+        response = await self.request(addr, message, transaction_id)
+
+        got, _ = HEADER.unpack_from(response)
+        if got == ERROR:
+            if action != CONNECT:
+                self.connections.pop(addr, None)
+            raise ConnectionError(response[HEADER.size:].decode(errors="replace"))
+        if got != action:
+            raise ValueError(f"unexpected action {got} in tracker response")
+        return response
+
+    async def connection_id(self, addr: tuple) -> int:
+        cached = self.connections.get(addr)
+        if cached and time.monotonic() - cached[1] < self.CONNECTION_ID_TTL:
+            return cached[0]
+        response = await self.exchange(addr, CONNECT, b"")
+        if len(response) < CONNECT_RESPONSE.size:
+            raise ValueError("truncated connect response")
+        connection_id = CONNECT_RESPONSE.unpack_from(response)[2]
+        self.connections[addr] = (connection_id, time.monotonic())
+        return connection_id
+
+    async def announce(self, url: str, params: dict) -> dict:
+        """Announces to a udp:// tracker.
+
+        :param params: The same parameters an HTTP announce gets.
+        :returns: A dictionary shaped like a compact HTTP response, so
+            it can be handled the same way.
+        """
+        parts = urlsplit(url)
+        if not parts.hostname or not parts.port:
+            raise ValueError(f"Invalid UDP tracker URL: {url}")
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(
+            parts.hostname, parts.port, family=socket.AF_INET, type=socket.SOCK_DGRAM
+        )
+        addr = infos[0][4]
+
+        peer_id = params["peer_id"]
+        body = ANNOUNCE_REQUEST.pack(
+            params["info_hash"],
+            peer_id.encode() if isinstance(peer_id, str) else peer_id,
+            params["downloaded"],
+            params["left"],
+            params["uploaded"],
+            EVENTS[params.get("event")],
+            0,                                  # let the tracker use our address
+            self.key,
+            -1,                                 # default number of peers
+            params["port"],
+        )
+        try:
+            response = await self.exchange(addr, ANNOUNCE, body)
+        except asyncio.TimeoutError:
+            self.connections.pop(addr, None)    # the id may have expired on their end
+            raise
+
+        if len(response) < ANNOUNCE_RESPONSE.size:
+            raise ValueError("truncated announce response")
+        _, _, interval, leechers, seeders = ANNOUNCE_RESPONSE.unpack_from(response)
+        peers = response[ANNOUNCE_RESPONSE.size:]
+        return {
+            b"interval": interval,
+            b"incomplete": leechers,
+            b"complete": seeders,
+            b"peers": peers[:len(peers) - len(peers) % 6],
+        }
+
+    def close(self) -> None:
+        if self.endpoint is not None:
+            self.endpoint.transport.close()
+        elif self.opening is not None:
+            self.opening.cancel()
+        self.endpoint = self.opening = None
+        self.connections.clear()